@@ -0,0 +1,348 @@
+import argparse
+import csv
+import os
+import sys
+
+"""
+A command line interface for the ETL, with a subcommand for each step.
+
+The arches_rascoll modules (and pandas, shapely and SQLAlchemy with them) only get
+imported by the subcommands that need them, so quick subcommands (like listing or
+checking the mapping configs) start fast. The --data-dir and --db-url options set the
+RASCOLL_ETL_DIR and ARCHES_DB_URL environment variables before general_configs gets
+imported, since it works out all of its paths (and the database URL) on import.
+
+# Use like this in a shell (from the directory with the data directory, or with --data-dir):
+
+python -m arches_rascoll configs
+python -m arches_rascoll validate --check-headers
+python -m arches_rascoll entities
+python -m arches_rascoll stage --loader copy --artifact-format parquet
+python -m arches_rascoll sql
+python -m arches_rascoll execute --batch-size 5000
+python -m arches_rascoll benchmark --sizes 10000 100000
+
+"""
+
+
+def set_environment(args):
+    """Sets the environment variables that general_configs reads on import"""
+    if args.data_dir:
+        os.environ['RASCOLL_ETL_DIR'] = os.path.abspath(args.data_dir)
+    if args.db_url:
+        os.environ['ARCHES_DB_URL'] = args.db_url
+
+
+def get_general_configs(args):
+    """Imports general_configs, and sets the configs given as options"""
+    from arches_rascoll import general_configs
+
+    if getattr(args, 'deterministic_uuids', False):
+        general_configs.DETERMINISTIC_UUIDS = True
+    return general_configs
+
+
+def get_all_configs(general_configs, staging_tables=None):
+    """Gets the mapping configs, or just those for the given staging tables"""
+    if not staging_tables:
+        return general_configs.ALL_MAPPING_CONFIGS
+    all_configs = [
+        configs for configs in general_configs.ALL_MAPPING_CONFIGS
+        if configs.get('staging_table') in staging_tables
+    ]
+    found = [configs.get('staging_table') for configs in all_configs]
+    unknown = [staging_table for staging_table in staging_tables if staging_table not in found]
+    if unknown:
+        raise SystemExit(f'Unknown staging tables: {unknown}')
+    return all_configs
+
+
+def read_csv_header(path):
+    """Reads the column names of a CSV file (without pandas)"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+
+def start_instrumentation(args):
+    """Starts an instrumentation report, if asked for"""
+    if not args.instrument:
+        return
+    from arches_rascoll import instrumentation
+
+    instrumentation.start_report(profile_stage=args.profile_stage)
+
+
+def save_instrumentation(args, general_configs):
+    """Saves the instrumentation report, if one was started"""
+    if not args.instrument:
+        return
+    from arches_rascoll import instrumentation
+
+    instrumentation.save_report(sql_path=general_configs.ARCHES_INSERT_SQL_PATH)
+
+
+def run_configs(args):
+    """Lists the mapping configs"""
+    general_configs = get_general_configs(args)
+    print(f'Data directory: {general_configs.DATA_DIR}')
+    for configs in get_all_configs(general_configs, args.staging_tables):
+        source = configs.get('load_path') or general_configs.RAW_IMPORT_CSV
+        print(
+            f"{configs.get('staging_table')}: {len(configs.get('mappings', []))} mappings "
+            f"into {configs.get('model_staging_schema')}, from {os.path.basename(source)}"
+        )
+    return 0
+
+
+def run_validate(args):
+    """Compiles (and so checks) the mapping configs, and optionally checks the input headers"""
+    general_configs = get_general_configs(args)
+    from arches_rascoll import mapping_plans
+
+    all_configs = get_all_configs(general_configs, args.staging_tables)
+    try:
+        plans = mapping_plans.compile_staging_plans(all_configs)
+    except ValueError as e:
+        print(e)
+        return 1
+    problems = 0
+    for plan in plans:
+        if not args.check_headers:
+            print(f'{plan.staging_table}: OK ({len(plan.mappings)} mappings)')
+            continue
+        input_path = plan.load_path or args.raw_path or general_configs.RAW_IMPORT_CSV
+        if not os.path.exists(input_path):
+            print(f'{plan.staging_table}: input not found (not prepared yet?): {input_path}')
+            continue
+        try:
+            mapping_plans.validate_raw_columns(plan, read_csv_header(input_path))
+        except ValueError as e:
+            print(e)
+            problems += 1
+            continue
+        print(f'{plan.staging_table}: OK ({len(plan.mappings)} mappings, columns of {os.path.basename(input_path)})')
+    return 1 if problems else 0
+
+
+def run_entities(args):
+    """Prepares and saves the persons, groups, places, sets and provenance activities"""
+    general_configs = get_general_configs(args)
+    from arches_rascoll import entity_registry
+
+    start_instrumentation(args)
+    entity_registry.prepare_all_entity_data(
+        raw_path=(args.raw_path or general_configs.RAW_IMPORT_CSV),
+        merge_distance=(args.merge_distance or general_configs.PLACE_MERGE_DISTANCE),
+    )
+    save_instrumentation(args, general_configs)
+    return 0
+
+
+def run_stage(args):
+    """Prepares, saves and loads the staging tables"""
+    general_configs = get_general_configs(args)
+    from arches_rascoll import ref_collection
+
+    kwargs = {
+        'raw_path': (args.raw_path or general_configs.RAW_IMPORT_CSV),
+        'all_configs': get_all_configs(general_configs, args.staging_tables),
+        'regenerate': args.regenerate,
+        'columnar_mode': (not args.row_wise),
+        'chunksize': args.chunksize,
+        'loader': args.loader,
+        'incremental': args.incremental,
+        'delta': args.delta,
+    }
+    if args.ewkb:
+        kwargs['ewkb_geometry'] = True
+    if args.artifact_format:
+        kwargs['artifact_format'] = args.artifact_format
+    start_instrumentation(args)
+    if args.with_entities:
+        from arches_rascoll import entity_registry
+
+        kwargs['registry'] = entity_registry.prepare_all_entity_data(raw_path=kwargs['raw_path'])
+    ref_collection.prepare_all_transformed_data(**kwargs)
+    save_instrumentation(args, general_configs)
+    return 0
+
+
+def get_sql_kwargs(args):
+    """Gets the kwargs for making the SQL statements"""
+    kwargs = {
+        'add_tile_update_sqls': args.add_tile_update_sqls,
+    }
+    if args.ewkb:
+        kwargs['ewkb_geometry'] = True
+    return kwargs
+
+
+def run_sql(args):
+    """Prepares the SQL statements to load the staging data into Arches, and saves them"""
+    general_configs = get_general_configs(args)
+    from arches_rascoll import ref_collection
+
+    start_instrumentation(args)
+    sqls = ref_collection.prepare_all_sql_inserts(
+        all_configs=get_all_configs(general_configs, args.staging_tables),
+        add_update_sqls=args.add_update_sqls,
+        sql_path=(args.sql_path or general_configs.ARCHES_INSERT_SQL_PATH),
+        **get_sql_kwargs(args),
+    )
+    print(f'Prepared {len(sqls)} SQL statements')
+    save_instrumentation(args, general_configs)
+    return 0
+
+
+def run_execute(args):
+    """Prepares and executes the SQL statements to load the staging data into Arches"""
+    general_configs = get_general_configs(args)
+    from arches_rascoll import sql_executor
+
+    sql_executor.execute_all_sql_inserts(
+        db_url=general_configs.ARCHES_DB_URL,
+        per_model_transactions=args.per_model_transactions,
+        batch_size=args.batch_size,
+        delta=args.delta,
+        all_configs=get_all_configs(general_configs, args.staging_tables),
+        **get_sql_kwargs(args),
+    )
+    return 0
+
+
+def run_benchmark(args):
+    """Runs the benchmark suite on synthetic raw data"""
+    get_general_configs(args)
+    from arches_rascoll import benchmarks
+
+    kwargs = {
+        'measure_memory': (not args.no_memory),
+        'trace_allocations': args.trace_allocations,
+        'seed': args.seed,
+    }
+    if args.sizes:
+        kwargs['sizes'] = args.sizes
+    if args.bench_dir:
+        kwargs['bench_dir'] = args.bench_dir
+    benchmarks.run_benchmark_suite(**kwargs)
+    return 0
+
+
+def add_staging_tables_arg(parser):
+    parser.add_argument(
+        '--staging-tables',
+        nargs='+',
+        help='Only use the mapping configs of these staging tables',
+    )
+
+
+def add_instrument_args(parser):
+    parser.add_argument(
+        '--instrument',
+        action='store_true',
+        help='Save an instrumentation report (etl_instrumentation.json) next to etl_sql.txt',
+    )
+    parser.add_argument(
+        '--profile-stage',
+        help="Run this stage (like 'prep_transformed_data:provenance_activity') under cProfile",
+    )
+
+
+def add_sql_args(parser):
+    parser.add_argument('--ewkb', action='store_true', help='Expect geometries staged as hex encoded EWKB')
+    parser.add_argument('--add-tile-update-sqls', action='store_true', help='Also update the tile data of tiles')
+
+
+def make_parser():
+    """Makes the argument parser, with a sub-parser for each subcommand"""
+    parser = argparse.ArgumentParser(
+        prog='python -m arches_rascoll',
+        description='ETL of legacy reference and sample collection data into Arches',
+    )
+    parser.add_argument('--data-dir', help='The data directory (sets RASCOLL_ETL_DIR)')
+    parser.add_argument('--db-url', help='The Arches database URL (sets ARCHES_DB_URL)')
+    parser.add_argument(
+        '--deterministic-uuids',
+        action='store_true',
+        help='Make UUIDs from natural keys (sets general_configs.DETERMINISTIC_UUIDS)',
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    configs_parser = subparsers.add_parser('configs', help='List the mapping configs')
+    add_staging_tables_arg(configs_parser)
+    configs_parser.set_defaults(func=run_configs)
+
+    validate_parser = subparsers.add_parser('validate', help='Check the mapping configs')
+    add_staging_tables_arg(validate_parser)
+    validate_parser.add_argument(
+        '--check-headers',
+        action='store_true',
+        help='Also check the input CSV files have the columns the configs need',
+    )
+    validate_parser.add_argument('--raw-path', help='The raw data CSV')
+    validate_parser.set_defaults(func=run_validate)
+
+    entities_parser = subparsers.add_parser('entities', help='Prepare the entity data (persons, groups, places, etc.)')
+    entities_parser.add_argument('--raw-path', help='The raw data CSV')
+    entities_parser.add_argument('--merge-distance', type=float, help='Merge places within this distance (degrees)')
+    add_instrument_args(entities_parser)
+    entities_parser.set_defaults(func=run_entities)
+
+    stage_parser = subparsers.add_parser('stage', help='Prepare and load the staging tables')
+    add_staging_tables_arg(stage_parser)
+    stage_parser.add_argument('--raw-path', help='The raw data CSV')
+    stage_parser.add_argument('--regenerate', action='store_true', help='Ignore previously prepared staging data')
+    stage_parser.add_argument('--row-wise', action='store_true', help='Use the (slower) row-wise transform')
+    stage_parser.add_argument('--chunksize', type=int, help='Stream the data in chunks of this many rows')
+    stage_parser.add_argument('--loader', choices=['to_sql', 'copy'], default='to_sql')
+    stage_parser.add_argument('--incremental', action='store_true', help='Only rebuild staging tables with changed inputs')
+    stage_parser.add_argument('--delta', action='store_true', help='Only stage raw records added or changed since the last load')
+    stage_parser.add_argument('--ewkb', action='store_true', help='Stage geometries as hex encoded EWKB')
+    stage_parser.add_argument('--artifact-format', choices=['csv', 'parquet'])
+    stage_parser.add_argument(
+        '--with-entities',
+        action='store_true',
+        help='Prepare the entity data first, and stage it from memory',
+    )
+    add_instrument_args(stage_parser)
+    stage_parser.set_defaults(func=run_stage)
+
+    sql_parser = subparsers.add_parser('sql', help='Prepare and save the SQL statements')
+    add_staging_tables_arg(sql_parser)
+    add_sql_args(sql_parser)
+    sql_parser.add_argument('--add-update-sqls', action='store_true', help='Also update tiles already in Arches')
+    sql_parser.add_argument('--sql-path', help='Where to save the SQL statements')
+    add_instrument_args(sql_parser)
+    sql_parser.set_defaults(func=run_sql)
+
+    execute_parser = subparsers.add_parser('execute', help='Prepare and execute the SQL statements')
+    add_staging_tables_arg(execute_parser)
+    add_sql_args(execute_parser)
+    execute_parser.add_argument('--per-model-transactions', action='store_true')
+    execute_parser.add_argument('--batch-size', type=int, help='Commit inserts in batches of this many resources')
+    execute_parser.add_argument('--delta', action='store_true', help='Execute a delta load')
+    execute_parser.set_defaults(func=run_execute)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Run the benchmark suite on synthetic data')
+    benchmark_parser.add_argument('--sizes', type=int, nargs='+', help='The numbers of synthetic raw rows')
+    benchmark_parser.add_argument('--bench-dir', help='Where to save the benchmark files and results')
+    benchmark_parser.add_argument('--no-memory', action='store_true', help="Don't measure memory use")
+    benchmark_parser.add_argument(
+        '--trace-allocations',
+        action='store_true',
+        help='Also run each stage under tracemalloc to measure its peak memory allocations',
+    )
+    benchmark_parser.add_argument('--seed', type=int, default=0)
+    benchmark_parser.set_defaults(func=run_benchmark)
+    return parser
+
+
+def main(argv=None):
+    """Runs a subcommand, and returns the exit status"""
+    args = make_parser().parse_args(argv)
+    set_environment(args)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,574 @@
+import datetime
+import os
+import platform
+import time
+import tracemalloc
+import uuid as GenUUID
+
+import numpy as np
+import pandas as pd
+
+from arches_rascoll import general_configs
+from arches_rascoll import groups
+from arches_rascoll import instrumentation
+from arches_rascoll import json_encoding
+from arches_rascoll import persons
+from arches_rascoll import places
+from arches_rascoll import prov_acts
+from arches_rascoll import ref_collection
+from arches_rascoll import sets
+from arches_rascoll import staging_artifacts
+from arches_rascoll import utilities
+
+"""
+Benchmarks for the slower steps of the ETL, run against synthetic data so we can see
+how they scale well beyond the size of the current raw data.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import benchmarks
+results = benchmarks.benchmark_prep_raw_geo_data()
+results = benchmarks.benchmark_merge_nearby_places()
+results = benchmarks.benchmark_name_lookups()
+
+# Or, run the whole suite (each stage of the ETL on synthetic raw data of 10k, 100k and
+# 1M rows), which saves the results as JSON in the BENCHMARK_DIR:
+results = benchmarks.run_benchmark_suite()
+
+"""
+
+# The directory for the files made by the benchmark suite, so they don't replace
+# the real ETL files in the DATA_DIR.
+BENCHMARK_DIR = os.path.join(general_configs.DATA_DIR, 'benchmarks')
+BENCHMARK_RESULTS_PREFIX = 'benchmark_results'
+
+# The numbers of synthetic raw rows to run the benchmark suite with.
+RAW_BENCHMARK_SIZES = [10000, 100000, 1000000]
+
+# Vocabularies for making synthetic raw data.
+SYNTHETIC_MATERIALS = [
+    'Azurite', 'Beeswax', 'Carmine', 'Gamboge', 'Gum Arabic', 'Indigo', 'Lead White',
+    'Madder Lake', 'Malachite', 'Ochre', 'Shellac', 'Ultramarine', 'Verdigris', 'Vermilion',
+]
+SYNTHETIC_PHYSICAL_FORMS = ['Crystals', 'Liquid', 'Lump', 'Paste', 'Powder', 'Solid']
+SYNTHETIC_FIRST_NAMES = [
+    'Ana', 'Ben', 'Carla', 'David', 'Elena', 'Frank', 'Grace', 'Hiro', 'Irene', 'Jorge',
+    'Kofi', 'Lena', 'Mei', 'Nadia', 'Omar', 'Paula',
+]
+SYNTHETIC_LAST_NAMES = [
+    'Alvarez', 'Brown', 'Chen', 'Dubois', 'Eze', 'Fischer', 'Garcia', 'Haddad', 'Ito',
+    'Jensen', 'Kumar', 'Lopez', 'Moreau', 'Nguyen', 'Okafor', 'Rossi',
+]
+SYNTHETIC_CITIES = [
+    'Amsterdam', 'Berlin', 'Cairo', 'Delhi', 'Florence', 'Kyoto', 'Lima', 'London',
+    'Los Angeles', 'Madrid', 'Mexico City', 'Paris', 'Rome', 'Vienna',
+]
+SYNTHETIC_INSTITUTION_KINDS = ['Museum', 'University', 'Institute', 'Laboratory', 'Pigment Company', 'Society']
+SYNTHETIC_NFPA_VALUES = ['0', '1', '2', '3', '4']
+SYNTHETIC_NFPA_OTHER_VALUES = ['C', 'OX', 'SA', 'W']
+
+# The numbers of raw place rows to benchmark with.
+GEO_BENCHMARK_SIZES = [10000, 100000, 1000000]
+
+# The numbers of acquisition rows to benchmark name lookups with.
+NAME_LOOKUP_BENCHMARK_SIZES = [10000, 100000, 500000]
+
+# The (name column, id column) pairs resolved against the persons and the groups,
+# like in prov_acts.prepare_save_prov_acts_data.
+PERSON_NAME_ID_COLS = [
+    ('Acquired By (CLEAN_1)', 'acq_by_person_1_uuid'),
+    ('Acquired By (CLEAN_2)', 'acq_by_person_2_uuid'),
+]
+GROUP_NAME_ID_COLS = [
+    ('Acquired By (Institution_1)', 'acq_by_group_1_uuid'),
+    ('Acquired By (Institution_2)', 'acq_by_group_2_uuid'),
+    ('Acquired From (CLEAN_1)', 'acq_from_group_1_uuid'),
+    ('Acquired From (CLEAN_2)', 'acq_from_group_2_uuid'),
+]
+
+
+def make_synthetic_geo_df(size, unique_ratio=0.5, seed=0):
+    """Makes a dataframe of raw place data (like the raw data's place columns)
+
+    About unique_ratio of the rows have a distinct specific_place_uri; the rest
+    repeat places from earlier rows, as objects from the same locality do.
+    """
+    rng = np.random.default_rng(seed)
+    n_places = max(1, int(size * unique_ratio))
+    df = pd.DataFrame()
+    for suffix in ['', '_2']:
+        place_ids = rng.integers(0, n_places, size=size)
+        lats = (rng.random(n_places) * 180.0) - 90.0
+        lons = (rng.random(n_places) * 360.0) - 180.0
+        df[f'specific_place{suffix}'] = [f'Place {i}' for i in place_ids]
+        df[f'specific_place_uri{suffix}'] = [f'https://example.org/places/{i}' for i in place_ids]
+        df[f'latitude{suffix}'] = lats[place_ids]
+        df[f'longitude{suffix}'] = lons[place_ids]
+        df[f'specific_geojson{suffix}'] = 'point'
+    if size > 1:
+        # Some raw rows don't have a second place.
+        no_second = rng.random(size) < 0.75
+        for col in ['specific_place_2', 'specific_place_uri_2', 'specific_geojson_2']:
+            df.loc[no_second, col] = np.nan
+    return df
+
+
+def benchmark_prep_raw_geo_data(sizes=GEO_BENCHMARK_SIZES):
+    """Times places.prep_raw_geo_data on synthetic raw data of different sizes"""
+    results = []
+    for size in sizes:
+        df = make_synthetic_geo_df(size)
+        start = time.time()
+        df_all_geo = places.prep_raw_geo_data(df)
+        seconds = time.time() - start
+        result = {
+            'rows': size,
+            'places': len(df_all_geo.index),
+            'seconds': seconds,
+            'rows_per_sec': (size / seconds) if seconds > 0 else float(size),
+        }
+        print(
+            f"prep_raw_geo_data: {result['rows']} rows -> {result['places']} places "
+            f"in {result['seconds']:.2f} seconds ({result['rows_per_sec']:.0f} rows per second)"
+        )
+        results.append(result)
+    return results
+
+
+def benchmark_merge_nearby_places(sizes=GEO_BENCHMARK_SIZES, merge_distance=0.001):
+    """Times places.merge_nearby_places on synthetic places of different sizes"""
+    results = []
+    for size in sizes:
+        df_all_geo = places.prep_raw_geo_data(make_synthetic_geo_df(size), merge_distance=None)
+        start = time.time()
+        df_merged = places.merge_nearby_places(df_all_geo, merge_distance)
+        seconds = time.time() - start
+        result = {
+            'places': len(df_all_geo.index),
+            'merged_places': df_merged['place_uuid'].nunique(),
+            'seconds': seconds,
+        }
+        print(
+            f"merge_nearby_places: {result['places']} places -> {result['merged_places']} places "
+            f"in {result['seconds']:.2f} seconds"
+        )
+        results.append(result)
+    return results
+
+
+def make_synthetic_name_lookup_dfs(size, n_persons=50, n_groups=700, null_ratio=0.6, seed=0):
+    """Makes a dataframe of acquisition rows with person and group names, and the
+    persons and groups lookup dataframes for those names
+    """
+    rng = np.random.default_rng(seed)
+    df_persons = pd.DataFrame(
+        {
+            'person_uuid': [utilities.make_uuid('person', i) for i in range(n_persons)],
+            'person_name': [f'Person {i}' for i in range(n_persons)],
+        }
+    )
+    df_groups = pd.DataFrame(
+        {
+            'group_uuid': [utilities.make_uuid('group', i) for i in range(n_groups)],
+            'group_name': [f'Group {i}' for i in range(n_groups)],
+        }
+    )
+    df = pd.DataFrame({'rsci_uuid': [f'rsci-{i}' for i in range(size)]})
+    for name_cols, names in [
+        ([c for c, _ in PERSON_NAME_ID_COLS], df_persons['person_name'].to_numpy()),
+        ([c for c, _ in GROUP_NAME_ID_COLS], df_groups['group_name'].to_numpy()),
+    ]:
+        for name_col in name_cols:
+            values = names[rng.integers(0, len(names), size=size)].astype(object)
+            # Some names are not in the lookups.
+            values[rng.random(size) < 0.05] = 'Unknown name'
+            values[rng.random(size) < null_ratio] = np.nan
+            df[name_col] = values
+    return df, df_persons, df_groups
+
+
+def resolve_names_with_merges(df, df_persons, df_groups):
+    """Resolves names to UUIDs with a chain of merges (the way prov_acts used to)"""
+    for name_col, id_col in PERSON_NAME_ID_COLS:
+        df = df.merge(df_persons, how='left', left_on=name_col, right_on='person_name')
+        df.drop(columns=['person_name'], inplace=True)
+        df.rename(columns={'person_uuid': id_col}, inplace=True)
+        null_index = df[id_col].isnull()
+        df.loc[null_index, id_col] = ''
+    for name_col, id_col in GROUP_NAME_ID_COLS:
+        df = df.merge(df_groups, how='left', left_on=name_col, right_on='group_name')
+        df.drop(columns=['group_name'], inplace=True)
+        df.rename(columns={'group_uuid': id_col}, inplace=True)
+        null_index = df[id_col].isnull()
+        df.loc[null_index, id_col] = ''
+    return df
+
+
+def resolve_names_with_lookups(df, df_persons, df_groups):
+    """Resolves names to UUIDs with lookup indexes (the way prov_acts does now)"""
+    df = df.copy()
+    persons_index = utilities.make_lookup_index(df_persons, 'person_name', 'person_uuid')
+    for name_col, id_col in PERSON_NAME_ID_COLS:
+        df[id_col] = utilities.lookup_values(df[name_col], persons_index)
+    groups_index = utilities.make_lookup_index(df_groups, 'group_name', 'group_uuid')
+    for name_col, id_col in GROUP_NAME_ID_COLS:
+        df[id_col] = utilities.lookup_values(df[name_col], groups_index)
+    return df
+
+
+def benchmark_name_lookups(sizes=NAME_LOOKUP_BENCHMARK_SIZES):
+    """Compares resolving names to UUIDs with a chain of merges and with lookup indexes"""
+    id_cols = [c for _, c in PERSON_NAME_ID_COLS + GROUP_NAME_ID_COLS]
+    results = []
+    for size in sizes:
+        df, df_persons, df_groups = make_synthetic_name_lookup_dfs(size)
+        start = time.time()
+        df_merged = resolve_names_with_merges(df, df_persons, df_groups)
+        merge_seconds = time.time() - start
+        start = time.time()
+        df_looked_up = resolve_names_with_lookups(df, df_persons, df_groups)
+        lookup_seconds = time.time() - start
+        same = df_merged[id_cols].astype(str).reset_index(drop=True).equals(
+            df_looked_up[id_cols].astype(str).reset_index(drop=True)
+        )
+        result = {
+            'rows': size,
+            'merge_seconds': merge_seconds,
+            'lookup_seconds': lookup_seconds,
+            'speedup': (merge_seconds / lookup_seconds) if lookup_seconds > 0 else None,
+            'same_results': same,
+        }
+        print(
+            f"name lookups: {size} rows, merges {merge_seconds:.2f} seconds, "
+            f"lookups {lookup_seconds:.2f} seconds (same results: {same})"
+        )
+        results.append(result)
+    return results
+
+
+def pick_values(rng, values, size, missing_ratio=0.0):
+    """Picks values at random (as an object array), with about missing_ratio of them missing"""
+    picked = np.array(values, dtype=object)[rng.integers(0, len(values), size=size)]
+    if missing_ratio:
+        picked[rng.random(size) < missing_ratio] = np.nan
+    return picked
+
+
+def make_synthetic_institution_names(n_institutions):
+    """Makes names of institutions (like 'Paris Museum' or 'Kyoto Institute 2')"""
+    names = []
+    for i in range(n_institutions):
+        city = SYNTHETIC_CITIES[i % len(SYNTHETIC_CITIES)]
+        kind = SYNTHETIC_INSTITUTION_KINDS[(i // len(SYNTHETIC_CITIES)) % len(SYNTHETIC_INSTITUTION_KINDS)]
+        name = f'{city} {kind}'
+        repeat = i // (len(SYNTHETIC_CITIES) * len(SYNTHETIC_INSTITUTION_KINDS))
+        if repeat:
+            name += f' {repeat + 1}'
+        names.append(name)
+    return names
+
+
+def make_synthetic_raw_df(size, seed=0):
+    """Makes a dataframe shaped like the raw data (gci-all-orig.csv), with all the raw
+    columns that the ETL uses (see: raw_data.get_raw_cols)
+
+    The values are strings (as raw_data.load_raw_data reads them), apart from the
+    coordinates. About 1 row in 20 names an institution, so the number of groups
+    grows with the size, as it does in the real data.
+    """
+    rng = np.random.default_rng(seed)
+    uuid_bytes = rng.bytes(16 * size)
+    barcodes = rng.choice(size * 3, size=size, replace=False) + 1
+    df = pd.DataFrame(
+        {
+            'rsci_uuid': [
+                str(GenUUID.UUID(bytes=uuid_bytes[(i * 16):((i + 1) * 16)], version=4)) for i in range(size)
+            ],
+            'Barcode No.': barcodes.astype(str).astype(object),
+        }
+    )
+    materials = pick_values(rng, SYNTHETIC_MATERIALS, size)
+    numbers = rng.integers(1, 500, size=size)
+    df['Common Name'] = [f'{material} {number}' for material, number in zip(materials, numbers)]
+    df['Additional Names'] = pick_values(rng, [f'{m} (sample)' for m in SYNTHETIC_MATERIALS], size, 0.6)
+    df['Notes'] = pick_values(rng, [f'Received as {f.lower()}, stored in glass vial' for f in SYNTHETIC_PHYSICAL_FORMS], size, 0.5)
+    df['Physical Form'] = pick_values(rng, SYNTHETIC_PHYSICAL_FORMS, size, 0.3)
+    person_names = [f'{first} {last}' for first in SYNTHETIC_FIRST_NAMES for last in SYNTHETIC_LAST_NAMES]
+    df['Acquired By (CLEAN_1)'] = pick_values(rng, person_names, size, 0.5)
+    df['Acquired By (CLEAN_2)'] = pick_values(rng, person_names, size, 0.9)
+    institution_names = make_synthetic_institution_names(max(100, size // 20))
+    df['Acquired By (Institution_1)'] = pick_values(rng, institution_names, size, 0.5)
+    df['Acquired By (Institution_2)'] = pick_values(rng, institution_names, size, 0.95)
+    df['Acquired From (CLEAN_1)'] = pick_values(rng, institution_names, size, 0.4)
+    df['Acquired From (CLEAN_2)'] = pick_values(rng, institution_names, size, 0.9)
+    df['Manufacturer (CLEAN)'] = pick_values(rng, institution_names, size, 0.6)
+    df['Fire Safety'] = pick_values(rng, SYNTHETIC_NFPA_VALUES, size, 0.4)
+    df['Health Safety'] = pick_values(rng, SYNTHETIC_NFPA_VALUES, size, 0.4)
+    df['Other Safety'] = pick_values(rng, SYNTHETIC_NFPA_OTHER_VALUES, size, 0.9)
+    df['Reactivity Safety'] = pick_values(rng, SYNTHETIC_NFPA_VALUES, size, 0.4)
+    # Acquisition dates are year ranges, and about 60 percent of the rows don't have one.
+    begin_years = rng.integers(1900, 2020, size=size)
+    end_years = begin_years + rng.integers(0, 6, size=size)
+    no_date = rng.random(size) < 0.6
+    for col, years, month_day in [
+        ('Acquisition Date__begin_of_the_begin', begin_years, '01-01'),
+        ('Acquisition Date__end_of_the_begin', begin_years, '12-31'),
+        ('Acquisition Date__begin_of_the_end', end_years, '01-01'),
+        ('Acquisition Date__end_of_the_end', end_years, '12-31'),
+    ]:
+        dates = np.array([f'{year}-{month_day}' for year in years], dtype=object)
+        dates[no_date] = np.nan
+        df[col] = dates
+    df_geo = make_synthetic_geo_df(size, seed=seed)
+    for col in df_geo.columns.tolist():
+        df[col] = df_geo[col].to_numpy()
+    return df
+
+
+def save_synthetic_raw_csv(size, path, seed=0):
+    """Saves synthetic raw data as a CSV file (to use as the RAW_IMPORT_CSV)"""
+    df = make_synthetic_raw_df(size, seed=seed)
+    df.to_csv(path, index=False)
+    return path
+
+
+def get_result_rows(result):
+    """Gets the number of rows in the result of a stage function, if it has rows"""
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, pd.DataFrame):
+        return len(result.index)
+    if isinstance(result, list):
+        return len(result)
+    return None
+
+
+def measure_stage(name, func, rows_in=None, measure_memory=True, trace_allocations=False, **kwargs):
+    """Times a stage function and measures its memory use in the same run
+
+    The memory use is the growth of the resident memory (RSS) over the run, and how
+    much the run raised the peak RSS of the process. With trace_allocations, the
+    stage also runs a second time under tracemalloc (which slows things down too much
+    to time) to measure its peak memory allocations. Returns the result and a record
+    of the measurements.
+    """
+    rss_start = instrumentation.get_current_rss_mb() if measure_memory else None
+    peak_rss_start = instrumentation.get_peak_rss_mb() if measure_memory else None
+    start = time.time()
+    result = func(**kwargs)
+    seconds = time.time() - start
+    rss_growth_mb = None
+    peak_rss_growth_mb = None
+    if measure_memory:
+        rss_end = instrumentation.get_current_rss_mb()
+        if rss_start is not None and rss_end is not None:
+            rss_growth_mb = rss_end - rss_start
+        peak_rss_end = instrumentation.get_peak_rss_mb()
+        if peak_rss_end is not None:
+            peak_rss_growth_mb = peak_rss_end - peak_rss_start
+    peak_memory_mb = None
+    if trace_allocations:
+        tracemalloc.start()
+        try:
+            func(**kwargs)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_memory_mb = peak_memory / (1024 * 1024)
+    record = {
+        'stage': name,
+        'rows_in': rows_in,
+        'rows_out': get_result_rows(result),
+        'seconds': seconds,
+        'rows_per_sec': (rows_in / seconds) if (rows_in and seconds > 0) else None,
+        'rss_growth_mb': rss_growth_mb,
+        'peak_rss_growth_mb': peak_rss_growth_mb,
+        'peak_memory_mb': peak_memory_mb,
+    }
+    memory_str = ''
+    if rss_growth_mb is not None:
+        memory_str += f', RSS {rss_growth_mb:+.1f} MB'
+    if peak_memory_mb is not None:
+        memory_str += f', peak allocations {peak_memory_mb:.1f} MB'
+    print(f"{name}: {rows_in} rows in {seconds:.2f} seconds{memory_str}")
+    return result, record
+
+
+def make_benchmark_path(path, bench_dir=BENCHMARK_DIR):
+    """Makes the path in the benchmark directory for one of the ETL's data files"""
+    return utilities.make_full_path_filename(bench_dir, os.path.basename(path))
+
+
+def make_benchmark_configs(all_configs=general_configs.ALL_MAPPING_CONFIGS, bench_dir=BENCHMARK_DIR):
+    """Makes copies of the mapping configs that load from the benchmark directory"""
+    bench_configs = []
+    for configs in all_configs:
+        if configs.get('load_path'):
+            configs = dict(configs, load_path=make_benchmark_path(configs.get('load_path'), bench_dir))
+        bench_configs.append(configs)
+    return bench_configs
+
+
+def benchmark_raw_size(
+    size,
+    bench_dir=BENCHMARK_DIR,
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    artifact_formats=None,
+    measure_memory=True,
+    trace_allocations=False,
+    seed=0,
+):
+    """Runs and measures each stage of the ETL on synthetic raw data of a given size"""
+    if artifact_formats is None:
+        artifact_formats = ['csv']
+        if staging_artifacts.pa is not None:
+            artifact_formats.append('parquet')
+    records = []
+    df, record = measure_stage(
+        'make_synthetic_raw_df',
+        make_synthetic_raw_df,
+        measure_memory=False,
+        size=size,
+        seed=seed,
+    )
+    records.append(record)
+    geo_path = make_benchmark_path(general_configs.IMPORT_PLACES_CSV, bench_dir)
+    persons_path = make_benchmark_path(general_configs.IMPORT_RAW_PERSON_CSV, bench_dir)
+    groups_path = make_benchmark_path(general_configs.IMPORT_RAW_GROUP_CSV, bench_dir)
+    df_all_geo, record = measure_stage(
+        'prep_raw_geo_data',
+        places.prep_raw_geo_data,
+        rows_in=size,
+        measure_memory=measure_memory,
+        trace_allocations=trace_allocations,
+        df=df,
+    )
+    records.append(record)
+    # Save the rest of the entity data that the mapping configs load.
+    df_all_geo.to_csv(geo_path, index=False)
+    places.prepare_rsci_place_data(
+        df,
+        geo_path=geo_path,
+        rsci_geo_path=make_benchmark_path(general_configs.IMPORT_RSCI_PLACES_CSV, bench_dir),
+    )
+    persons.prepare_save_persons_data(df, save_path=persons_path)
+    groups.prepare_save_groups_data(df=groups.get_groups_from_raw_data(df=df), save_path=groups_path)
+    sets.prepare_save_sets_data(save_path=make_benchmark_path(general_configs.IMPORT_RAW_SET_CSV, bench_dir))
+    _, record = measure_stage(
+        'prepare_rsci_group_safety_data',
+        groups.prepare_rsci_group_safety_data,
+        rows_in=size,
+        measure_memory=measure_memory,
+        trace_allocations=trace_allocations,
+        df=df,
+        rsci_safety_path=make_benchmark_path(general_configs.IMPORT_RSCI_GROUPS_SAFTEY_CSV, bench_dir),
+    )
+    records.append(record)
+    _, record = measure_stage(
+        'prepare_save_prov_acts_data',
+        prov_acts.prepare_save_prov_acts_data,
+        rows_in=size,
+        measure_memory=measure_memory,
+        trace_allocations=trace_allocations,
+        df=df,
+        persons_path=persons_path,
+        groups_path=groups_path,
+        save_path=make_benchmark_path(general_configs.IMPORT_RAW_PROV_ACT_CSV, bench_dir),
+    )
+    records.append(record)
+    for configs in make_benchmark_configs(all_configs, bench_dir):
+        staging_table = configs.get('staging_table')
+        df_load = df
+        if configs.get('load_path'):
+            df_load = pd.read_csv(configs.get('load_path'))
+        (df_stage, col_data_types), record = measure_stage(
+            f'prep_transformed_data:{staging_table}',
+            ref_collection.prep_transformed_data,
+            rows_in=len(df_load.index),
+            measure_memory=measure_memory,
+            trace_allocations=trace_allocations,
+            df=df_load,
+            configs=configs,
+            columnar_mode=True,
+        )
+        records.append(record)
+        df_encoded, record = measure_stage(
+            f'encode_json_columns:{staging_table}',
+            json_encoding.encode_json_columns,
+            rows_in=len(df_stage.index),
+            measure_memory=measure_memory,
+            trace_allocations=trace_allocations,
+            df_stage=df_stage,
+            col_data_types=col_data_types,
+        )
+        records.append(record)
+        for artifact_format in artifact_formats:
+            _, record = measure_stage(
+                f'save_staging_artifact:{artifact_format}:{staging_table}',
+                ref_collection.save_staging_artifact,
+                rows_in=len(df_stage.index),
+                measure_memory=measure_memory,
+                trace_allocations=trace_allocations,
+                df_stage=df_stage,
+                col_data_types=col_data_types,
+                path=staging_artifacts.make_staging_artifact_path(staging_table, artifact_format, data_dir=bench_dir),
+                df_encoded=df_encoded,
+            )
+            records.append(record)
+    _, record = measure_stage(
+        'prepare_all_sql_inserts',
+        ref_collection.prepare_all_sql_inserts,
+        measure_memory=measure_memory,
+        trace_allocations=trace_allocations,
+        all_configs=all_configs,
+        sql_path=make_benchmark_path(general_configs.ARCHES_INSERT_SQL_PATH, bench_dir),
+    )
+    records.append(record)
+    return records
+
+
+def save_benchmark_results(results, bench_dir=BENCHMARK_DIR):
+    """Saves benchmark results as JSON, in a file named for when the run started"""
+    filename = f"{BENCHMARK_RESULTS_PREFIX}_{results.get('started')}.json"
+    utilities.save_serialized_json(bench_dir, filename, results)
+    return os.path.join(bench_dir, filename)
+
+
+def run_benchmark_suite(
+    sizes=RAW_BENCHMARK_SIZES,
+    bench_dir=BENCHMARK_DIR,
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    artifact_formats=None,
+    measure_memory=True,
+    trace_allocations=False,
+    seed=0,
+):
+    """Runs and measures each stage of the ETL on synthetic raw data of each size,
+    and saves the results as JSON so runs can be compared
+    """
+    results = {
+        'started': datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'orjson': json_encoding.orjson is not None,
+        'pyarrow': staging_artifacts.pa is not None,
+        'deterministic_uuids': general_configs.DETERMINISTIC_UUIDS,
+        'measure_memory': measure_memory,
+        'trace_allocations': trace_allocations,
+        'runs': [],
+    }
+    for size in sizes:
+        print(f'Benchmarking the ETL stages with {size} synthetic raw rows')
+        records = benchmark_raw_size(
+            size,
+            bench_dir=bench_dir,
+            all_configs=all_configs,
+            artifact_formats=artifact_formats,
+            measure_memory=measure_memory,
+            trace_allocations=trace_allocations,
+            seed=seed,
+        )
+        results['runs'].append({'rows': size, 'stages': records})
+    path = save_benchmark_results(results, bench_dir)
+    print(f'Saved benchmark results to: {path}')
+    return results
@@ -0,0 +1,383 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import utilities
+
+"""
+A columnar execution engine for the mapping configs. This produces the same df_staging
+and col_data_types as ref_collection.prep_transformed_data, but it applies each
+mapping to whole columns of the raw dataframe rather than walking the dataframe
+one row at a time.
+
+The row-wise ref_collection.prep_transformed_data remains the reference implementation.
+Some of its quirks are reproduced on purpose here, for example:
+
+(1) Rows that share a raw_pk collapse into one staging row, with later rows overwriting
+    values written by earlier rows.
+(2) If a mapping has tile_other_fields, the main staging field gets the last
+    non-null transformed value of the tile.
+(3) The order of staging columns follows the order in which the row-wise loop
+    first inserts a key into a staging row.
+
+"""
+
+
+def get_object_values(series):
+    """Gets the values of a series as a numpy object array of Python scalars"""
+    return series.to_numpy(dtype=object)
+
+
+def json_loads_or_none(value):
+    """Loads a JSON string, returning None if the string is not valid JSON"""
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return None
+
+
+def transform_values(raw_values, data_type, value_transform):
+    """Applies a value_transform to an array of (non-null) raw values"""
+    if data_type == JSONB and value_transform == general_configs.copy_value:
+        # Same as ref_collection.make_transformed_value, strings get parsed as JSON.
+        return [
+            json_loads_or_none(v) if isinstance(v, str) else v
+            for v in raw_values
+        ]
+    if value_transform == general_configs.copy_value:
+        return list(raw_values)
+    return [value_transform(v) for v in raw_values]
+
+
+def make_object_array(size, fill_value=None):
+    """Makes a numpy object array filled with a (shared) value"""
+    values = np.empty(size, dtype=object)
+    values.fill(fill_value)
+    return values
+
+
+def to_object_array(values):
+    """Makes a numpy object array from a list, without numpy unpacking nested lists"""
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def make_uuid_strs(keys_list):
+    """Makes an array of new UUID strings, one for each tuple of natural keys
+    (see: utilities.make_uuid)
+    """
+    return to_object_array([utilities.make_uuid(*keys) for keys in keys_list])
+
+
+def get_valid_related_resource_mask(resource_ids):
+    """Gets a mask for resource ids that can be used in a related resource object"""
+    return np.array(
+        [
+            not (pd.isnull(rid) or not rid or str(rid) == 'NaN')
+            for rid in resource_ids
+        ],
+        dtype=bool,
+    )
+
+
+def make_related_resource_objs(plan, mapping, rel_dict, raw_pks, resource_ids):
+    """Makes the relationship objects of one related resource source, for a batch of
+    rows (with valid resource ids)
+    """
+    res_x_res_ids = utilities.make_uuids(
+        len(resource_ids),
+        'resource_x_resource',
+        plan.staging_table,
+        mapping.stage_field_prefix,
+        rel_dict.source_field_to_uuid,
+        raw_pks,
+        resource_ids,
+    )
+    return [
+        {
+            "resourceId": resource_id,
+            "ontologyProperty": rel_dict.rel_type_id,
+            "resourceXresourceId": res_x_res_id,
+            "inverseOntologyProperty": rel_dict.inverse_rel_type_id,
+        }
+        for resource_id, res_x_res_id in zip(resource_ids.tolist(), res_x_res_ids)
+    ]
+
+
+def make_related_resources_writes(df, plan, mapping, ok_mask, ordinal, step):
+    """Makes the staging column writes for the related_resources of a mapping plan
+
+    The relationship objects (and their resourceXresourceId UUIDs) get made in one
+    batch per related resource source, then grouped into a container per row by
+    sorting them on their rows.
+    """
+    n = len(df.index)
+    raw_pks = get_object_values(df[plan.raw_pk_col])
+    rel_dicts = mapping.related_resources
+    # Each related_objs field (there may be several for a mapping, grouped by the
+    # group_source_field) is a container of relationship objects per row.
+    field_rel_is = {}
+    for rel_i, rel_dict in enumerate(rel_dicts):
+        field_rel_is.setdefault(rel_dict.related_objs_col, []).append(rel_i)
+    writes = []
+    for source_rel_objs_field, rel_is in field_rel_is.items():
+        obj_rows = []
+        obj_rel_is = []
+        rel_objs = []
+        for rel_i in rel_is:
+            rel_dict = rel_dicts[rel_i]
+            resource_ids = get_object_values(df[rel_dict.source_field_to_uuid])
+            rows = np.flatnonzero(ok_mask & get_valid_related_resource_mask(resource_ids))
+            obj_rows.append(rows)
+            obj_rel_is.append(np.full(len(rows), rel_i))
+            rel_objs += make_related_resource_objs(plan, mapping, rel_dict, raw_pks[rows], resource_ids[rows])
+        obj_rows = np.concatenate(obj_rows)
+        obj_rel_is = np.concatenate(obj_rel_is)
+        # A stable sort keeps the objects of a row in the order of the related resources,
+        # as the row-wise loop appends them.
+        order = np.argsort(obj_rows, kind='stable')
+        obj_rows = obj_rows[order]
+        obj_rel_is = obj_rel_is[order]
+        rel_objs = [rel_objs[i] for i in order.tolist()]
+        is_start = np.ones(len(obj_rows), dtype=bool)
+        is_start[1:] = obj_rows[1:] != obj_rows[:-1]
+        starts = np.flatnonzero(is_start)
+        ends = np.append(starts[1:], len(obj_rows))
+        containers = make_object_array(n)
+        first_rel_i = np.full(n, len(rel_dicts), dtype=float)
+        first_rel_i[obj_rows[starts]] = obj_rel_is[starts]
+        for row, start, end, rel_i in zip(
+            obj_rows[starts].tolist(), starts.tolist(), ends.tolist(), obj_rel_is[starts].tolist()
+        ):
+            # The container type is set by the first valid relationship, as in the
+            # row-wise loop.
+            if rel_dicts[rel_i].multi_value:
+                containers[row] = rel_objs[start:end]
+            else:
+                containers[row] = {rel_obj["resourceXresourceId"]: rel_obj for rel_obj in rel_objs[start:end]}
+        mask = np.zeros(n, dtype=bool)
+        mask[obj_rows] = True
+        # The key order of the related_objs fields in a row depends on which relationship
+        # is the first valid one for that row.
+        rel_ordinal = ordinal + step * (first_rel_i + 1) / (len(rel_dicts) + 2)
+        writes.append((source_rel_objs_field, JSONB, containers, mask, rel_ordinal))
+    return writes
+
+
+def make_tile_data_values(tile_data_template, copy_values, ok_mask):
+    """Makes the tile_data objects for rows in the ok_mask, from the tile_data template
+    of a mapping plan
+    """
+    values = make_object_array(len(ok_mask))
+    make_tile_data = tile_data_template.make_tile_data
+    for i in np.flatnonzero(ok_mask):
+        values[i] = make_tile_data(copy_values[i])
+    return values
+
+
+def make_mapping_writes(df, plan, mapping, ordinal, ewkb_values=None):
+    """Makes the staging column registrations and writes for a single mapping plan
+
+    The ewkb_values are the geometries already converted to EWKB for the mappings
+    that get staged as EWKB (see: places.convert_ewkb_geometries), if we have them.
+
+    Returns a tuple of (registrations, writes). Registrations are tuples of
+    (column, data_type, mask, ordinal) for entries into col_data_types. Writes are
+    tuples of (column, data_type, values, mask, ordinal) for the staging values.
+    """
+    n = len(df.index)
+    all_rows = np.ones(n, dtype=bool)
+    raw_col = mapping.raw_col
+    data_type = mapping.data_type
+    stage_targ_field = mapping.stage_targ_col
+    # We use fractional ordinals to keep the order of operations within a mapping.
+    step = 1 / 100
+    registrations = [(stage_targ_field, data_type, all_rows, ordinal)]
+    writes = []
+    raw_values = get_object_values(df[raw_col])
+    active = df[raw_col].notnull().to_numpy()
+    values = make_object_array(n)
+    if ewkb_values and mapping.staging_geometry_format == 'ewkb' and raw_col in ewkb_values:
+        values[active] = to_object_array(ewkb_values[raw_col])[active]
+    else:
+        values[active] = to_object_array(
+            transform_values(raw_values[active], data_type, mapping.value_transform)
+        )
+    main_ok = active & np.array([v is not None for v in values], dtype=bool)
+    any_other_ok = np.zeros(n, dtype=bool)
+    for other_i, other_field in enumerate(mapping.other_fields):
+        other_raw_col = other_field.raw_col
+        other_data_type = other_field.data_type
+        other_stage_targ_field = other_field.stage_col
+        other_value_transform = other_field.value_transform
+        other_active = active & df[other_raw_col].notnull().to_numpy()
+        other_values = make_object_array(n)
+        other_values[other_active] = to_object_array(
+            transform_values(
+                get_object_values(df[other_raw_col])[other_active],
+                other_data_type,
+                other_value_transform,
+            )
+        )
+        other_ok = other_active & np.array([v is not None for v in other_values], dtype=bool)
+        other_ordinal = ordinal + (other_i + 1) * step
+        writes.append((other_stage_targ_field, other_data_type, other_values, other_ok, other_ordinal))
+        registrations.append((other_stage_targ_field, other_data_type, other_ok, other_ordinal))
+        # The row-wise loop leaves the last non-null transformed value of the tile
+        # in the main staging field.
+        values = np.where(other_ok, other_values, values)
+        any_other_ok |= other_ok
+    ok_mask = main_ok | any_other_ok
+    ordinal += 0.5
+    if mapping.make_tileid:
+        staging_tileid = mapping.tileid_col
+        tileids = make_object_array(n)
+        tileids[ok_mask] = make_uuid_strs(
+            [
+                ('tile', plan.staging_table, mapping.stage_field_prefix, raw_pk)
+                for raw_pk in get_object_values(df[plan.raw_pk_col])[ok_mask]
+            ]
+        )
+        writes.append((staging_tileid, UUID, tileids, ok_mask, ordinal))
+        registrations.append((staging_tileid, UUID, ok_mask, ordinal))
+    ordinal += step
+    writes.append((stage_targ_field, data_type, values, ok_mask, ordinal))
+    for default_value in mapping.default_values:
+        ordinal += step
+        default_col = default_value.stage_col
+        d_type = default_value.data_type
+        writes.append((default_col, d_type, make_object_array(n, default_value.value), ok_mask, ordinal))
+        registrations.append((default_col, d_type, ok_mask, ordinal))
+    if mapping.related_resources:
+        ordinal += step
+        for write in make_related_resources_writes(df, plan, mapping, ok_mask, ordinal, step):
+            writes.append(write)
+            col, d_type, _, mask, rel_ordinal = write
+            registrations.append((col, d_type, mask, rel_ordinal))
+        ordinal += step
+    if mapping.tile_data:
+        ordinal += step
+        tile_data_col = mapping.tile_data_col
+        tile_data_values = make_tile_data_values(mapping.tile_data, values, ok_mask)
+        registrations.append((tile_data_col, general_configs.JSONB, ok_mask, ordinal))
+        writes.append((tile_data_col, general_configs.JSONB, tile_data_values, ok_mask, ordinal))
+    return registrations, writes
+
+
+def get_first_positions(items, row_order):
+    """Gets the (row position, ordinal) where each column first shows up"""
+    firsts = {}
+    for col, mask, ordinal in items:
+        ordered_mask = mask[row_order]
+        if not ordered_mask.any():
+            continue
+        # Rows are taken in row_order. Within a row, the ordinal gives the order of insertion.
+        pos = int(np.argmax(ordered_mask))
+        act_ordinal = ordinal if np.isscalar(ordinal) else ordinal[row_order][pos]
+        key = (pos, act_ordinal)
+        if col not in firsts or key < firsts[col]:
+            firsts[col] = key
+    return firsts
+
+
+def get_group_codes(raw_pks):
+    """Gets staging row codes (in order of first appearance) for the raw primary keys"""
+    # Null primary keys share a single staging row, as they do in the row-wise loop
+    # (where the null raw_pk is the same NaN object for every row).
+    codes, uniques = pd.factorize(raw_pks, use_na_sentinel=False)
+    n_groups = len(uniques)
+    # Make sure the codes follow the order of first appearance (factorize may put a
+    # null key last).
+    first_pos = np.full(n_groups, len(codes))
+    np.minimum.at(first_pos, codes, np.arange(len(codes)))
+    group_rank = np.empty(n_groups, dtype=int)
+    group_rank[np.argsort(first_pos, kind='stable')] = np.arange(n_groups)
+    return group_rank[codes], n_groups
+
+
+def prep_transformed_data_columnar(df, plan, ewkb_values=None):
+    """Prepares a dataset from the dataframe df for transformation into a staging table,
+    working on whole columns at a time
+
+    The plan is the compiled mapping config (see: mapping_plans.compile_staging_plan).
+    The ewkb_values are the geometries already converted to EWKB (see:
+    places.convert_ewkb_geometries), if we have them.
+    """
+    if df.empty:
+        return pd.DataFrame([]), {}
+    n = len(df.index)
+    row_codes, n_groups = get_group_codes(get_object_values(df[plan.raw_pk_col]))
+    group_row_order = np.lexsort((np.arange(n), row_codes))
+    all_registrations = []
+    all_writes = []
+    for mapping_i, mapping in enumerate(plan.mappings):
+        with instrumentation.measure_stage(
+            'mapping',
+            staging_table=plan.staging_table,
+            mapping=mapping.stage_targ_col,
+            rows_in=n,
+        ) as record:
+            registrations, writes = make_mapping_writes(
+                df,
+                plan,
+                mapping,
+                float(mapping_i),
+                ewkb_values=ewkb_values,
+            )
+            if instrumentation.is_recording():
+                # The rows out are the raw rows that the mapping wrote any staging values for.
+                written = np.zeros(n, dtype=bool)
+                for _, _, _, mask, _ in writes:
+                    written |= mask
+                record['rows_out'] = int(written.sum())
+        all_registrations += registrations
+        all_writes += writes
+
+    # Compose the col_data_types with the same key order and the same (last registered)
+    # values as the row-wise loop.
+    reg_firsts = get_first_positions(
+        [(col, mask, ordinal) for col, _, mask, ordinal in all_registrations],
+        np.arange(n),
+    )
+    reg_lasts = {}
+    for col, d_type, mask, ordinal in all_registrations:
+        if not mask.any():
+            continue
+        pos = n - 1 - int(np.argmax(mask[::-1]))
+        act_ordinal = ordinal if np.isscalar(ordinal) else ordinal[pos]
+        key = (pos, act_ordinal)
+        if col not in reg_lasts or key >= reg_lasts[col][0]:
+            reg_lasts[col] = (key, d_type)
+    col_data_types = {
+        col: reg_lasts[col][1] for col in sorted(reg_firsts, key=lambda c: reg_firsts[c])
+    }
+
+    # Now compose the staging columns. Later writes overwrite earlier writes, both
+    # within a row and between rows that share the same raw_pk.
+    write_firsts = get_first_positions(
+        [(col, mask, ordinal) for col, _, _, mask, ordinal in all_writes],
+        group_row_order,
+    )
+    col_values = {}
+    col_present = {}
+    for col, _, values, mask, _ in all_writes:
+        if col not in col_values:
+            col_values[col] = make_object_array(n, np.nan)
+            col_present[col] = np.zeros(n, dtype=bool)
+        col_values[col][mask] = values[mask]
+        col_present[col] |= mask
+    staging_data = {}
+    for col in sorted(write_firsts, key=lambda c: write_firsts[c]):
+        present_rows = np.flatnonzero(col_present[col])
+        rev_codes = row_codes[present_rows][::-1]
+        act_codes, rev_index = np.unique(rev_codes, return_index=True)
+        last_rows = present_rows[len(present_rows) - 1 - rev_index]
+        staging_values = make_object_array(n_groups, np.nan)
+        staging_values[act_codes] = col_values[col][last_rows]
+        staging_data[col] = staging_values.tolist()
+    df_staging = pd.DataFrame(staging_data)
+    return df_staging, col_data_types
@@ -0,0 +1,149 @@
+import io
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from arches_rascoll import general_configs
+from arches_rascoll import utilities
+
+"""
+Loads staging dataframes into PostgreSQL with COPY ... FROM STDIN (CSV format), which
+is much faster than the INSERT batches that DataFrame.to_sql sends through SQLAlchemy.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import copy_loader
+stats = copy_loader.copy_df_to_staging_table(df_stage, 'rsci', col_data_types)
+
+"""
+
+# The number of rows to send to PostgreSQL in a single COPY.
+COPY_BATCH_SIZE = 20000
+
+
+# For these types, an empty string is the sentinel for a missing value
+# (see: ref_collection.make_objs_from_json_strings).
+EMPTY_STR_NULL_SQL_TYPES = ['jsonb', 'uuid', 'uuid[]']
+
+
+def is_null_value(value, sql_type):
+    """Checks if a staging value should be loaded as a SQL NULL"""
+    if value is None:
+        return True
+    if isinstance(value, (list, dict)):
+        return False
+    if isinstance(value, str):
+        return value == '' and sql_type in EMPTY_STR_NULL_SQL_TYPES
+    return pd.isnull(value)
+
+
+def encode_uuid_array(value):
+    """Encodes a list of UUIDs as a PostgreSQL array literal"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return '{' + ','.join([str(v) for v in value]) + '}'
+
+
+def encode_copy_value(value, sql_type):
+    """Encodes a staging value as text for a given PostgreSQL column type"""
+    if is_null_value(value, sql_type):
+        return None
+    if sql_type == 'jsonb':
+        if isinstance(value, str):
+            # Already JSON encoded.
+            return value
+        return json.dumps(value, ensure_ascii=False)
+    if sql_type == 'uuid[]':
+        return encode_uuid_array(value)
+    if sql_type == 'integer' and isinstance(value, (float, np.floating)):
+        return str(int(value))
+    return str(value)
+
+
+def quote_copy_csv_field(value):
+    """Quotes a text value for COPY CSV, where an unquoted empty field is NULL"""
+    if value is None:
+        return ''
+    return '"' + value.replace('"', '""') + '"'
+
+
+def make_copy_csv_lines(df_stage, cols, col_sql_types):
+    """Yields lines of COPY CSV for the rows of a staging dataframe"""
+    encoded_cols = []
+    for col in cols:
+        sql_type = col_sql_types[col]
+        encoded_cols.append(
+            [quote_copy_csv_field(encode_copy_value(v, sql_type)) for v in df_stage[col].tolist()]
+        )
+    for row_values in zip(*encoded_cols):
+        yield ','.join(row_values) + '\n'
+
+
+def get_col_sql_types(cols, col_data_types):
+    """Gets the PostgreSQL type for each staging column"""
+    col_sql_types = {}
+    for col in cols:
+        data_type = col_data_types.get(col)
+        if data_type is None:
+            col_sql_types[col] = 'text'
+            continue
+        col_sql_types[col] = utilities.lookup_data_type_sql_str(data_type)
+    return col_sql_types
+
+
+def make_create_table_sql(staging_table, col_sql_types, staging_schema=general_configs.STAGING_SCHEMA_NAME):
+    """Makes the SQL to create a staging table for the given column types"""
+    cols_sql = ',\n'.join([f'"{col}" {sql_type}' for col, sql_type in col_sql_types.items()])
+    return f'CREATE TABLE IF NOT EXISTS {staging_schema}.{staging_table} (\n{cols_sql}\n);'
+
+
+def copy_df_to_staging_table(
+    df_stage,
+    staging_table,
+    col_data_types,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    db_url=general_configs.ARCHES_DB_URL,
+    replace=True,
+    batch_size=COPY_BATCH_SIZE,
+):
+    """Creates a staging table from the col_data_types and COPYs the staging data into it
+
+    Returns a dict with the number of rows loaded, the elapsed seconds and the
+    rows per second.
+    """
+    start = time.time()
+    cols = df_stage.columns.tolist()
+    col_sql_types = get_col_sql_types(cols, col_data_types)
+    cols_sql = ', '.join([f'"{col}"' for col in cols])
+    copy_sql = f'COPY {staging_schema}.{staging_table} ({cols_sql}) FROM STDIN WITH (FORMAT csv)'
+    engine = utilities.get_engine(db_url)
+    con = engine.raw_connection()
+    try:
+        cursor = con.cursor()
+        if replace:
+            cursor.execute(f'DROP TABLE IF EXISTS {staging_schema}.{staging_table};')
+        cursor.execute(make_create_table_sql(staging_table, col_sql_types, staging_schema))
+        for batch_start in range(0, len(df_stage.index), batch_size):
+            df_batch = df_stage.iloc[batch_start:(batch_start + batch_size)]
+            buffer = io.StringIO()
+            buffer.writelines(make_copy_csv_lines(df_batch, cols, col_sql_types))
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+        con.commit()
+    finally:
+        con.close()
+    elapsed = time.time() - start
+    rows = len(df_stage.index)
+    rows_per_sec = rows / elapsed if elapsed > 0 else float(rows)
+    print(
+        f'COPY loaded {rows} rows into {staging_schema}.{staging_table} '
+        f'in {elapsed:.2f} seconds ({rows_per_sec:.0f} rows per second)'
+    )
+    return {
+        'staging_table': staging_table,
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows_per_sec,
+    }
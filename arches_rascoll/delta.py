@@ -0,0 +1,189 @@
+import os
+
+import pandas as pd
+
+from sqlalchemy.types import Text
+from sqlalchemy.dialects.postgresql import UUID
+
+from arches_rascoll import general_configs
+from arches_rascoll import utilities
+
+"""
+Compares a new export of the raw data with a snapshot of the raw data from the last
+successful load into Arches, so we only need to stage and load the records that
+were added or changed (see: ref_collection.prepare_delta_transformed_data).
+
+The snapshot is a CSV file in the DATA_DIR with a hash of each raw record, keyed
+by the DELTA_KEY_COL. The hashes cover a sorted list of the raw columns, saved with
+the snapshot, so a new export with its columns in another order (or with more
+columns) hashes the same way. Preparing a delta saves a pending snapshot, which only
+replaces the last snapshot once the data gets loaded into Arches.
+
+A delta also stages the tileids that the mappings make for the added and changed
+records (in the DELTA_TILES_TABLE), so the SQL can delete the tiles of changed
+records that no longer have any data, as a full load would not have made them.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import delta
+from arches_rascoll import ref_collection
+from arches_rascoll import sql_executor
+dfs = ref_collection.prepare_all_transformed_data(delta=True)
+records = sql_executor.execute_all_sql_inserts(delta=True)
+
+"""
+
+DELTA_KEY_COL = 'rsci_uuid'
+RAW_SNAPSHOT_FILENAME = 'raw_snapshot.csv'
+PENDING_RAW_SNAPSHOT_FILENAME = 'raw_snapshot_pending.csv'
+RAW_DELTA_FILENAME = 'raw_delta.json'
+RAW_SNAPSHOT_COLUMNS_FILENAME = 'raw_snapshot_columns.json'
+PENDING_RAW_SNAPSHOT_COLUMNS_FILENAME = 'raw_snapshot_columns_pending.json'
+
+# The staging table of the tileids made for the added and changed records.
+DELTA_TILES_TABLE = 'delta_tiles'
+DELTA_TILES_COL_DATA_TYPES = {
+    'staging_table': Text,
+    'tileid_col': Text,
+    'tileid': UUID,
+}
+
+
+def get_raw_hash_cols(df, snapshot_hash_cols=None):
+    """Gets the sorted list of raw columns to hash, which are the columns hashed for
+    the snapshot (if we have them and df has all of them)
+    """
+    hash_cols = sorted([str(col) for col in df.columns])
+    if not snapshot_hash_cols:
+        return hash_cols
+    missing_cols = [col for col in snapshot_hash_cols if col not in hash_cols]
+    if missing_cols:
+        print(f'The raw data lacks columns hashed in the snapshot, so every record will look changed: {missing_cols}')
+        return hash_cols
+    new_cols = [col for col in hash_cols if col not in snapshot_hash_cols]
+    if new_cols:
+        print(f'Changes to raw columns not hashed in the snapshot will not be found: {new_cols}')
+    return list(snapshot_hash_cols)
+
+
+def hash_raw_rows(df, key_col=DELTA_KEY_COL, hash_cols=None):
+    """Makes a dataframe of the key and a hash of the values of each raw record
+
+    The hash covers the hash_cols (by default, all the columns sorted by name), so
+    the order of the columns in the export doesn't matter. We hash the values as
+    strings, so a new export where a column gets read with a different dtype (say,
+    float rather than int) doesn't look like a change to every row.
+    """
+    if hash_cols is None:
+        hash_cols = get_raw_hash_cols(df)
+    row_hashes = pd.util.hash_pandas_object(df[hash_cols].astype(str), index=False)
+    df_hashes = pd.DataFrame(
+        {
+            key_col: df[key_col].astype(str).to_numpy(),
+            'row_hash': row_hashes.astype(str).to_numpy(),
+        }
+    )
+    df_hashes = df_hashes[df[key_col].notnull().to_numpy()]
+    # If a key is repeated, the last record wins, as it does in the staging data.
+    return df_hashes.drop_duplicates(subset=[key_col], keep='last').reset_index(drop=True)
+
+
+def load_raw_snapshot(data_dir=general_configs.DATA_DIR, filename=RAW_SNAPSHOT_FILENAME):
+    """Loads the snapshot of the raw record hashes, or None if there isn't one"""
+    path = os.path.join(data_dir, filename)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, dtype=str)
+
+
+def load_raw_snapshot_hash_cols(data_dir=general_configs.DATA_DIR, filename=RAW_SNAPSHOT_COLUMNS_FILENAME):
+    """Loads the list of raw columns hashed in the snapshot, or None if we don't have it"""
+    return utilities.load_serialized_json(data_dir, filename)
+
+
+def diff_raw_data(df_hashes, df_snapshot=None, key_col=DELTA_KEY_COL):
+    """Classifies the raw records as added, changed or removed since the snapshot"""
+    if df_snapshot is None:
+        df_snapshot = pd.DataFrame({key_col: [], 'row_hash': []}, dtype=str)
+    df_merged = df_hashes.merge(
+        df_snapshot,
+        how='outer',
+        on=key_col,
+        suffixes=('', '_snapshot'),
+        indicator=True,
+    )
+    added = df_merged['_merge'] == 'left_only'
+    removed = df_merged['_merge'] == 'right_only'
+    both = df_merged['_merge'] == 'both'
+    changed = both & (df_merged['row_hash'] != df_merged['row_hash_snapshot'])
+    return {
+        'added': df_merged[added][key_col].tolist(),
+        'changed': df_merged[changed][key_col].tolist(),
+        'removed': df_merged[removed][key_col].tolist(),
+        'unchanged': int((both & ~changed).sum()),
+    }
+
+
+def save_pending_raw_snapshot(df_hashes, raw_delta, data_dir=general_configs.DATA_DIR, hash_cols=None):
+    """Saves the raw record hashes (with the hashed columns, and the delta) of the data being loaded"""
+    path = utilities.make_full_path_filename(data_dir, PENDING_RAW_SNAPSHOT_FILENAME)
+    df_hashes.to_csv(path, index=False)
+    if hash_cols is not None:
+        utilities.save_serialized_json(data_dir, PENDING_RAW_SNAPSHOT_COLUMNS_FILENAME, hash_cols)
+    utilities.save_serialized_json(data_dir, RAW_DELTA_FILENAME, raw_delta)
+    return path
+
+
+def commit_raw_snapshot(data_dir=general_configs.DATA_DIR):
+    """Makes the pending snapshot the snapshot of the last successful load"""
+    pending_path = os.path.join(data_dir, PENDING_RAW_SNAPSHOT_FILENAME)
+    if not os.path.exists(pending_path):
+        print('No pending raw data snapshot to commit')
+        return None
+    path = os.path.join(data_dir, RAW_SNAPSHOT_FILENAME)
+    os.replace(pending_path, path)
+    pending_cols_path = os.path.join(data_dir, PENDING_RAW_SNAPSHOT_COLUMNS_FILENAME)
+    if os.path.exists(pending_cols_path):
+        os.replace(pending_cols_path, os.path.join(data_dir, RAW_SNAPSHOT_COLUMNS_FILENAME))
+    print(f'Saved the raw data snapshot of the last successful load: {path}')
+    return path
+
+
+def filter_affected_rows(df, affected_keys, key_col=DELTA_KEY_COL):
+    """Filters a dataframe to rows with affected keys. A dataframe without the key
+    column (like the persons or groups) gets returned unfiltered
+    """
+    if key_col not in df.columns:
+        return df
+    return df[df[key_col].astype(str).isin(affected_keys)].copy()
+
+
+def make_delta_tiles(df, plan):
+    """Makes a dataframe of the tileids that the tile mappings of a plan (see:
+    mapping_plans.compile_staging_plan) make for the raw records of df
+
+    These are the tileids of the transform (see: columnar.make_mapping_writes), which
+    are the same for every run with general_configs.DETERMINISTIC_UUIDS.
+    """
+    raw_pks = df[plan.raw_pk_col]
+    raw_pks = raw_pks[raw_pks.notnull()].drop_duplicates().tolist()
+    dfs_tiles = [pd.DataFrame({col: [] for col in DELTA_TILES_COL_DATA_TYPES.keys()}, dtype=str)]
+    for mapping in plan.mappings:
+        if not mapping.make_tileid:
+            continue
+        dfs_tiles.append(
+            pd.DataFrame(
+                {
+                    'staging_table': plan.staging_table,
+                    'tileid_col': mapping.tileid_col,
+                    'tileid': utilities.make_uuids(
+                        len(raw_pks),
+                        'tile',
+                        plan.staging_table,
+                        mapping.stage_field_prefix,
+                        raw_pks,
+                    ),
+                }
+            )
+        )
+    return pd.concat(dfs_tiles, ignore_index=True)
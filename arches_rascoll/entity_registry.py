@@ -0,0 +1,127 @@
+import numpy as np
+
+from arches_rascoll import general_configs
+from arches_rascoll import groups
+from arches_rascoll import persons
+from arches_rascoll import places
+from arches_rascoll import raw_data
+from arches_rascoll import utilities
+
+"""
+An in-memory registry of the persons, groups and places extracted from the raw data.
+We build the registry once per run, then pass it to the stages that prepare data
+(persons, groups, places, prov_acts and ref_collection), so they share the same
+identities without writing and re-reading CSV files between stages.
+
+The registry is a dict with an entry for each entity type. Each entry has the
+entity dataframe, the path of the CSV file it gets saved to (and that the mapping
+configs load from), and an index of natural key -> UUID. Person and group names get
+normalized (see: utilities.normalize_key) for their keys, place URIs don't. The
+places also have an index of URI -> geo_point.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import entity_registry
+from arches_rascoll import ref_collection
+registry = entity_registry.prepare_all_entity_data()
+dfs = ref_collection.prepare_all_transformed_data(registry=registry)
+
+"""
+
+# The entity types with name keys that get normalized for lookups.
+NAME_ENTITY_TYPES = ['persons', 'groups']
+
+
+def make_name_index(df, name_col, uuid_col):
+    """Makes an index of normalized name -> UUID
+
+    If names only differ in case or whitespace, they resolve to the UUID of the
+    first of them (so the configured groups win over groups from the raw data).
+    """
+    df_keys = df[df[name_col].notnull()][[name_col, uuid_col]].copy()
+    df_keys['key'] = [utilities.normalize_key(name) for name in df_keys[name_col].tolist()]
+    df_keys.drop_duplicates(subset=['key'], keep='first', inplace=True)
+    return utilities.make_lookup_index(df_keys, 'key', uuid_col)
+
+
+def make_place_index(df_all_geo, value_col='place_uuid'):
+    """Makes an index of place URI -> place UUID (or another value_col, like the
+    geo_point), for places that have a UUID
+    """
+    valid_index = df_all_geo['place_uuid'].notnull() & (df_all_geo['place_uuid'] != '')
+    return utilities.make_lookup_index(df_all_geo[valid_index], 'specific_place_uri', value_col)
+
+
+def make_entity_registry(
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    merge_distance=general_configs.PLACE_MERGE_DISTANCE,
+):
+    """Extracts the persons, groups and places from the raw data and indexes them"""
+    if df is None:
+        df = raw_data.load_raw_data(raw_path)
+    df_persons = persons.get_persons_from_raw_data(df)
+    df_groups = groups.get_groups_data(df_raw=df)
+    df_all_geo = places.prep_raw_geo_data(df, merge_distance=merge_distance)
+    return {
+        'persons': {
+            'df': df_persons,
+            'path': general_configs.IMPORT_RAW_PERSON_CSV,
+            'index': make_name_index(df_persons, 'person_name', 'person_uuid'),
+        },
+        'groups': {
+            'df': df_groups,
+            'path': general_configs.IMPORT_RAW_GROUP_CSV,
+            'index': make_name_index(df_groups, 'group_name', 'group_uuid'),
+        },
+        'places': {
+            'df': df_all_geo,
+            'path': general_configs.IMPORT_PLACES_CSV,
+            'index': make_place_index(df_all_geo),
+            'geo_point_index': make_place_index(df_all_geo, value_col='geo_point'),
+        },
+    }
+
+
+def lookup_entity_uuids(registry, entity_type, keys, missing_value=''):
+    """Looks up the UUIDs of a series of entity names (or place URIs)"""
+    if entity_type in NAME_ENTITY_TYPES:
+        keys = keys.map(utilities.normalize_key, na_action='ignore')
+    return utilities.lookup_values(keys, registry[entity_type]['index'], missing_value=missing_value)
+
+
+def get_load_df(registry, load_path):
+    """Gets the entity dataframe saved to a load_path, as it would be read from the
+    CSV file, or None if the registry doesn't have it
+    """
+    if not registry:
+        return None
+    for entry in registry.values():
+        if entry.get('path') != load_path:
+            continue
+        # Empty strings are missing values once saved to CSV.
+        return entry['df'].replace({'': np.nan})
+    return None
+
+
+def prepare_all_entity_data(
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    merge_distance=general_configs.PLACE_MERGE_DISTANCE,
+):
+    """Builds the entity registry, then prepares and saves all the entity data with it"""
+    # Imported here, since prov_acts uses this module for lookups.
+    from arches_rascoll import prov_acts
+    from arches_rascoll import sets
+
+    if df is None:
+        df = raw_data.load_raw_data(raw_path)
+    registry = make_entity_registry(df=df, merge_distance=merge_distance)
+    places.prepare_save_geo_data(df, registry=registry)
+    places.prepare_rsci_place_data(df, registry=registry)
+    groups.prepare_save_groups_data(registry=registry)
+    groups.prepare_rsci_group_safety_data(df)
+    persons.prepare_save_persons_data(df, registry=registry)
+    sets.prepare_save_sets_data()
+    prov_acts.prepare_save_prov_acts_data(df, registry=registry)
+    return registry
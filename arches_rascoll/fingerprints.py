@@ -0,0 +1,183 @@
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+from arches_rascoll import general_configs
+from arches_rascoll import staging_artifacts
+from arches_rascoll import utilities
+
+try:
+    import fcntl
+except ImportError:
+    # The fcntl module is Unix only. Without it, we don't lock the manifest, so
+    # don't update it from parallel processes.
+    fcntl = None
+
+"""
+Fingerprints the inputs of each staging table, so we only need to rebuild and
+reload the staging tables whose inputs changed since the last run. A fingerprint
+covers:
+
+(1) The data the staging table is made from (the raw CSV or the config's load_path).
+(2) A stable hash of the mapping config, including the identity (and code) of
+    its value_transform functions.
+
+The fingerprints of the last successful run are stored in a manifest (JSON) file in
+the DATA_DIR. Processes (see: scheduler) update the manifest one at a time, under a
+lock file, so they don't drop each other's entries.
+"""
+
+STAGING_MANIFEST_FILENAME = 'staging_manifest.json'
+STAGING_MANIFEST_LOCK_FILENAME = 'staging_manifest.lock'
+
+# Read files in blocks of this many bytes to hash them.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Makes a sha256 hash of the content of a file"""
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def hash_df(df):
+    """Makes a sha256 hash of the content of a dataframe"""
+    df_hash = hashlib.sha256()
+    df_hash.update(json.dumps([str(c) for c in df.columns]).encode('utf-8'))
+    df_hash.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return df_hash.hexdigest()
+
+
+def get_function_identity(func):
+    """Gets a stable identity for a function, including a hash of its code"""
+    func_id = f'{func.__module__}.{func.__qualname__}'
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = repr(getattr(func, '__code__', None) and func.__code__.co_code)
+    source_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    return f'{func_id}:{source_hash}'
+
+
+def make_config_jsonable(obj):
+    """Makes a JSON friendly version of a mapping config, with stable representations of
+    functions and SQLAlchemy data types"""
+    if isinstance(obj, dict):
+        return {str(k): make_config_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [make_config_jsonable(v) for v in obj]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if inspect.isfunction(obj) or inspect.isbuiltin(obj):
+        return get_function_identity(obj)
+    if inspect.isclass(obj):
+        return f'{obj.__module__}.{obj.__qualname__}'
+    # SQLAlchemy type instances, like ARRAY(UUID).
+    return f'{obj.__class__.__module__}.{repr(obj)}'
+
+
+def hash_config(configs):
+    """Makes a stable sha256 hash of a mapping config"""
+    config_json = json.dumps(make_config_jsonable(configs), sort_keys=True)
+    return hashlib.sha256(config_json.encode('utf-8')).hexdigest()
+
+
+def make_staging_fingerprint(
+    configs,
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+):
+    """Makes the fingerprint of the inputs of a staging table"""
+    input_path = configs.get('load_path')
+    if input_path:
+        input_hash = hash_file(input_path)
+    elif df is not None:
+        input_path = None
+        input_hash = hash_df(df)
+    else:
+        input_path = raw_path
+        input_hash = hash_file(raw_path)
+    config_hash = hash_config(configs)
+    fingerprint = hashlib.sha256(
+        f'{staging_schema}|{input_hash}|{config_hash}'.encode('utf-8')
+    ).hexdigest()
+    return {
+        'staging_schema': staging_schema,
+        'input_path': input_path,
+        'input_sha256': input_hash,
+        'config_sha256': config_hash,
+        'fingerprint': fingerprint,
+    }
+
+
+def load_staging_manifest(data_dir=general_configs.DATA_DIR):
+    """Loads the manifest of staging table fingerprints"""
+    manifest = utilities.load_serialized_json(data_dir, STAGING_MANIFEST_FILENAME)
+    if manifest is None:
+        return {}
+    return manifest
+
+
+def save_staging_manifest(manifest, data_dir=general_configs.DATA_DIR):
+    """Saves the manifest of staging table fingerprints"""
+    utilities.save_serialized_json(data_dir, STAGING_MANIFEST_FILENAME, manifest)
+
+
+@contextlib.contextmanager
+def lock_staging_manifest(data_dir=general_configs.DATA_DIR):
+    """Holds an exclusive lock on the manifest of staging table fingerprints"""
+    lock_path = utilities.make_full_path_filename(data_dir, STAGING_MANIFEST_LOCK_FILENAME)
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def update_staging_manifest(
+    staging_fingerprints=None,
+    removed_staging_tables=None,
+    data_dir=general_configs.DATA_DIR,
+):
+    """Adds fingerprints to (and removes staging tables from) the manifest, reading
+    and saving it under the lock, so other processes' updates don't get lost
+    """
+    with lock_staging_manifest(data_dir):
+        manifest = load_staging_manifest(data_dir)
+        manifest.update(staging_fingerprints or {})
+        for staging_table in removed_staging_tables or []:
+            manifest.pop(staging_table, None)
+        save_staging_manifest(manifest, data_dir)
+    return manifest
+
+
+def staging_table_is_current(
+    staging_table,
+    fingerprint,
+    manifest,
+    data_dir=general_configs.DATA_DIR,
+    artifact_format=general_configs.STAGING_ARTIFACT_FORMAT,
+    configs=None,
+):
+    """Checks if a staging table was already made from inputs with the same fingerprint"""
+    prior = manifest.get(staging_table, {})
+    if prior.get('fingerprint') != fingerprint.get('fingerprint'):
+        return False
+    trans_path = staging_artifacts.make_staging_artifact_path(
+        staging_table,
+        artifact_format,
+        data_dir=data_dir,
+        configs=configs,
+    )
+    return os.path.exists(trans_path)
@@ -22,6 +22,20 @@ RAW_IMPORT_CSV = os.path.join(DATA_DIR, 'gci-all-orig.csv')
 ARCHES_INSERT_SQL_PATH =  os.path.join(DATA_DIR, 'etl_sql.txt')
 
 STAGING_SCHEMA_NAME = 'staging'
+# The default number of raw rows to transform and load at a time when streaming
+# staging data in chunks.
+STAGING_CHUNK_SIZE = 10000
+# The file format of the staging data saved in the DATA_DIR: 'csv' (with JSON objects
+# as strings, easy to look at) or 'parquet' (needs pyarrow, much faster to reload).
+STAGING_ARTIFACT_FORMAT = 'csv'
+# If True, generated UUIDs (for persons, groups, places, provenance activities, tiles
+# and resource to resource relations) are UUIDv5 values made from this namespace and
+# natural keys (see: utilities.make_uuid), so reruns make the same UUIDs.
+DETERMINISTIC_UUIDS = False
+UUID_NAMESPACE = '7bfc0705-d015-57b2-b4a2-f2d317e544d4'
+# The default number of staging resourceinstanceids to insert into Arches in one
+# committed batch (see: sql_executor.execute_sql_steps).
+SQL_BATCH_SIZE = 5000
 IMPORT_TABLE_NAME = 'rsci'
 
 # For this demo, we're using the AfRSC resource and sample collection resource model.
@@ -171,6 +185,18 @@ RSCI_MAPPING_CONFIGS = {
 
 IMPORT_PLACES_CSV = os.path.join(DATA_DIR, 'gci-all-places.csv')
 
+# The spatial reference system of the GeoJSON in the raw data (WGS 84).
+GEOMETRY_SRID = 4326
+
+# If True, source GeoJSON geometries get validated and staged as hex encoded EWKB
+# (see: ref_collection.make_ewkb_geometry_configs), so loading into Arches only
+# needs a cast rather than parsing GeoJSON for each row.
+STAGE_GEOMETRY_AS_EWKB = False
+
+# If set, places within this distance (in degrees, for example 0.001) of each other
+# get merged into one place (see: places.merge_nearby_places).
+PLACE_MERGE_DISTANCE = None
+
 PLACE_MODEL_UUID = '3dda9f54-d771-11ef-825b-0275dc2ded29'
 PLACE_MODEL_NAME = 'place'
 
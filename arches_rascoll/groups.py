@@ -1,8 +1,10 @@
 import os
 import pandas as pd
-import uuid as GenUUID
 
 from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import raw_data
+from arches_rascoll import utilities
 
 # The following are the value UUIDs for the NFPA Safety Classification concept prefLabels.
 NFPA_SAFETY_CLASSIFICATION_VALUE_UUIDS = {
@@ -39,6 +41,7 @@ NFPA_FIELD_CONFIGS = [
 def get_groups_from_raw_data(
     raw_path=general_configs.RAW_IMPORT_CSV,
     data=general_configs.GROUP_DATA,
+    df=None,
 ):
     """Add groups from raw data."""
     group_cols = [
@@ -48,42 +51,67 @@ def get_groups_from_raw_data(
         'Acquired From (CLEAN_2)',
         'Manufacturer (CLEAN)',
     ]
-    df = pd.read_csv(raw_path)
+    if df is None:
+        df = raw_data.load_raw_data(raw_path)
     group_vals = []
     for col in group_cols:
         index = df[col].notnull()
         group_vals += df[index][col].unique().tolist()
-    group_vals = list(set(group_vals))
+    # Sorted, so the same name variant wins each run (see: utilities.drop_duplicate_names).
+    group_vals = sorted(set(group_vals), key=str)
     group_data = data.copy()
     for group_val in group_vals:
         group_data.append(
             {
-                'group_uuid': str(GenUUID.uuid4()),
+                'group_uuid': utilities.make_uuid('group', utilities.normalize_key(group_val)),
                 'group_name': group_val,
             }
         )
-    df_groups = pd.DataFrame(group_data)
+    # The configured groups come first, so they win over name variants in the raw data.
+    df_groups = utilities.drop_duplicate_names(pd.DataFrame(group_data), 'group_name')
     return df_groups
 
 
+def get_groups_data(
+    df_raw=None,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    data=general_configs.GROUP_DATA,
+    save_path=general_configs.IMPORT_RAW_GROUP_CSV,
+):
+    """Gets the groups from the raw data, or the groups saved by an earlier run."""
+    # With deterministic UUIDs, we don't need to reuse the saved groups to keep
+    # the same group UUIDs between runs.
+    if general_configs.DETERMINISTIC_UUIDS or not os.path.exists(save_path):
+        return get_groups_from_raw_data(
+            raw_path=raw_path,
+            data=data,
+            df=df_raw,
+        )
+    return pd.read_csv(save_path)
+
+
+@instrumentation.instrument_stage('groups')
 def prepare_save_groups_data(
     df=None,
     raw_path=general_configs.RAW_IMPORT_CSV,
     data=general_configs.GROUP_DATA, 
-    save_path=general_configs.IMPORT_RAW_GROUP_CSV
+    save_path=general_configs.IMPORT_RAW_GROUP_CSV,
+    registry=None,
 ):
+    if df is None and registry:
+        # The groups already got extracted (or loaded) for the entity registry.
+        df = registry['groups']['df']
     if df is None:
-        if not os.path.exists(save_path):
-            df = get_groups_from_raw_data(
-                raw_path=raw_path,
-                data=data,
-            )
-        else:
-            df = pd.read_csv(save_path)
+        df = get_groups_data(
+            raw_path=raw_path,
+            data=data,
+            save_path=save_path,
+        )
     df.to_csv(save_path, index=False)
     return df
 
 
+@instrumentation.instrument_stage('rsci_group_safety')
 def prepare_rsci_group_safety_data(
     df=None, 
     raw_path=general_configs.RAW_IMPORT_CSV,
@@ -91,7 +119,7 @@ def prepare_rsci_group_safety_data(
     field_configs=NFPA_FIELD_CONFIGS,
 ):
     if df is None:
-        df = pd.read_csv(raw_path)
+        df = raw_data.load_raw_data(raw_path)
     
     keep_cols = ['rsci_uuid'] + [field_config[0] for field_config in field_configs]
     df_rsci_safety = df[keep_cols].copy()
@@ -105,7 +133,6 @@ def prepare_rsci_group_safety_data(
         for raw_field_val in field_vals:
             field_val = str(raw_field_val).upper()
             field_val = field_val.strip()
-            field_val = field_val.replace('.0', '')
             field_val = suffix_map.get(field_val, field_val)
             label = f"{value_prefix}{field_val}"
             value_uuid = NFPA_SAFETY_CLASSIFICATION_VALUE_UUIDS.get(label)
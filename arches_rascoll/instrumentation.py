@@ -0,0 +1,248 @@
+import contextlib
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import sys
+import time
+
+import pandas as pd
+
+from arches_rascoll import general_configs
+from arches_rascoll import utilities
+
+try:
+    import resource
+except ImportError:
+    # The resource module is Unix only. Without it, we don't report the peak RSS.
+    resource = None
+
+"""
+Records the wall time, CPU time, RSS (resident memory) at the start and end, and
+rows in and out of each stage of an ETL run, and of each mapping of each mapping
+config, so we can see where the time of a slow run goes. The peak RSS of the process
+is a high-water mark for the whole run, so each record has how much a stage raised
+it (process_peak_rss_growth_mb) rather than the peak itself.
+
+Nothing gets recorded unless a report is started. The stage functions get measured
+with the instrument_stage decorator, and the mappings get measured by the columnar
+engine (see: columnar.prep_transformed_data_columnar). One stage (named like 'prov_acts' or
+'prep_transformed_data:provenance_activity') can also be run under cProfile. The
+report gets saved as JSON next to the etl_sql.txt file.
+
+Records only get made in the process that started the report, so run the stages
+in one process (not with the scheduler) to instrument them.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import instrumentation
+from arches_rascoll import ref_collection
+instrumentation.start_report(profile_stage='prep_transformed_data:provenance_activity')
+dfs = ref_collection.prepare_all_transformed_data()
+sqls = ref_collection.prepare_all_sql_inserts()
+report = instrumentation.save_report()
+
+"""
+
+INSTRUMENTATION_REPORT_FILENAME = 'etl_instrumentation.json'
+
+# Linux reports the current resident memory of a process (in pages) in this file.
+PROC_STATM_PATH = '/proc/self/statm'
+
+# The number of the slowest functions (by cumulative time) to put in the report for a profiled stage.
+PROFILE_TOP_FUNCTIONS = 25
+
+# The report of the current run, or None if we're not recording.
+CURRENT_REPORT = None
+
+
+def get_peak_rss_mb():
+    """Gets the peak resident memory of this process so far, in MB"""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes, Linux reports kilobytes.
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def get_current_rss_mb():
+    """Gets the current resident memory of this process, in MB (on Linux only)"""
+    try:
+        with open(PROC_STATM_PATH) as statm:
+            rss_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return rss_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def start_report(profile_stage=None):
+    """Starts recording the stages (and mappings) of a run
+
+    If profile_stage is given, the stage with that name (or that stage name, with or
+    without the staging table) gets run under cProfile.
+    """
+    global CURRENT_REPORT
+    CURRENT_REPORT = {
+        'started': time.time(),
+        'profile_stage': profile_stage,
+        'records': [],
+        'stack': [],
+    }
+    return CURRENT_REPORT
+
+
+def is_recording():
+    """Checks if we're recording a report"""
+    return CURRENT_REPORT is not None
+
+
+def make_stage_name(stage, staging_table=None, mapping=None):
+    """Makes the name of a stage (like 'prep_transformed_data:provenance_activity')"""
+    return ':'.join([part for part in [stage, staging_table, mapping] if part])
+
+
+def should_profile(stage, name):
+    """Checks if a stage should be run under cProfile"""
+    profile_stage = CURRENT_REPORT.get('profile_stage')
+    if not profile_stage:
+        return False
+    return profile_stage in [stage, name]
+
+
+def make_profile_summary(profiler, top_n=PROFILE_TOP_FUNCTIONS):
+    """Makes a list of the functions with the most cumulative time in a profile"""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative')
+    summary = []
+    for func in stats.fcn_list[:top_n]:
+        _, calls, total_time, cumulative_time, _ = stats.stats[func]
+        filename, line, func_name = func
+        summary.append(
+            {
+                'function': f'{filename}:{line}({func_name})',
+                'calls': calls,
+                'total_seconds': total_time,
+                'cumulative_seconds': cumulative_time,
+            }
+        )
+    return summary
+
+
+@contextlib.contextmanager
+def measure_stage(stage, staging_table=None, mapping=None, rows_in=None, path=None):
+    """Measures a stage (or a mapping) of the run, if we're recording a report
+
+    Yields a record dict, so the caller can set the 'rows_out' once it knows them.
+    """
+    record = {
+        'name': make_stage_name(stage, staging_table, mapping),
+        'stage': stage,
+        'staging_table': staging_table,
+        'mapping': mapping,
+        'parent': None,
+        'rows_in': rows_in,
+        'rows_out': None,
+    }
+    if path:
+        record['path'] = path
+    if CURRENT_REPORT is None:
+        yield record
+        return
+    stack = CURRENT_REPORT['stack']
+    if stack:
+        record['parent'] = stack[-1]
+    stack.append(record['name'])
+    profiler = None
+    if should_profile(stage, record['name']):
+        profiler = cProfile.Profile()
+    record['rss_start_mb'] = get_current_rss_mb()
+    peak_rss_start = get_peak_rss_mb()
+    start = time.time()
+    cpu_start = time.process_time()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_seconds'] = time.time() - start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['rss_end_mb'] = get_current_rss_mb()
+        peak_rss_end = get_peak_rss_mb()
+        record['process_peak_rss_growth_mb'] = None
+        if peak_rss_end is not None:
+            record['process_peak_rss_growth_mb'] = peak_rss_end - peak_rss_start
+        if profiler is not None:
+            record['profile'] = make_profile_summary(profiler)
+        stack.pop()
+        CURRENT_REPORT['records'].append(record)
+
+
+def count_rows(result):
+    """Counts the rows of a dataframe (or the first item of a tuple), or passes on a count"""
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if isinstance(result, pd.DataFrame):
+        return len(result.index)
+    if isinstance(result, int) and not isinstance(result, bool):
+        return result
+    return None
+
+
+def instrument_stage(stage):
+    """Makes a decorator that measures each call of a stage function
+
+    The rows in are the rows of the function's df (or df_stage) argument, and the
+    staging table comes from its configs (or staging_table) argument, if it has them.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if CURRENT_REPORT is None:
+                return func(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            staging_table = arguments.get('staging_table')
+            if arguments.get('configs'):
+                staging_table = arguments['configs'].get('staging_table')
+            df = arguments.get('df', arguments.get('df_stage'))
+            with measure_stage(
+                stage,
+                staging_table=staging_table,
+                rows_in=count_rows(df),
+                path=arguments.get('path'),
+            ) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def save_report(sql_path=general_configs.ARCHES_INSERT_SQL_PATH):
+    """Saves the report as JSON next to the saved SQL statements, and stops recording"""
+    global CURRENT_REPORT
+    if CURRENT_REPORT is None:
+        print('No instrumentation report was started')
+        return None
+    report = {
+        'started': CURRENT_REPORT.get('started'),
+        'wall_seconds': time.time() - CURRENT_REPORT.get('started'),
+        'process_peak_rss_mb': get_peak_rss_mb(),
+        'profile_stage': CURRENT_REPORT.get('profile_stage'),
+        'records': CURRENT_REPORT.get('records'),
+    }
+    CURRENT_REPORT = None
+    report_dir = os.path.dirname(sql_path)
+    utilities.save_serialized_json(report_dir, INSTRUMENTATION_REPORT_FILENAME, report)
+    print(f'Saved instrumentation report to: {os.path.join(report_dir, INSTRUMENTATION_REPORT_FILENAME)}')
+    return report
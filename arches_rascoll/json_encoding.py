@@ -0,0 +1,104 @@
+import json
+
+import pandas as pd
+from sqlalchemy.dialects.postgresql import JSONB
+
+from arches_rascoll import instrumentation
+from arches_rascoll import utilities
+
+try:
+    import orjson
+except ImportError:
+    # Without orjson, we encode with the (slower) standard library json.
+    orjson = None
+
+"""
+Encodes the JSONB columns of staging data as JSON strings, once per staging run.
+
+The staging CSV (or Parquet) writer and the staging table loaders (COPY or to_sql)
+all reuse the same encoded strings, rather than each of them encoding every JSON
+object again. If orjson is installed, we use it, since it's much faster than the
+standard library json. Both make the same compact JSON (no spaces after separators),
+so the staging CSV doesn't depend on which one is installed.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import json_encoding
+df_encoded = json_encoding.encode_json_columns(df_stage, col_data_types)
+
+"""
+
+# One encoder for all the values, since json.dumps makes a new encoder for each
+# call with non-default options.
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_json_value(value):
+    """Encodes a value as a compact JSON string"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except TypeError:
+            # orjson is stricter (for example, about non-string dict keys).
+            pass
+    elif type(value) is not dict and hasattr(value, 'encode_json'):
+        # Like the tile_data made from a template (see: mapping_plans.TileDataTemplate),
+        # which encodes itself from JSON fragments encoded once per template. orjson
+        # encodes these small objects faster than we can join the fragments.
+        return value.encode_json()
+    return JSON_ENCODER.encode(value)
+
+
+def encode_json_values(values):
+    """Encodes a list of values as JSON strings, with None for missing values"""
+    return [None if utilities.is_missing_value(v) else encode_json_value(v) for v in values]
+
+
+def get_json_cols(df_stage, col_data_types):
+    """Gets the JSONB columns of a staging dataframe"""
+    json_cols = []
+    for col in df_stage.columns.tolist():
+        data_type = col_data_types.get(col)
+        if data_type is None:
+            continue
+        if utilities.lookup_data_type_sql_str(data_type) == 'jsonb':
+            json_cols.append(col)
+    return json_cols
+
+
+@instrumentation.instrument_stage('encode_json_columns')
+def encode_json_columns(df_stage, col_data_types):
+    """Makes a copy of a staging dataframe with the JSONB columns encoded as JSON strings
+
+    Missing values (None, NaN or the empty string sentinel) become None, which
+    loads as a SQL NULL.
+    """
+    df_encoded = df_stage.copy(deep=False)
+    for col in get_json_cols(df_stage, col_data_types):
+        df_encoded[col] = pd.Series(
+            encode_json_values(df_stage[col].tolist()),
+            index=df_stage.index,
+            dtype=object,
+        )
+    return df_encoded
+
+
+class PreEncodedJSONB(JSONB):
+    """A JSONB column type for values already encoded as JSON strings, which get sent
+    to PostgreSQL as they are (rather than encoded again)
+    """
+
+    cache_ok = True
+
+    def bind_processor(self, dialect):
+        return None
+
+
+def make_pre_encoded_col_data_types(col_data_types):
+    """Makes a copy of the col_data_types with PreEncodedJSONB for the JSONB columns"""
+    pre_encoded_col_data_types = {}
+    for col, data_type in col_data_types.items():
+        if utilities.lookup_data_type_sql_str(data_type) == 'jsonb':
+            data_type = PreEncodedJSONB
+        pre_encoded_col_data_types[col] = data_type
+    return pre_encoded_col_data_types
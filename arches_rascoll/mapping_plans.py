@@ -0,0 +1,441 @@
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+
+from arches_rascoll import general_configs
+from arches_rascoll import json_encoding
+from arches_rascoll import utilities
+
+"""
+Compiles the mapping configs (see: general_configs.ALL_MAPPING_CONFIGS) into
+immutable plan objects, which the transform engines (ref_collection.prep_transformed_data
+and columnar) and the SQL generator (ref_collection.make_sql_insert_steps) run from.
+
+A plan has all the names derived from a config (like the staging column
+f'{stage_field_prefix}{targ_field}' and the PostgreSQL type of each column) made
+once, rather than looked up and formatted again for every row. Compiling also
+checks the configs, and validate_raw_columns checks that the input data has the
+raw columns a plan needs, so config mistakes fail before a long transform starts.
+
+The staging columns of a mapping follow these naming rules:
+
+(1) The main value of a mapping goes into f'{stage_field_prefix}{targ_field}'.
+(2) Each of the tile_other_fields goes into f'{stage_field_prefix}{targ_field}'.
+(3) Mappings that make_tileid get a f'{stage_field_prefix}tileid' column.
+(4) Each of the default_values goes into f'{stage_field_prefix}{d_col}'.
+(5) Related resources get grouped into f'{stage_field_prefix}{group_source_field}related_objs'.
+(6) Mappings with tile_data get a f'{stage_field_prefix}tile_data' column.
+
+The tile_data of a mapping gets compiled into a TileDataTemplate, split into its
+constant values and the slots that copy the main value of the mapping. Each row's
+tile_data shares the constant values (rather than deep copying them for every row),
+and encodes itself as JSON by filling the slots of JSON fragments encoded once per
+template. So treat the tile_data values of staging data as read-only.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import general_configs, mapping_plans
+plan = mapping_plans.compile_staging_plan(general_configs.RSCI_MAPPING_CONFIGS)
+mapping_plans.validate_raw_columns(plan, df.columns)
+
+"""
+
+REQUIRED_CONFIG_KEYS = ['staging_table', 'raw_pk_col', 'mappings']
+REQUIRED_MAPPING_KEYS = ['raw_col', 'targ_table', 'targ_field', 'data_type', 'value_transform']
+REQUIRED_OTHER_FIELD_KEYS = ['raw_col', 'targ_field', 'data_type', 'value_transform']
+REQUIRED_RELATED_RESOURCE_KEYS = ['source_field_to_uuid', 'targ_field']
+
+
+def rebuild_plan(plan_class, values):
+    """Rebuilds a plan object (for pickling and copying)"""
+    return plan_class(**values)
+
+
+class Plan:
+    """A base class for immutable plan objects, with their attributes in __slots__"""
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{self.__class__.__name__} objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{self.__class__.__name__} objects are immutable')
+
+    def __reduce__(self):
+        return (rebuild_plan, (self.__class__, {name: getattr(self, name) for name in self.__slots__}))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({getattr(self, self.__slots__[0])!r})'
+
+
+class OtherFieldPlan(Plan):
+    """The plan for one of the tile_other_fields of a mapping"""
+
+    __slots__ = (
+        'stage_col',
+        'raw_col',
+        'targ_field',
+        'data_type',
+        'data_type_sql',
+        'value_transform',
+    )
+
+
+class DefaultValuePlan(Plan):
+    """The plan for one of the default_values of a mapping"""
+
+    __slots__ = (
+        'stage_col',
+        'd_col',
+        'data_type',
+        'data_type_sql',
+        'value',
+    )
+
+
+class RelatedResourcePlan(Plan):
+    """The plan for one of the related_resources of a mapping"""
+
+    __slots__ = (
+        'related_objs_col',
+        'source_field_to_uuid',
+        'rel_type_id',
+        'inverse_rel_type_id',
+        'multi_value',
+        'targ_field',
+    )
+
+
+class TileDataTemplate(Plan):
+    """The plan for the tile_data of a mapping, split into its constant values and
+    the slots that copy the main value of the mapping
+    """
+
+    __slots__ = (
+        'keys',
+        'constant_values',
+        'copy_keys',
+        'json_fragments',
+    )
+
+    def make_tile_data(self, copy_value):
+        """Makes the tile_data of a row, with the copy slots filled by its value"""
+        tile_data = TemplateTileData(self.constant_values)
+        for key in self.copy_keys:
+            dict.__setitem__(tile_data, key, copy_value)
+        tile_data.template = self
+        return tile_data
+
+    def encode_json(self, copy_value):
+        """Encodes the tile_data of a row as JSON, encoding only the copied value"""
+        if not self.copy_keys:
+            return self.json_fragments[0]
+        copy_json = json_encoding.encode_json_value(copy_value)
+        return copy_json.join(self.json_fragments)
+
+
+class TemplateTileData(dict):
+    """The tile_data of a row, made from a TileDataTemplate. Changing the keys or
+    values of the tile_data drops its template, so it then gets encoded as a plain
+    dict rather than from the JSON fragments of the template.
+    """
+
+    __slots__ = ('template',)
+
+    def _drop_template(self):
+        self.template = None
+
+    def __setitem__(self, key, value):
+        self._drop_template()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._drop_template()
+        dict.__delitem__(self, key)
+
+    def __ior__(self, other):
+        self._drop_template()
+        return dict.__ior__(self, other)
+
+    def update(self, *args, **kwargs):
+        self._drop_template()
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._drop_template()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self._drop_template()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._drop_template()
+        return dict.popitem(self)
+
+    def clear(self):
+        self._drop_template()
+        dict.clear(self)
+
+    def encode_json(self):
+        """Encodes the tile_data as JSON, from the JSON fragments of its template"""
+        template = getattr(self, 'template', None)
+        if template is None:
+            return json_encoding.encode_json_value(dict(self))
+        copy_value = self[template.copy_keys[0]] if template.copy_keys else None
+        return template.encode_json(copy_value)
+
+
+class MappingPlan(Plan):
+    """The plan for one mapping of a mapping config"""
+
+    __slots__ = (
+        'stage_targ_col',
+        'raw_col',
+        'targ_table',
+        'targ_field',
+        'stage_field_prefix',
+        'data_type',
+        'data_type_sql',
+        'value_transform',
+        'source_geojson',
+        'staging_geometry_format',
+        'make_tileid',
+        'tileid_col',
+        'other_fields',
+        'default_values',
+        'related_resources',
+        'related_tileid',
+        'tile_data',
+        'tile_data_col',
+        'nodegroupid_col',
+        'raw_cols',
+        'staging_columns',
+    )
+
+
+class StagingPlan(Plan):
+    """The plan for a mapping config (and its staging table)"""
+
+    __slots__ = (
+        'staging_table',
+        'model_staging_schema',
+        'model_id',
+        'raw_pk_col',
+        'load_path',
+        'mappings',
+        'raw_cols',
+    )
+
+
+def get_missing_keys(config_dict, required_keys):
+    """Gets the required keys missing from a config dict"""
+    return [key for key in required_keys if config_dict.get(key) is None]
+
+
+def check_mapping_config(mapping, label):
+    """Gets a list of the problems with a mapping config"""
+    problems = []
+    missing = get_missing_keys(mapping, REQUIRED_MAPPING_KEYS)
+    if missing:
+        problems.append(f'{label} lacks: {missing}')
+    if not isinstance(mapping.get('stage_field_prefix'), str):
+        problems.append(f'{label} needs a stage_field_prefix string')
+    if mapping.get('value_transform') is not None and not callable(mapping.get('value_transform')):
+        problems.append(f'{label} value_transform is not callable')
+    for i, tile_other_field_config in enumerate(mapping.get('tile_other_fields', [])):
+        missing = get_missing_keys(tile_other_field_config, REQUIRED_OTHER_FIELD_KEYS)
+        if missing:
+            problems.append(f'{label} tile_other_fields[{i}] lacks: {missing}')
+        elif not callable(tile_other_field_config.get('value_transform')):
+            problems.append(f'{label} tile_other_fields[{i}] value_transform is not callable')
+    for i, default_value in enumerate(mapping.get('default_values', [])):
+        if len(default_value) != 3:
+            problems.append(f'{label} default_values[{i}] is not a (column, data_type, value) tuple')
+    for i, rel_dict in enumerate(mapping.get('related_resources', [])):
+        missing = get_missing_keys(rel_dict, REQUIRED_RELATED_RESOURCE_KEYS)
+        if missing:
+            problems.append(f'{label} related_resources[{i}] lacks: {missing}')
+    if mapping.get('tile_data') is not None and not isinstance(mapping.get('tile_data'), dict):
+        problems.append(f'{label} tile_data is not a dict')
+    if mapping.get('related_tileid'):
+        missing = get_missing_keys(mapping.get('related_tileid'), ['targ_tile_field', 'source_tile_field'])
+        if missing:
+            problems.append(f'{label} related_tileid lacks: {missing}')
+    return problems
+
+
+def check_configs(configs):
+    """Raises a ValueError listing the problems with a mapping config, if it has any"""
+    staging_table = configs.get('staging_table')
+    problems = []
+    missing = get_missing_keys(configs, REQUIRED_CONFIG_KEYS)
+    if missing:
+        problems.append(f'config lacks: {missing}')
+    for i, mapping in enumerate(configs.get('mappings') or []):
+        problems += check_mapping_config(mapping, f'mappings[{i}]')
+    if problems:
+        raise ValueError(f'Invalid mapping config for {staging_table}: ' + '; '.join(problems))
+
+
+def add_unique(items, item):
+    """Adds an item to a list, if the list doesn't already have it"""
+    if item and item not in items:
+        items.append(item)
+
+
+def compile_tile_data_template(tile_data):
+    """Compiles the tile_data of a mapping config into a TileDataTemplate
+
+    The JSON fragments are the JSON of the tile_data, split at the copy slots, so
+    joining them with the JSON of a copied value gives the JSON of a row's tile_data.
+    """
+    keys = []
+    constant_values = {}
+    copy_keys = []
+    json_fragments = []
+    fragment = '{'
+    for i, (key, val) in enumerate(tile_data.items()):
+        keys.append(key)
+        if i > 0:
+            fragment += ','
+        fragment += json_encoding.encode_json_value(key) + ':'
+        if val == general_configs.TILE_DATA_COPY_FLAG:
+            # A placeholder, so the copied values keep their place in the key order.
+            constant_values[key] = None
+            copy_keys.append(key)
+            json_fragments.append(fragment)
+            fragment = ''
+            continue
+        constant_values[key] = val
+        fragment += json_encoding.encode_json_value(val)
+    json_fragments.append(fragment + '}')
+    return TileDataTemplate(
+        keys=tuple(keys),
+        constant_values=constant_values,
+        copy_keys=tuple(copy_keys),
+        json_fragments=tuple(json_fragments),
+    )
+
+
+def compile_mapping_plan(mapping):
+    """Compiles a (checked) mapping config into a MappingPlan"""
+    stage_field_prefix = mapping.get('stage_field_prefix')
+    stage_targ_col = f"{stage_field_prefix}{mapping.get('targ_field')}"
+    raw_cols = [mapping.get('raw_col')]
+    other_fields = []
+    for tile_other_field_config in mapping.get('tile_other_fields', []):
+        other_fields.append(
+            OtherFieldPlan(
+                stage_col=f"{stage_field_prefix}{tile_other_field_config.get('targ_field')}",
+                raw_col=tile_other_field_config.get('raw_col'),
+                targ_field=tile_other_field_config.get('targ_field'),
+                data_type=tile_other_field_config.get('data_type'),
+                data_type_sql=utilities.lookup_data_type_sql_str(tile_other_field_config.get('data_type')),
+                value_transform=tile_other_field_config.get('value_transform'),
+            )
+        )
+        add_unique(raw_cols, tile_other_field_config.get('raw_col'))
+    default_values = []
+    for d_col, d_type, d_val in mapping.get('default_values', []):
+        default_values.append(
+            DefaultValuePlan(
+                stage_col=f'{stage_field_prefix}{d_col}',
+                d_col=d_col,
+                data_type=d_type,
+                data_type_sql=utilities.lookup_data_type_sql_str(d_type),
+                value=d_val,
+            )
+        )
+    related_resources = []
+    for rel_dict in mapping.get('related_resources', []):
+        related_resources.append(
+            RelatedResourcePlan(
+                related_objs_col=f"{stage_field_prefix}{rel_dict.get('group_source_field', '')}related_objs",
+                source_field_to_uuid=rel_dict.get('source_field_to_uuid'),
+                rel_type_id=rel_dict.get('rel_type_id'),
+                inverse_rel_type_id=rel_dict.get('inverse_rel_type_id'),
+                multi_value=rel_dict.get('multi_value', False),
+                targ_field=rel_dict.get('targ_field'),
+            )
+        )
+        add_unique(raw_cols, rel_dict.get('source_field_to_uuid'))
+    tile_data = None
+    if mapping.get('tile_data'):
+        tile_data = compile_tile_data_template(mapping.get('tile_data'))
+    related_tileid = None
+    if mapping.get('related_tileid'):
+        rel_tile_config = mapping.get('related_tileid')
+        related_tileid = (rel_tile_config.get('targ_tile_field'), rel_tile_config.get('source_tile_field'))
+    tileid_col = f'{stage_field_prefix}tileid'
+    tile_data_col = f'{stage_field_prefix}tile_data'
+    # The (column, data_type, slot) tuples of the staging columns the mapping can make.
+    # The slot is one of 'targ', 'other', 'tileid', 'default', 'related_objs', or 'tile_data'.
+    staging_columns = [(stage_targ_col, mapping.get('data_type'), 'targ')]
+    staging_columns += [(other.stage_col, other.data_type, 'other') for other in other_fields]
+    if mapping.get('make_tileid'):
+        staging_columns.append((tileid_col, UUID, 'tileid'))
+    staging_columns += [(default.stage_col, default.data_type, 'default') for default in default_values]
+    staging_columns += [(rel.related_objs_col, JSONB, 'related_objs') for rel in related_resources]
+    if tile_data:
+        staging_columns.append((tile_data_col, general_configs.JSONB, 'tile_data'))
+    return MappingPlan(
+        stage_targ_col=stage_targ_col,
+        raw_col=mapping.get('raw_col'),
+        targ_table=mapping.get('targ_table'),
+        targ_field=mapping.get('targ_field'),
+        stage_field_prefix=stage_field_prefix,
+        data_type=mapping.get('data_type'),
+        data_type_sql=utilities.lookup_data_type_sql_str(mapping.get('data_type')),
+        value_transform=mapping.get('value_transform'),
+        source_geojson=bool(mapping.get('source_geojson')),
+        staging_geometry_format=mapping.get('staging_geometry_format'),
+        make_tileid=bool(mapping.get('make_tileid')),
+        tileid_col=tileid_col,
+        other_fields=tuple(other_fields),
+        default_values=tuple(default_values),
+        related_resources=tuple(related_resources),
+        related_tileid=related_tileid,
+        tile_data=tile_data,
+        tile_data_col=tile_data_col,
+        nodegroupid_col=f'{stage_field_prefix}nodegroupid',
+        raw_cols=tuple(raw_cols),
+        staging_columns=tuple(staging_columns),
+    )
+
+
+def compile_staging_plan(configs):
+    """Checks and compiles a mapping config into a StagingPlan"""
+    if isinstance(configs, StagingPlan):
+        return configs
+    check_configs(configs)
+    mapping_plans = tuple(compile_mapping_plan(mapping) for mapping in configs.get('mappings'))
+    raw_cols = [configs.get('raw_pk_col')]
+    for mapping_plan in mapping_plans:
+        for raw_col in mapping_plan.raw_cols:
+            add_unique(raw_cols, raw_col)
+    return StagingPlan(
+        staging_table=configs.get('staging_table'),
+        model_staging_schema=configs.get('model_staging_schema'),
+        model_id=configs.get('model_id'),
+        raw_pk_col=configs.get('raw_pk_col'),
+        load_path=configs.get('load_path'),
+        mappings=mapping_plans,
+        raw_cols=tuple(raw_cols),
+    )
+
+
+def compile_staging_plans(all_configs=general_configs.ALL_MAPPING_CONFIGS):
+    """Checks and compiles all the mapping configs, so any config mistake fails at once"""
+    return [compile_staging_plan(configs) for configs in all_configs]
+
+
+def validate_raw_columns(plan, columns):
+    """Raises a ValueError if the input data lacks raw columns that a plan needs"""
+    columns = set(columns)
+    missing = [col for col in plan.raw_cols if col not in columns]
+    if missing:
+        raise ValueError(f'The input data for {plan.staging_table} lacks the columns: {missing}')
@@ -1,17 +1,13 @@
 import pandas as pd
-import uuid as GenUUID
 
 from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import raw_data
+from arches_rascoll import utilities
 
 
-def prepare_save_persons_data(
-    df=None,
-    raw_path=general_configs.RAW_IMPORT_CSV, 
-    save_path=general_configs.IMPORT_RAW_PERSON_CSV
-):
-    """Prepare and save the persons data for import."""
-    if df is None:
-        df = pd.read_csv(raw_path)
+def get_persons_from_raw_data(df):
+    """Gets a dataframe of the persons named in the raw data."""
     person_cols = [
         'Acquired By (CLEAN_1)',
         'Acquired By (CLEAN_2)',
@@ -21,15 +17,32 @@ def prepare_save_persons_data(
     for col in person_cols:
         index = df[col].notnull()
         person_vals += df[index][col].unique().tolist()
-    person_vals = list(set(person_vals))
+    # Sorted, so the same name variant wins each run (see: utilities.drop_duplicate_names).
+    person_vals = sorted(set(person_vals), key=str)
     for person_val in person_vals:
         rows.append(
             {
-                'person_uuid': str(GenUUID.uuid4()),
+                'person_uuid': utilities.make_uuid('person', utilities.normalize_key(person_val)),
                 'person_name': person_val,
             }
         )
-    df_persons = pd.DataFrame(rows)
+    return utilities.drop_duplicate_names(pd.DataFrame(rows), 'person_name')
+
+
+@instrumentation.instrument_stage('persons')
+def prepare_save_persons_data(
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV, 
+    save_path=general_configs.IMPORT_RAW_PERSON_CSV,
+    registry=None,
+):
+    """Prepare and save the persons data for import."""
+    if registry:
+        # The persons already got extracted for the entity registry.
+        df_persons = registry['persons']['df']
+    else:
+        if df is None:
+            df = raw_data.load_raw_data(raw_path)
+        df_persons = get_persons_from_raw_data(df)
     df_persons.to_csv(save_path, index=False)
     return df_persons
-
@@ -3,12 +3,13 @@ import copy
 import datetime
 import json
 import os
-import uuid as GenUUID
 
 import numpy as np
 import pandas as pd
 
+import shapely
 from shapely.geometry import mapping, shape
+from shapely.strtree import STRtree
 
 from sqlalchemy import create_engine
 from sqlalchemy.sql import text
@@ -17,6 +18,9 @@ from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
 
 
 from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import raw_data
+from arches_rascoll import utilities
 
 
 def make_geo_point_geojson(lat, lon, to_json=True):
@@ -31,7 +35,157 @@ def make_geo_point_geojson(lat, lon, to_json=True):
     return geo_dict
 
 
-def prep_raw_geo_data(df):
+def make_geo_point_geojsons(lats, lons):
+    """Makes a list of GeoJSON point strings (like make_geo_point_geojson) from columns of coordinates"""
+    lats = pd.to_numeric(lats).astype(float).tolist()
+    lons = pd.to_numeric(lons).astype(float).tolist()
+    return [
+        json.dumps({"type": "Point", "coordinates": [lon, lat]}, ensure_ascii=False)
+        for lat, lon in zip(lats, lons)
+    ]
+
+
+def load_geojson_geometry(value):
+    """Loads a GeoJSON geometry (a dict or a JSON string) as a shapely geometry, or
+    returns None if it can't be loaded
+    """
+    try:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return shape(value)
+    except (ValueError, TypeError, KeyError, AttributeError, shapely.errors.ShapelyError):
+        return None
+
+
+def geojson_to_ewkb_hex(value):
+    """Converts a GeoJSON geometry to hex encoded EWKB (with the SRID), which
+    PostGIS casts straight to a geometry without parsing JSON
+    """
+    geom = load_geojson_geometry(value)
+    if geom is None:
+        return None
+    geom = shapely.set_srid(geom, general_configs.GEOMETRY_SRID)
+    return shapely.to_wkb(geom, hex=True, include_srid=True)
+
+
+def load_geojson_geometries(values):
+    """Loads a list of GeoJSON geometries (dicts or JSON strings) as an array of shapely
+    geometries in one call, with None for missing values and values that can't be loaded
+    """
+    geojsons = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        if isinstance(value, dict):
+            value = json.dumps(value, ensure_ascii=False)
+        elif not isinstance(value, str):
+            continue
+        geojsons[i] = value
+    return shapely.from_geojson(geojsons, on_invalid='ignore')
+
+
+def get_invalid_geometries(values, geoms):
+    """Gets a list of dicts describing the GeoJSON values that couldn't be loaded (as
+    the geoms array, see: load_geojson_geometries) or that are not valid geometries
+    """
+    invalids = []
+    loaded = ~shapely.is_missing(geoms)
+    not_valid = loaded & ~shapely.is_valid(geoms)
+    for i, value in enumerate(values.tolist()):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        if not loaded[i]:
+            invalids.append({'index': values.index[i], 'value': value, 'reason': 'Not a GeoJSON geometry'})
+        elif not_valid[i]:
+            invalids.append({'index': values.index[i], 'value': value, 'reason': shapely.is_valid_reason(geoms[i])})
+    return invalids
+
+
+def convert_ewkb_geometries(df, plan, max_examples=5):
+    """Converts the GeoJSON geometries in the raw columns of the mappings that get
+    staged as EWKB to hex encoded EWKB (see: geojson_to_ewkb_hex), reporting the
+    invalid geometries before we transform and load them
+
+    Each raw column gets parsed by shapely only once, for both the report and the
+    conversion. The plan is a compiled mapping config (see: mapping_plans.compile_staging_plan).
+    Returns a dict of raw_col -> list of EWKB values, in the order of the rows of df.
+    Values that can't be loaded become None, and get staged as NULL. Values that load
+    but are not valid geometries still get converted (PostGIS accepts them), but we
+    report them.
+    """
+    ewkb_values = {}
+    for mapping in plan.mappings:
+        if mapping.staging_geometry_format != 'ewkb':
+            continue
+        raw_col = mapping.raw_col
+        if raw_col not in df.columns or raw_col in ewkb_values:
+            continue
+        geoms = load_geojson_geometries(df[raw_col].tolist())
+        invalids = get_invalid_geometries(df[raw_col], geoms)
+        if invalids:
+            print(f'{len(invalids)} invalid geometries in {plan.staging_table} column {raw_col}, for example:')
+            for invalid in invalids[:max_examples]:
+                print(f"    row {invalid['index']}: {invalid['reason']}: {str(invalid['value'])[:80]}")
+        geoms = shapely.set_srid(geoms, general_configs.GEOMETRY_SRID)
+        ewkb_values[raw_col] = shapely.to_wkb(geoms, hex=True, include_srid=True).tolist()
+    return ewkb_values
+
+
+def get_point_clusters(lons, lats, merge_distance):
+    """Gets a cluster label for each point, where points within merge_distance of
+    each other (directly, or through a chain of other close points) share a label
+
+    The STRtree spatial index finds the nearby pairs of points without comparing
+    every point to every other point.
+    """
+    points = shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    tree = STRtree(points)
+    left, right = tree.query(points, predicate='dwithin', distance=merge_distance)
+    labels = np.arange(len(points))
+    while True:
+        # Give each point the smallest label of its neighbors, until nothing changes.
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, left, labels[right])
+        np.minimum.at(new_labels, right, labels[left])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def merge_nearby_places(df_all_geo, merge_distance):
+    """Merges places within merge_distance (in degrees) of each other into one place
+
+    The most commonly used place in a cluster is its representative. The other places
+    in the cluster keep their own URIs (so the raw data still joins to them), but they
+    get the representative's place_uuid, statement and geo_point. The representatives
+    get sorted last, so their values win when the staging rows get merged by place_uuid.
+    """
+    df_all_geo = df_all_geo.reset_index(drop=True)
+    valid_pos = np.flatnonzero((df_all_geo['place_uuid'] != '').to_numpy())
+    if not len(valid_pos):
+        return df_all_geo
+    df_valid = df_all_geo.iloc[valid_pos]
+    labels = get_point_clusters(df_valid['longitude'], df_valid['latitude'], merge_distance)
+    # Sort by cluster, then most used first, to find the representative of each cluster.
+    order = np.lexsort((valid_pos, -df_valid['count'].to_numpy(), labels))
+    first_in_cluster = np.ones(len(order), dtype=bool)
+    first_in_cluster[1:] = labels[order][1:] != labels[order][:-1]
+    rep_by_label = dict(zip(labels[order][first_in_cluster], valid_pos[order][first_in_cluster]))
+    rep_pos = np.array([rep_by_label[label] for label in labels])
+    for col in ['place_uuid', 'statement', 'geo_point']:
+        values = df_all_geo[col].to_numpy(dtype=object).copy()
+        values[valid_pos] = values[rep_pos]
+        df_all_geo[col] = values
+    is_rep = np.zeros(len(df_all_geo.index), dtype=bool)
+    is_rep[rep_pos] = True
+    print(
+        f'Merged {len(valid_pos)} places into {len(rep_by_label)} places '
+        f'within {merge_distance} degrees of each other'
+    )
+    return df_all_geo.iloc[np.argsort(is_rep, kind='stable')].reset_index(drop=True)
+
+
+@instrumentation.instrument_stage('prep_raw_geo_data')
+def prep_raw_geo_data(df, merge_distance=general_configs.PLACE_MERGE_DISTANCE):
     cols = ['specific_place', 'specific_place_uri', 'specific_geojson', 'latitude', 'longitude']
     cols_b = ['specific_place_2', 'specific_place_uri_2', 'specific_geojson_2', 'latitude_2', 'longitude_2']
     col_rename = {c: c.replace('_2', '') for c in cols_b}
@@ -50,61 +204,94 @@ def prep_raw_geo_data(df):
     df_all_geo = pd.concat(dfs)
     # Ensure we have unique rows for a given URI.
     df_all_geo.drop_duplicates(subset=['specific_place_uri'], inplace=True)
-    df_all_geo['place_uuid'] = ''
-    df_all_geo['geo_point'] = ''
-    df_all_geo['statement'] = ''
-    for _, row in df_all_geo.iterrows():
-        lat = row['latitude']
-        lon = row['longitude']
-        if np.isnan(lat) or np.isnan(lon):
-            continue
-        index = df_all_geo['specific_place_uri'] == row['specific_place_uri']
-        statement_text = f"{row['specific_place']} (URI: {row['specific_place_uri']})"
-        df_all_geo.loc[index, 'place_uuid'] = str(GenUUID.uuid4())
-        df_all_geo.loc[index, 'statement'] = statement_text
-        df_all_geo.loc[index, 'geo_point'] = make_geo_point_geojson(lat, lon)
+    # Only places with a URI and coordinates get a place_uuid, statement and geo_point.
+    # The rows are unique by URI, so we assign these a whole column at a time.
+    valid = (
+        df_all_geo['specific_place_uri'].notnull()
+        & df_all_geo['latitude'].notnull()
+        & df_all_geo['longitude'].notnull()
+    ).to_numpy()
+    df_valid = df_all_geo[valid]
+    place_uuids = np.full(len(df_all_geo.index), '', dtype=object)
+    statements = np.full(len(df_all_geo.index), '', dtype=object)
+    geo_points = np.full(len(df_all_geo.index), '', dtype=object)
+    place_uuids[valid] = [
+        utilities.make_uuid('place', uri) for uri in df_valid['specific_place_uri'].tolist()
+    ]
+    statements[valid] = (
+        df_valid['specific_place'].astype(str)
+        + ' (URI: '
+        + df_valid['specific_place_uri'].astype(str)
+        + ')'
+    ).tolist()
+    geo_points[valid] = make_geo_point_geojsons(df_valid['latitude'], df_valid['longitude'])
+    df_all_geo['place_uuid'] = place_uuids
+    df_all_geo['geo_point'] = geo_points
+    df_all_geo['statement'] = statements
+    if merge_distance:
+        df_all_geo = merge_nearby_places(df_all_geo, merge_distance)
     return df_all_geo
 
 
+@instrumentation.instrument_stage('places')
 def prepare_save_geo_data(
     df=None, 
     raw_path=general_configs.RAW_IMPORT_CSV, 
-    save_path=general_configs.IMPORT_PLACES_CSV
+    save_path=general_configs.IMPORT_PLACES_CSV,
+    merge_distance=general_configs.PLACE_MERGE_DISTANCE,
+    registry=None,
 ):
+    if registry:
+        # The places already got extracted for the entity registry.
+        df_all_geo = registry['places']['df']
+        df_all_geo.to_csv(save_path, index=False)
+        return df_all_geo
     if df is None:
-        df = pd.read_csv(raw_path)
-    df_all_geo = prep_raw_geo_data(df)
+        df = raw_data.load_raw_data(raw_path)
+    df_all_geo = prep_raw_geo_data(df, merge_distance=merge_distance)
     df_all_geo.to_csv(save_path, index=False)
     return df_all_geo
 
 
+@instrumentation.instrument_stage('rsci_places')
 def prepare_rsci_place_data(
     df=None, 
     raw_path=general_configs.RAW_IMPORT_CSV,
     geo_path=general_configs.IMPORT_PLACES_CSV,
     rsci_geo_path=general_configs.IMPORT_RSCI_PLACES_CSV,
+    registry=None,
 ):
     if df is None:
-        df = pd.read_csv(raw_path)
-    if not os.path.exists(geo_path):
-        df_all_geo = prepare_save_geo_data(
-            df, 
-            raw_path=raw_path,
-            save_path=geo_path,
-        )
-    else:
-        df_all_geo = pd.read_csv(geo_path)
+        df = raw_data.load_raw_data(raw_path)
     keep_cols = ['rsci_uuid', 'specific_place_uri', 'specific_place_uri_2']
     df_rsci_geo = df[keep_cols].copy()
     df_rsci_geo.rename(columns={'specific_place_uri': 'specific_place_uri_1'}, inplace=True)
-    copy_geo_cols = ['place_uuid', 'specific_place_uri', 'geo_point']
-    df_geo_trim = df_all_geo[copy_geo_cols].copy()
-    for i in [1, 2]:
-        renames = {col: f'{col}_{i}' for col in df_geo_trim.columns.tolist()}
-        df_act_geo = df_geo_trim.copy()
-        df_act_geo.rename(columns=renames, inplace=True)
-        join_col = f'specific_place_uri_{i}'
-        df_rsci_geo = df_rsci_geo.merge(df_act_geo, how='left', left_on=join_col, right_on=join_col)
+    if registry:
+        # Look up the places by URI with the indexes of the entity registry, rather
+        # than merging with all the places.
+        for i in [1, 2]:
+            uris = df_rsci_geo[f'specific_place_uri_{i}']
+            for col, index_key in [('place_uuid', 'index'), ('geo_point', 'geo_point_index')]:
+                values = utilities.lookup_values(uris, registry['places'][index_key], missing_value=np.nan)
+                # Empty strings are missing values, as they are when read from the geo_path.
+                df_rsci_geo[f'{col}_{i}'] = values.replace({'': np.nan})
+    else:
+        if not os.path.exists(geo_path):
+            df_all_geo = prepare_save_geo_data(
+                df, 
+                raw_path=raw_path,
+                save_path=geo_path,
+            )
+        else:
+            df_all_geo = pd.read_csv(geo_path)
+        copy_geo_cols = ['place_uuid', 'specific_place_uri', 'geo_point']
+        df_geo_trim = df_all_geo[copy_geo_cols].copy()
+        for i in [1, 2]:
+            renames = {col: f'{col}_{i}' for col in df_geo_trim.columns.tolist()}
+            df_act_geo = df_geo_trim.copy()
+            df_act_geo.rename(columns=renames, inplace=True)
+            join_col = f'specific_place_uri_{i}'
+            df_rsci_geo = df_rsci_geo.merge(df_act_geo, how='left', left_on=join_col, right_on=join_col)
     good_index = (df_rsci_geo['place_uuid_1'].notnull() | df_rsci_geo['place_uuid_2'].notnull())
     df_rsci_geo = df_rsci_geo[good_index].copy()
     df_rsci_geo.to_csv(rsci_geo_path, index=False)
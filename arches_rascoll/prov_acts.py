@@ -1,19 +1,24 @@
 import pandas as pd
-import uuid as GenUUID
 
+from arches_rascoll import entity_registry
 from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import raw_data
+from arches_rascoll import utilities
 
 
+@instrumentation.instrument_stage('prov_acts')
 def prepare_save_prov_acts_data(
     df=None,
     raw_path=general_configs.RAW_IMPORT_CSV,
     persons_path=general_configs.IMPORT_RAW_PERSON_CSV,
     groups_path=general_configs.IMPORT_RAW_GROUP_CSV,
     save_path=general_configs.IMPORT_RAW_PROV_ACT_CSV,
+    registry=None,
 ):
     """Prepare and save the persons data for import."""
     if df is None:
-        df = pd.read_csv(raw_path)
+        df = raw_data.load_raw_data(raw_path)
 
     person_name_id_cols = [
         ('Acquired By (CLEAN_1)', 'acq_by_person_1_uuid'),
@@ -50,22 +55,28 @@ def prepare_save_prov_acts_data(
     df_prov_acts['set_uuid'] = general_configs.GCI_REF_COL_SET_UUID
     df_prov_acts['prov_act_uuid'] = ''
     df_prov_acts['Barcode No.'] = df_prov_acts['Barcode No.'].astype(str)
-    df_prov_acts['prov_act_uuid'] = df_prov_acts['prov_act_uuid'].apply(lambda x: str(GenUUID.uuid4()))
-    df_prov_acts['prov_act_name'] = 'Acquisition of Barcode ' + df_prov_acts['Barcode No.'].str.strip().replace('.0', '', regex=True)  
-    df_persons = pd.read_csv(persons_path)
-    for name_col, id_col in person_name_id_cols:
-        df_prov_acts = df_prov_acts.merge(df_persons, how='left', left_on=name_col, right_on='person_name')
-        df_prov_acts.drop(columns=['person_name'], inplace=True)
-        df_prov_acts.rename(columns={'person_uuid': id_col}, inplace=True)
-        null_index = df_prov_acts[id_col].isnull()
-        df_prov_acts.loc[null_index, id_col] = ''
-    df_groups = pd.read_csv(groups_path)
-    for name_col, id_col in group_name_id_cols:
-        df_prov_acts = df_prov_acts.merge(df_groups, how='left', left_on=name_col, right_on='group_name')
-        df_prov_acts.drop(columns=['group_name'], inplace=True)
-        df_prov_acts.rename(columns={'group_uuid': id_col}, inplace=True)
-        null_index = df_prov_acts[id_col].isnull()
-        df_prov_acts.loc[null_index, id_col] = ''
+    df_prov_acts['prov_act_uuid'] = [
+        utilities.make_uuid('prov_act', rsci_uuid) for rsci_uuid in df_prov_acts['rsci_uuid'].tolist()
+    ]
+    df_prov_acts['prov_act_name'] = 'Acquisition of Barcode ' + df_prov_acts['Barcode No.'].str.strip()
+    if registry:
+        # Resolve the names with the (normalized name) indexes of the entity registry.
+        for name_col, id_col in person_name_id_cols:
+            df_prov_acts[id_col] = entity_registry.lookup_entity_uuids(registry, 'persons', df_prov_acts[name_col])
+        for name_col, id_col in group_name_id_cols:
+            df_prov_acts[id_col] = entity_registry.lookup_entity_uuids(registry, 'groups', df_prov_acts[name_col])
+    else:
+        # Index the persons and groups by normalized name, so we can resolve all the
+        # name columns (and name variants that differ in case or whitespace) with
+        # lookups rather than joins.
+        persons_index = entity_registry.make_name_index(pd.read_csv(persons_path), 'person_name', 'person_uuid')
+        for name_col, id_col in person_name_id_cols:
+            keys = df_prov_acts[name_col].map(utilities.normalize_key, na_action='ignore')
+            df_prov_acts[id_col] = utilities.lookup_values(keys, persons_index)
+        groups_index = entity_registry.make_name_index(pd.read_csv(groups_path), 'group_name', 'group_uuid')
+        for name_col, id_col in group_name_id_cols:
+            keys = df_prov_acts[name_col].map(utilities.normalize_key, na_action='ignore')
+            df_prov_acts[id_col] = utilities.lookup_values(keys, groups_index)
     df_prov_acts = df_prov_acts[first_cols + end_cols].copy()
     # Let's only keep rows with at least some acquisition data
     good_index = (
@@ -0,0 +1,194 @@
+import os
+
+import pandas as pd
+
+from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import mapping_plans
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    # Without pyarrow, we just don't keep a Parquet copy of the raw data.
+    pyarrow = None
+
+"""
+Loads the raw data CSV (general_configs.RAW_IMPORT_CSV) for all the stages that use it.
+
+We only read the raw columns that the mapping configs and the entity data preparation
+(persons, groups, places and prov_acts) use, and we read them with declared dtypes
+rather than letting pandas guess. All the columns are read as strings, as written in
+the CSV (so barcodes like "100" don't become 100.0), except for the coordinates.
+
+A parsed raw dataframe gets cached in memory, so stages running in the same process
+only parse the CSV once. If pyarrow is installed, it also gets saved as a Parquet
+file next to the CSV, which other processes (see: scheduler) read much faster than
+the CSV. The Parquet file gets remade if the CSV is newer.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import raw_data
+df = raw_data.load_raw_data()
+
+"""
+
+# The raw columns used to prepare the entity data (see: persons, groups, places and prov_acts).
+ENTITY_RAW_COLS = [
+    'rsci_uuid',
+    'Barcode No.',
+    'Acquired By (CLEAN_1)',
+    'Acquired By (CLEAN_2)',
+    'Acquired By (Institution_1)',
+    'Acquired By (Institution_2)',
+    'Acquired From (CLEAN_1)',
+    'Acquired From (CLEAN_2)',
+    'Manufacturer (CLEAN)',
+    'Fire Safety',
+    'Health Safety',
+    'Other Safety',
+    'Reactivity Safety',
+    'Acquisition Date__begin_of_the_begin',
+    'Acquisition Date__end_of_the_begin',
+    'Acquisition Date__begin_of_the_end',
+    'Acquisition Date__end_of_the_end',
+    'specific_place',
+    'specific_place_uri',
+    'specific_geojson',
+    'latitude',
+    'longitude',
+    'specific_place_2',
+    'specific_place_uri_2',
+    'specific_geojson_2',
+    'latitude_2',
+    'longitude_2',
+]
+
+# The raw columns read as floats. All the other raw columns are read as strings.
+RAW_FLOAT_COLS = ['latitude', 'longitude', 'latitude_2', 'longitude_2']
+
+RAW_PARQUET_EXTENSION = '.parquet'
+
+# Parsed raw dataframes, keyed by (raw_path, modified time, columns).
+RAW_DF_CACHE = {}
+
+
+def get_config_raw_cols(configs):
+    """Gets the raw data columns that a mapping config uses"""
+    if configs.get('load_path'):
+        # The config uses data prepared from the raw data, not the raw data itself.
+        return []
+    return list(mapping_plans.compile_staging_plan(configs).raw_cols)
+
+
+def get_raw_cols(all_configs=general_configs.ALL_MAPPING_CONFIGS, extra_cols=ENTITY_RAW_COLS):
+    """Gets the raw data columns to read for the mapping configs and the entity data"""
+    raw_cols = []
+    # Always include the columns of the default configs, so stages that only use some
+    # configs share the same cached raw data.
+    for configs in general_configs.ALL_MAPPING_CONFIGS + list(all_configs):
+        for col in get_config_raw_cols(configs):
+            if col and col not in raw_cols:
+                raw_cols.append(col)
+    for col in extra_cols:
+        if col not in raw_cols:
+            raw_cols.append(col)
+    return raw_cols
+
+
+def check_raw_columns(raw_path, raw_cols, all_configs=general_configs.ALL_MAPPING_CONFIGS):
+    """Checks that the header of the raw data CSV has the raw columns we read
+
+    Raises a ValueError naming each missing column and the mapping configs (or the
+    entity data preparation) that use it.
+    """
+    header_cols = pd.read_csv(raw_path, nrows=0).columns.tolist()
+    missing_cols = [col for col in raw_cols if col not in header_cols]
+    if not missing_cols:
+        return None
+    missing_descriptions = []
+    for col in missing_cols:
+        users = []
+        for configs in general_configs.ALL_MAPPING_CONFIGS + list(all_configs):
+            staging_table = configs.get('staging_table')
+            if col in get_config_raw_cols(configs) and staging_table not in users:
+                users.append(staging_table)
+        if col in ENTITY_RAW_COLS:
+            users.append('the entity data (persons, groups, places and prov_acts)')
+        missing_descriptions.append(f"'{col}' (used by {', '.join(users)})")
+    raise ValueError(
+        f'The raw data in {raw_path} is missing columns: {"; ".join(missing_descriptions)}'
+    )
+
+
+def get_raw_dtypes(raw_cols):
+    """Gets the declared dtypes of the raw data columns"""
+    return {col: (float if col in RAW_FLOAT_COLS else str) for col in raw_cols}
+
+
+def get_read_csv_kwargs(all_configs=general_configs.ALL_MAPPING_CONFIGS):
+    """Gets the pd.read_csv kwargs to read the raw data columns with declared dtypes"""
+    raw_cols = get_raw_cols(all_configs)
+    return {'usecols': raw_cols, 'dtype': get_raw_dtypes(raw_cols)}
+
+
+def make_raw_parquet_path(raw_path):
+    """Makes the path of the Parquet copy of a raw data CSV"""
+    return os.path.splitext(raw_path)[0] + RAW_PARQUET_EXTENSION
+
+
+def load_raw_parquet(raw_path, raw_cols):
+    """Loads the Parquet copy of the raw data, or None if it's missing or out of date"""
+    parquet_path = make_raw_parquet_path(raw_path)
+    if pyarrow is None or not os.path.exists(parquet_path):
+        return None
+    if os.path.getmtime(parquet_path) < os.path.getmtime(raw_path):
+        return None
+    try:
+        return pd.read_parquet(parquet_path, columns=raw_cols)
+    except Exception:
+        # Likely saved for other raw columns, so we'll remake it.
+        return None
+
+
+def save_raw_parquet(df, raw_path):
+    """Saves a Parquet copy of the raw data, if pyarrow is installed"""
+    if pyarrow is None:
+        return None
+    parquet_path = make_raw_parquet_path(raw_path)
+    # Write to a temporary file first, since other processes may read the Parquet file.
+    temp_path = f'{parquet_path}.{os.getpid()}.tmp'
+    df.to_parquet(temp_path, index=False)
+    os.replace(temp_path, parquet_path)
+    return parquet_path
+
+
+@instrumentation.instrument_stage('load_raw_data')
+def load_raw_data(
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    use_cache=True,
+):
+    """Loads the raw data columns used by the ETL, with declared dtypes
+
+    Returns a copy of the cached dataframe, so stages can't change the cached data.
+    """
+    raw_cols = get_raw_cols(all_configs)
+    cache_key = (os.path.abspath(raw_path), os.path.getmtime(raw_path), tuple(raw_cols))
+    if use_cache and cache_key in RAW_DF_CACHE:
+        return RAW_DF_CACHE[cache_key].copy()
+    df = None
+    if use_cache:
+        df = load_raw_parquet(raw_path, raw_cols)
+    if df is None:
+        check_raw_columns(raw_path, raw_cols, all_configs)
+        df = pd.read_csv(raw_path, usecols=raw_cols, dtype=get_raw_dtypes(raw_cols))
+        # Keep the column order the same, however the CSV orders them.
+        df = df[raw_cols]
+        if use_cache:
+            save_raw_parquet(df, raw_path)
+    print(f'Loaded {len(df.index)} rows and {len(raw_cols)} columns of raw data from: {raw_path}')
+    if use_cache:
+        RAW_DF_CACHE.clear()
+        RAW_DF_CACHE[cache_key] = df
+        return df.copy()
+    return df
@@ -1,7 +1,8 @@
 import copy
+import hashlib
 import json
 import os
-import uuid as GenUUID
+import warnings
 
 import numpy as np
 import pandas as pd
@@ -13,8 +14,19 @@ from sqlalchemy.sql import text
 from sqlalchemy.types import JSON, Float, Text, DateTime, Integer
 from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
 
+from arches_rascoll import columnar
+from arches_rascoll import copy_loader
+from arches_rascoll import delta as raw_delta
+from arches_rascoll import entity_registry
+from arches_rascoll import fingerprints
 from arches_rascoll import general_configs
+from arches_rascoll import instrumentation
+from arches_rascoll import json_encoding
+from arches_rascoll import mapping_plans
 from arches_rascoll import places
+from arches_rascoll import raw_data
+from arches_rascoll import schema_planner
+from arches_rascoll import staging_artifacts
 from arches_rascoll import utilities
 
 """
@@ -26,13 +38,21 @@ sqls = ref_collection.prepare_all_sql_inserts()
 
 """
 
+# PostgreSQL truncates identifiers (like index names) longer than this.
+POSTGRES_MAX_IDENTIFIER_LEN = 63
 
-def save_data_to_csv_with_objects_as_json(df_stage, col_data_types, path):
-    """Saves a dataframe to a CSV file with JSON objects as strings"""
+
+def save_data_to_csv_with_objects_as_json(df_stage, col_data_types, path, append=False, json_encoded=False):
+    """Saves a dataframe to a CSV file with JSON objects as strings
+
+    If append is True, the rows get added (without a header) to the end of an existing CSV.
+    If json_encoded is True, the JSONB columns are already JSON strings (see:
+    json_encoding.encode_json_columns).
+    """
     df_temp = df_stage.copy()
     for col, data_type in col_data_types.items():
         mapped_data_type = utilities.lookup_data_type_sql_str(data_type)
-        if mapped_data_type == 'jsonb':
+        if mapped_data_type == 'jsonb' and not json_encoded:
             index = (
                 df_temp[col].notnull() 
             )
@@ -47,6 +67,9 @@ def save_data_to_csv_with_objects_as_json(df_stage, col_data_types, path):
                 df_temp[col].notnull() 
             )
             df_temp.loc[index, col] = df_temp[index][col].apply(lambda x: json.dumps(x))
+    if append:
+        df_temp.to_csv(path, index=False, mode='a', header=False)
+        return
     df_temp.to_csv(path, index=False)
 
 
@@ -54,6 +77,10 @@ def make_objs_from_json_strings(df_stage, col_data_types):
     """Makes JSON objects from JSON strings in a dataframe"""
     for col, data_type in col_data_types.items():
         mapped_data_type = utilities.lookup_data_type_sql_str(data_type)
+        if mapped_data_type in ['jsonb', 'uuid[]']:
+            # A column may have been read as all nulls (floats), so make sure
+            # it can hold objects.
+            df_stage[col] = df_stage[col].astype(object)
         if mapped_data_type == 'jsonb':
             index = (
                 df_stage[col].notnull() 
@@ -71,6 +98,43 @@ def make_objs_from_json_strings(df_stage, col_data_types):
     return df_stage
 
 
+@instrumentation.instrument_stage('save_staging_artifact')
+def save_staging_artifact(df_stage, col_data_types, path, df_encoded=None):
+    """Saves staging data as CSV or as Parquet, depending on the path
+
+    The df_encoded is the staging data with the JSONB columns already encoded (see:
+    json_encoding.encode_json_columns), which we reuse rather than encode again.
+    """
+    if staging_artifacts.is_parquet_path(path):
+        staging_artifacts.save_staging_parquet(df_stage, col_data_types, path, df_encoded=df_encoded)
+        return
+    if df_encoded is not None:
+        save_data_to_csv_with_objects_as_json(df_encoded, col_data_types, path, json_encoded=True)
+        return
+    save_data_to_csv_with_objects_as_json(df_stage, col_data_types, path)
+
+
+@instrumentation.instrument_stage('load_staging_artifact')
+def load_staging_artifact(path, configs):
+    """Loads saved staging data (CSV or Parquet) for a mapping config
+
+    Returns the staging dataframe and its col_data_types, or (None, None) if the
+    saved data doesn't have the columns that the config makes.
+    """
+    is_parquet = staging_artifacts.is_parquet_path(path)
+    if is_parquet:
+        df_prior = staging_artifacts.load_staging_parquet(path)
+    else:
+        df_prior = pd.read_csv(path)
+    col_data_types = schema_planner.get_col_data_types_for_columns(configs, df_prior.columns.tolist())
+    if col_data_types is None:
+        return None, None
+    if not is_parquet:
+        # Parquet keeps the JSON objects, but the CSV has them as strings.
+        df_prior = make_objs_from_json_strings(df_prior, col_data_types)
+    return df_prior, col_data_types
+
+
 def make_transformed_value(act_raw_value, data_type, value_transform):
     """Makes a transformed value based on the data type and value transform"""
     if data_type == JSONB \
@@ -85,48 +149,80 @@ def make_transformed_value(act_raw_value, data_type, value_transform):
     return value_transform(act_raw_value)
 
 
-def prep_transformed_data(df, configs):
-    """Prepares a dataset from the dataframe df for transformation into a staging table"""
+def make_ewkb_geometry_configs(configs):
+    """Makes a copy of the configs where the source_geojson mappings stage their
+    geometries as hex encoded EWKB text (see: places.geojson_to_ewkb_hex)
+    """
+    ewkb_configs = copy.copy(configs)
+    ewkb_configs['mappings'] = []
+    for mapping in configs.get('mappings'):
+        if mapping.get('source_geojson') and mapping.get('staging_geometry_format') != 'ewkb':
+            mapping = copy.copy(mapping)
+            mapping['value_transform'] = places.geojson_to_ewkb_hex
+            mapping['data_type'] = Text
+            mapping['staging_geometry_format'] = 'ewkb'
+        ewkb_configs['mappings'].append(mapping)
+    return ewkb_configs
+
+
+@instrumentation.instrument_stage('prep_transformed_data')
+def prep_transformed_data(df, configs, columnar_mode=False, plan=None):
+    """Prepares a dataset from the dataframe df for transformation into a staging table
+
+    If columnar_mode is True, we apply each mapping to whole columns of the dataframe
+    (see: columnar.prep_transformed_data_columnar), which gives the same results
+    much faster. Otherwise, we use the row-wise loop below as the reference implementation.
+
+    Both run from the compiled plan of the configs (see: mapping_plans). Pass a plan
+    already checked against the columns of df to skip compiling and checking it again
+    (for example, for each chunk of the same data).
+    """
+    if plan is None:
+        plan = mapping_plans.compile_staging_plan(configs)
+        mapping_plans.validate_raw_columns(plan, df.columns)
+    # Parse the geometries that get staged as EWKB once, to report the invalid ones
+    # (if any) and to convert them.
+    ewkb_values = places.convert_ewkb_geometries(df, plan)
+    if columnar_mode:
+        return columnar.prep_transformed_data_columnar(df, plan, ewkb_values=ewkb_values)
     dict_rows = {}
     col_data_types = {}
-    for _, row in df.iterrows():
+    for row_i, (_, row) in enumerate(df.iterrows()):
         # Given the small data volumes, I'm not bothering to optimize performance with
         # vectorized operations. We'll just iterate through the rows.
-        raw_pk = row[configs.get('raw_pk_col')]
+        raw_pk = row[plan.raw_pk_col]
         if not dict_rows.get(raw_pk):
             dict_rows[raw_pk] = {}
-        for mapping in configs.get('mappings'):
-            raw_col = mapping.get('raw_col')
-            stage_field_prefix = mapping.get('stage_field_prefix')
-            value_transform = mapping.get('value_transform')
-            targ_field = mapping.get('targ_field')
-            data_type = mapping.get('data_type')
-            stage_targ_field = f'{stage_field_prefix}{targ_field}'
+        for mapping in plan.mappings:
+            stage_field_prefix = mapping.stage_field_prefix
+            data_type = mapping.data_type
+            stage_targ_field = mapping.stage_targ_col
             col_data_types[stage_targ_field] = data_type
-            if pd.isnull(row[raw_col]):
+            if pd.isnull(row[mapping.raw_col]):
                 continue
-            act_raw_value = row[raw_col]
+            act_raw_value = row[mapping.raw_col]
             # The transformed value will be the value that we will insert into the staging table and
             # then moved into Arches
             all_transformed_values = []
-            transformed_value = make_transformed_value(act_raw_value, data_type, value_transform)
+            if mapping.staging_geometry_format == 'ewkb' and mapping.raw_col in ewkb_values:
+                transformed_value = ewkb_values[mapping.raw_col][row_i]
+            else:
+                transformed_value = make_transformed_value(act_raw_value, data_type, mapping.value_transform)
             all_transformed_values.append(transformed_value)
-            if mapping.get('tile_other_fields'):
-                for tile_other_field_config in mapping.get('tile_other_fields', []):
-                    other_raw_col = tile_other_field_config.get('raw_col')
-                    if pd.isnull( row[other_raw_col]):
-                        continue
-                    other_raw_value = row[other_raw_col]
-                    other_data_type = tile_other_field_config.get('data_type')
-                    other_targ_field = tile_other_field_config.get('targ_field')
-                    other_stage_targ_field = f'{stage_field_prefix}{other_targ_field}'
-                    other_value_transform = tile_other_field_config.get('value_transform')
-                    other_transformed_value = make_transformed_value(other_raw_value, other_data_type, other_value_transform)
-                    if other_transformed_value is None:
-                        continue
-                    all_transformed_values.append(other_transformed_value)
-                    dict_rows[raw_pk][other_stage_targ_field] = other_transformed_value
-                    col_data_types[other_stage_targ_field] = other_data_type
+            for other_field in mapping.other_fields:
+                if pd.isnull(row[other_field.raw_col]):
+                    continue
+                other_raw_value = row[other_field.raw_col]
+                other_transformed_value = make_transformed_value(
+                    other_raw_value,
+                    other_field.data_type,
+                    other_field.value_transform,
+                )
+                if other_transformed_value is None:
+                    continue
+                all_transformed_values.append(other_transformed_value)
+                dict_rows[raw_pk][other_field.stage_col] = other_transformed_value
+                col_data_types[other_field.stage_col] = other_field.data_type
             # Check to see if at least one field has a transformed value.
             transformed_value_ok = False
             for transformed_value in all_transformed_values:
@@ -134,43 +230,46 @@ def prep_transformed_data(df, configs):
                     transformed_value_ok = True
             if not transformed_value_ok:
                 continue
-            if mapping.get('make_tileid'):
-                tileid = str(GenUUID.uuid4())
-                staging_tileid = f'{stage_field_prefix}tileid'
-                dict_rows[raw_pk][staging_tileid] = tileid
-                col_data_types[staging_tileid] = UUID
+            if mapping.make_tileid:
+                tileid = utilities.make_uuid('tile', plan.staging_table, stage_field_prefix, raw_pk)
+                dict_rows[raw_pk][mapping.tileid_col] = tileid
+                col_data_types[mapping.tileid_col] = UUID
             dict_rows[raw_pk][stage_targ_field] = transformed_value
-            default_values = mapping.get('default_values', [])
-            for d_col, d_type, d_val in default_values:
-                default_col = f'{stage_field_prefix}{d_col}'
-                col_data_types[default_col] = d_type
-                dict_rows[raw_pk][default_col] = d_val
-            if mapping.get('related_resources'):
+            for default_value in mapping.default_values:
+                col_data_types[default_value.stage_col] = default_value.data_type
+                dict_rows[raw_pk][default_value.stage_col] = default_value.value
+            if mapping.related_resources:
                 # We have related resources to populate for this field.
                 rel_objs = {}
-                for rel_dict in mapping.get('related_resources', []):
+                for rel_resource in mapping.related_resources:
                     # We have related resources to populate in a dictionary
                     # Make a source_rel_objs_field for the related resources. Note that multiple source
                     # columns can go into the same related resources field, and that they will be
                     # grouped by the group_source_field.
-                    multi_value = rel_dict.get('multi_value', False)
-                    resource_id = row[rel_dict.get('source_field_to_uuid')]
+                    multi_value = rel_resource.multi_value
+                    resource_id = row[rel_resource.source_field_to_uuid]
                     if pd.isnull(resource_id) or not resource_id or str(resource_id) == 'NaN':
                         continue
-                    group_source_field = rel_dict.get('group_source_field', '')
-                    source_rel_objs_field = f'{stage_field_prefix}{group_source_field}related_objs'
+                    source_rel_objs_field = rel_resource.related_objs_col
                     if not rel_objs.get(source_rel_objs_field):
                         if multi_value:
                             rel_objs[source_rel_objs_field] = []
                         else:
                             rel_objs[source_rel_objs_field] = {}
-                    res_x_res_id = str(GenUUID.uuid4())
+                    res_x_res_id = utilities.make_uuid(
+                        'resource_x_resource',
+                        plan.staging_table,
+                        stage_field_prefix,
+                        rel_resource.source_field_to_uuid,
+                        raw_pk,
+                        resource_id,
+                    )
                     rel_obj = {
                         # This is the resource instance id that we are linking TO (towards)
                         "resourceId": resource_id,
-                        "ontologyProperty": rel_dict.get('rel_type_id'),
+                        "ontologyProperty": rel_resource.rel_type_id,
                         "resourceXresourceId": res_x_res_id,
-                        "inverseOntologyProperty": rel_dict.get('inverse_rel_type_id'),
+                        "inverseOntologyProperty": rel_resource.inverse_rel_type_id,
                     }
                     if multi_value:
                         rel_objs[source_rel_objs_field].append(rel_obj)
@@ -182,22 +281,208 @@ def prep_transformed_data(df, configs):
                     col_data_types[source_rel_objs_field] = JSONB
                     # only add one resource.
                     dict_rows[raw_pk][source_rel_objs_field] = copy.deepcopy(rel_obj_vals)
-            if not mapping.get('tile_data'):
+            if not mapping.tile_data:
                 continue
-            tile_data_col = f'{stage_field_prefix}tile_data'
-            col_data_types[tile_data_col] = general_configs.JSONB
-            tile_data = {}
-            for key, val in mapping.get('tile_data', {}).items():
-                if val == general_configs.TILE_DATA_COPY_FLAG:
-                    tile_data[key] = copy.deepcopy(dict_rows[raw_pk][stage_targ_field])
-                else:
-                    tile_data[key] = copy.deepcopy(val)
-            dict_rows[raw_pk][tile_data_col] = tile_data
+            col_data_types[mapping.tile_data_col] = general_configs.JSONB
+            dict_rows[raw_pk][mapping.tile_data_col] = mapping.tile_data.make_tile_data(
+                dict_rows[raw_pk][stage_targ_field]
+            )
     rows = [dict(row) for _, row in dict_rows.items()]
     df_staging = pd.DataFrame(rows)
     return df_staging, col_data_types
 
 
+@instrumentation.instrument_stage('load_staging_data')
+def load_staging_data(
+    df_stage,
+    staging_table,
+    col_data_types,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    db_url=general_configs.ARCHES_DB_URL,
+    loader='to_sql',
+    replace=True,
+    json_encoded=False,
+):
+    """Loads a staging dataframe into a staging table
+
+    The loader can be 'to_sql' (INSERTs via SQLAlchemy) or 'copy' (the much
+    faster PostgreSQL COPY, see: copy_loader.copy_df_to_staging_table). If json_encoded
+    is True, the JSONB columns are already JSON strings, which get loaded as they are.
+    """
+    if loader == 'copy':
+        return copy_loader.copy_df_to_staging_table(
+            df_stage,
+            staging_table,
+            col_data_types,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            replace=replace,
+        )
+    if loader != 'to_sql':
+        raise ValueError(f'Unknown staging loader: {loader}')
+    if json_encoded:
+        col_data_types = json_encoding.make_pre_encoded_col_data_types(col_data_types)
+    engine = utilities.get_engine(db_url)
+    df_stage.to_sql(
+        staging_table,
+        con=engine,
+        schema=staging_schema,
+        if_exists=('replace' if replace else 'append'),
+        index=False,
+        dtype=col_data_types,
+    )
+    return None
+
+
+def read_load_df(configs, registry=None):
+    """Reads the dataframe in a config's load_path, or gets it from the entity
+    registry (see: entity_registry) if that has it
+    """
+    df_load = entity_registry.get_load_df(registry, configs.get('load_path'))
+    if df_load is not None:
+        return df_load
+    return pd.read_csv(configs.get('load_path'))
+
+
+def iter_df_chunks(df, chunksize, key_col=None):
+    """Yields successive chunks of rows from a dataframe
+
+    If a key_col is given, the rows get grouped by their key (in the order each key
+    first appears), and a chunk never splits the rows of a key, so rows that share a
+    raw_pk get merged as they would be without chunks.
+    """
+    if key_col is not None:
+        codes, _ = pd.factorize(df[key_col], use_na_sentinel=False)
+        order = np.argsort(codes, kind='stable')
+        df = df.iloc[order]
+        codes = codes[order]
+    start = 0
+    while start < len(df.index):
+        end = min(start + chunksize, len(df.index))
+        if key_col is not None and end < len(df.index):
+            # Extend the chunk to the last row with the same key.
+            end = int(np.searchsorted(codes, codes[end - 1], side='right'))
+        yield df.iloc[start:end]
+        start = end
+
+
+def iter_chunks_or_none(df_chunks):
+    """Yields the chunks, or a single None if there are none, so an empty input
+    still gets an (empty) staging table and staging artifact
+    """
+    is_empty = True
+    for df_chunk in df_chunks:
+        is_empty = False
+        yield df_chunk
+    if is_empty:
+        yield None
+
+
+@instrumentation.instrument_stage('stream_transformed_data')
+def stream_transformed_data(
+    configs,
+    df_chunks,
+    trans_path,
+    regenerate=False,
+    chunksize=general_configs.STAGING_CHUNK_SIZE,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    db_url=general_configs.ARCHES_DB_URL,
+    columnar_mode=True,
+    loader='to_sql',
+):
+    """Transforms and loads a staging table one chunk of rows at a time
+
+    Each chunk of raw rows gets transformed, appended to the staging table and appended
+    to the staging CSV, so memory use depends on the chunksize rather than on the
+    size of the data. Rows that share a raw_pk only get merged if they are in the
+    same chunk (see: iter_df_chunks), so we raise a ValueError if a raw_pk shows up
+    again in a later chunk. Returns the number of rows loaded into the staging table.
+    """
+    staging_table = configs.get('staging_table')
+    # Compile the configs once, for all the chunks.
+    plan = mapping_plans.compile_staging_plan(configs)
+    # Every chunk needs the same columns, even if a chunk happens to lack data for
+    # some of them.
+    all_col_data_types = schema_planner.plan_staging_schema(configs)
+    stage_cols = list(all_col_data_types.keys())
+    is_parquet = staging_artifacts.is_parquet_path(trans_path)
+    use_prior = False
+    if not regenerate and os.path.exists(trans_path):
+        if is_parquet:
+            prior_cols = staging_artifacts.get_staging_parquet_columns(trans_path)
+        else:
+            prior_cols = pd.read_csv(trans_path, nrows=0).columns.tolist()
+        prior_col_data_types = schema_planner.get_col_data_types_for_columns(configs, prior_cols)
+        use_prior = prior_col_data_types is not None
+    if use_prior and is_parquet:
+        df_chunks = staging_artifacts.iter_staging_parquet_chunks(trans_path, chunksize=chunksize)
+    elif use_prior:
+        df_chunks = pd.read_csv(trans_path, chunksize=chunksize)
+    raw_pk_col = configs.get('raw_pk_col')
+    staged_raw_pks = set()
+    parquet_writer = None
+    total_rows = 0
+    for chunk_i, df_chunk in enumerate(iter_chunks_or_none(df_chunks)):
+        if df_chunk is None:
+            # There's no data, so stage an empty table with the planned columns.
+            col_data_types = prior_col_data_types if use_prior else all_col_data_types
+            df_stage = pd.DataFrame(columns=list(col_data_types.keys()))
+        elif use_prior:
+            col_data_types = prior_col_data_types
+            df_stage = df_chunk
+            if not is_parquet:
+                df_stage = make_objs_from_json_strings(df_chunk, col_data_types)
+        else:
+            if chunk_i == 0:
+                # All the chunks have the same columns, so we only check the first.
+                mapping_plans.validate_raw_columns(plan, df_chunk.columns)
+            chunk_raw_pks = set(df_chunk[raw_pk_col].dropna().astype(str).tolist())
+            repeat_raw_pks = chunk_raw_pks & staged_raw_pks
+            if repeat_raw_pks:
+                raise ValueError(
+                    f'{staging_table} rows with the same {raw_pk_col} are in different chunks, '
+                    f'so they would not get merged: {sorted(repeat_raw_pks)[:10]}'
+                )
+            staged_raw_pks |= chunk_raw_pks
+            df_stage, _ = prep_transformed_data(df_chunk, configs, columnar_mode=columnar_mode, plan=plan)
+            df_stage = df_stage.reindex(columns=stage_cols)
+            col_data_types = all_col_data_types
+        # Encode the JSON objects once, for both the saved staging data and the staging table.
+        df_encoded = json_encoding.encode_json_columns(df_stage, col_data_types)
+        if not use_prior and is_parquet:
+            parquet_writer = staging_artifacts.write_staging_parquet_chunk(
+                parquet_writer,
+                df_stage,
+                col_data_types,
+                trans_path,
+                df_encoded=df_encoded,
+            )
+        elif not use_prior:
+            save_data_to_csv_with_objects_as_json(
+                df_encoded,
+                col_data_types,
+                trans_path,
+                append=(chunk_i > 0),
+                json_encoded=True,
+            )
+        load_staging_data(
+            df_encoded,
+            staging_table,
+            col_data_types,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            loader=loader,
+            replace=(chunk_i == 0),
+            json_encoded=True,
+        )
+        total_rows += len(df_stage.index)
+        print(f'Staged {total_rows} rows (chunk {chunk_i + 1}) for: {staging_table}')
+    if parquet_writer is not None:
+        parquet_writer.close()
+    return total_rows
+
+
+@instrumentation.instrument_stage('prepare_all_transformed_data')
 def prepare_all_transformed_data(
     df=None,
     raw_path=general_configs.RAW_IMPORT_CSV, 
@@ -205,240 +490,826 @@ def prepare_all_transformed_data(
     regenerate=False,
     staging_schema=general_configs.STAGING_SCHEMA_NAME,
     db_url=general_configs.ARCHES_DB_URL,
+    columnar_mode=True,
+    chunksize=None,
+    loader='to_sql',
+    incremental=False,
+    ewkb_geometry=general_configs.STAGE_GEOMETRY_AS_EWKB,
+    delta=False,
+    registry=None,
+    artifact_format=general_configs.STAGING_ARTIFACT_FORMAT,
 ):
-    if df is None:
-        df = pd.read_csv(raw_path)
+    """Prepares, saves and loads the staging tables for all the mapping configs
+
+    If chunksize is set, we stream the raw data (and the data in each config's
+    load_path) in chunks of that many rows, and the returned dict gives the count of
+    staged rows for each staging table rather than a dataframe.
+
+    The loader can be 'to_sql' or 'copy' (to load staging tables with the much faster
+    PostgreSQL COPY).
+
+    If incremental is True, we only rebuild and reload the staging tables whose inputs
+    changed since the last run (see: prepare_changed_transformed_data).
+
+    If ewkb_geometry is True, source GeoJSON geometries get validated and staged as
+    hex encoded EWKB (see: make_ewkb_geometry_configs). Use the same option when
+    preparing the SQL inserts.
+
+    If delta is True, we only stage the raw records added or changed since the
+    last successful load (see: prepare_delta_transformed_data).
+
+    If a registry is given (see: entity_registry.prepare_all_entity_data), the
+    persons, groups and places get staged from its dataframes rather than read
+    from their load_path CSV files.
+
+    The artifact_format ('csv' or 'parquet') sets the file format of the staging data
+    saved in the DATA_DIR (see: staging_artifacts).
+    """
+    if ewkb_geometry:
+        all_configs = [make_ewkb_geometry_configs(configs) for configs in all_configs]
+    # Compile (and check) all the configs first, so a config mistake fails before we
+    # transform any data.
+    mapping_plans.compile_staging_plans(all_configs)
+    if delta:
+        return prepare_delta_transformed_data(
+            df=df,
+            raw_path=raw_path,
+            all_configs=all_configs,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            columnar_mode=columnar_mode,
+            loader=loader,
+            registry=registry,
+            artifact_format=artifact_format,
+        )
+    if incremental:
+        return prepare_changed_transformed_data(
+            df=df,
+            raw_path=raw_path,
+            all_configs=all_configs,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            columnar_mode=columnar_mode,
+            chunksize=chunksize,
+            loader=loader,
+            registry=registry,
+            artifact_format=artifact_format,
+        )
+    if chunksize:
+        return prepare_all_transformed_data_in_chunks(
+            df=df,
+            raw_path=raw_path,
+            all_configs=all_configs,
+            regenerate=regenerate,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            columnar_mode=columnar_mode,
+            chunksize=chunksize,
+            loader=loader,
+            registry=registry,
+            artifact_format=artifact_format,
+        )
     dfs = {}
     for configs in all_configs:
         staging_table = configs.get('staging_table')
         print(f'Preparing data for: {staging_table}')
         utilities.drop_import_table(staging_table)
-        trans_path = utilities.make_full_path_filename(
-            general_configs.DATA_DIR, 
-            f'{staging_table}.csv'
-        )
-        if not configs.get('load_path'):
-            # Use the main data frame of reference and sample collection items.
-            df_stage, col_data_types = prep_transformed_data(df, configs)
-        else:
-            # Use a separate data frame for the data prior to transformation.
-            df_load = pd.read_csv(configs.get('load_path'))
-            df_stage, col_data_types = prep_transformed_data(df_load, configs)
+        trans_path = staging_artifacts.make_staging_artifact_path(staging_table, artifact_format, configs=configs)
+        df_stage = None
         if not regenerate and os.path.exists(trans_path):
-            # Yes this is inefficient. We're always regenerating a df_stage even if we
-            # don't want to regenerate and will be throwing away the newly created df_stage
-            # by reading an existing dataset. But we still want the col_data_types, so
-            # we'll just suffer with the inefficiency.
-            df_stage = pd.read_csv(trans_path)
-            print(f'Loaded previously prepared {len(df_stage.index)} rows of data for: {staging_table}')
-            df_stage = make_objs_from_json_strings(df_stage, col_data_types)
-        save_data_to_csv_with_objects_as_json(df_stage, col_data_types, trans_path)
+            # Load the previously prepared staging data. The col_data_types come from
+            # the configs, so we don't need to redo the transformation.
+            df_stage, col_data_types = load_staging_artifact(trans_path, configs)
+            if df_stage is not None:
+                print(f'Loaded previously prepared {len(df_stage.index)} rows of data for: {staging_table}')
+        if df_stage is None:
+            if not configs.get('load_path'):
+                # Use the main data frame of reference and sample collection items.
+                if df is None:
+                    df = raw_data.load_raw_data(raw_path, all_configs=all_configs)
+                df_stage, col_data_types = prep_transformed_data(df, configs, columnar_mode=columnar_mode)
+            else:
+                # Use a separate data frame for the data prior to transformation.
+                df_load = read_load_df(configs, registry=registry)
+                df_stage, col_data_types = prep_transformed_data(df_load, configs, columnar_mode=columnar_mode)
+            # Encode the JSON objects once, for both the saved staging data and the staging table.
+            df_encoded = json_encoding.encode_json_columns(df_stage, col_data_types)
+            save_staging_artifact(df_stage, col_data_types, trans_path, df_encoded=df_encoded)
+        else:
+            df_encoded = json_encoding.encode_json_columns(df_stage, col_data_types)
         # Always replace the data in the stating schema. We dropped the staging table above 
         # at the top of this loop.
-        engine = utilities.create_engine(db_url)
-        df_stage.to_sql(
+        load_staging_data(
+            df_encoded,
             staging_table,
-            con=engine,
-            schema=staging_schema,
-            if_exists='replace',
-            index=False,
-            dtype=col_data_types,
+            col_data_types,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            loader=loader,
+            json_encoded=True,
         )
         dfs[staging_table] = df_stage
     return dfs
 
 
-def prepare_all_sql_inserts(
+def prepare_all_transformed_data_in_chunks(
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV, 
+    all_configs=general_configs.ALL_MAPPING_CONFIGS, 
+    regenerate=False,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    db_url=general_configs.ARCHES_DB_URL,
+    columnar_mode=True,
+    chunksize=general_configs.STAGING_CHUNK_SIZE,
+    loader='to_sql',
+    registry=None,
+    artifact_format=general_configs.STAGING_ARTIFACT_FORMAT,
+):
+    """Prepares, saves and loads the staging tables, streaming the data in chunks"""
+    staged_counts = {}
+    for configs in all_configs:
+        staging_table = configs.get('staging_table')
+        print(f'Preparing data (in chunks of {chunksize} rows) for: {staging_table}')
+        utilities.drop_import_table(staging_table)
+        trans_path = staging_artifacts.make_staging_artifact_path(staging_table, artifact_format, configs=configs)
+        raw_pk_col = configs.get('raw_pk_col')
+        if configs.get('load_path'):
+            # The load_path data (like the places, which can have several rows for
+            # a merged place) gets read in full, so the chunks can keep the rows of
+            # each raw_pk together.
+            df_chunks = iter_df_chunks(read_load_df(configs, registry=registry), chunksize, key_col=raw_pk_col)
+        elif df is not None:
+            df_chunks = iter_df_chunks(df, chunksize, key_col=raw_pk_col)
+        else:
+            raw_data.check_raw_columns(raw_path, raw_data.get_raw_cols(all_configs), all_configs)
+            df_chunks = pd.read_csv(
+                raw_path,
+                chunksize=chunksize,
+                **raw_data.get_read_csv_kwargs(all_configs),
+            )
+        staged_counts[staging_table] = stream_transformed_data(
+            configs,
+            df_chunks,
+            trans_path,
+            regenerate=regenerate,
+            chunksize=chunksize,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            columnar_mode=columnar_mode,
+            loader=loader,
+        )
+    return staged_counts
+
+
+def prepare_changed_transformed_data(
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV, 
+    all_configs=general_configs.ALL_MAPPING_CONFIGS, 
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    db_url=general_configs.ARCHES_DB_URL,
+    columnar_mode=True,
+    chunksize=None,
+    loader='to_sql',
+    registry=None,
+    artifact_format=general_configs.STAGING_ARTIFACT_FORMAT,
+):
+    """Rebuilds and reloads only the staging tables with changed inputs
+
+    We fingerprint the inputs of each staging table (the raw data or load_path, and
+    the mapping config) and compare them with the fingerprints saved in the staging
+    manifest by the last run. Unchanged staging tables are left alone (and are not
+    in the returned dict).
+    """
+    data_dir = general_configs.DATA_DIR
+    manifest = fingerprints.load_staging_manifest(data_dir)
+    changed_configs = []
+    changed_fingerprints = {}
+    for configs in all_configs:
+        staging_table = configs.get('staging_table')
+        fingerprint = fingerprints.make_staging_fingerprint(
+            configs,
+            df=df,
+            raw_path=raw_path,
+            staging_schema=staging_schema,
+        )
+        if (
+            fingerprints.staging_table_is_current(
+                staging_table,
+                fingerprint,
+                manifest,
+                data_dir,
+                artifact_format=artifact_format,
+                configs=configs,
+            )
+            and utilities.staging_table_exists(staging_table, staging_schema=staging_schema, db_url=db_url)
+        ):
+            print(f'No changes to the inputs of: {staging_table}')
+            continue
+        changed_configs.append(configs)
+        changed_fingerprints[staging_table] = fingerprint
+    if not changed_configs:
+        return {}
+    # The inputs changed, so any previously prepared staging data is out of date.
+    dfs = prepare_all_transformed_data(
+        df=df,
+        raw_path=raw_path,
+        all_configs=changed_configs,
+        regenerate=True,
+        staging_schema=staging_schema,
+        db_url=db_url,
+        columnar_mode=columnar_mode,
+        chunksize=chunksize,
+        loader=loader,
+        registry=registry,
+        artifact_format=artifact_format,
+    )
+    # Other processes (see: scheduler) may update the manifest for other staging
+    # tables at the same time.
+    fingerprints.update_staging_manifest(changed_fingerprints, data_dir=data_dir)
+    return dfs
+
+
+def prepare_delta_transformed_data(
+    df=None,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    db_url=general_configs.ARCHES_DB_URL,
+    columnar_mode=True,
+    loader='to_sql',
+    key_col=raw_delta.DELTA_KEY_COL,
+    registry=None,
+    artifact_format=general_configs.STAGING_ARTIFACT_FORMAT,
+):
+    """Prepares and loads staging tables with only the raw records that were added or
+    changed since the last successful load
+
+    The entity data (like the rsci places and provenance activities) should already be
+    prepared from the new raw data. Staging data with the key_col gets filtered to the
+    added and changed records. Staging data without it (like the persons and groups)
+    gets staged in full, since the insert statements skip what's already loaded.
+    This needs deterministic UUIDs, so the changed records get the same tileids as the
+    tiles already in Arches (which the SQL updates, see: make_sql_insert_steps).
+    """
+    if not general_configs.DETERMINISTIC_UUIDS:
+        raise ValueError('Delta loads need general_configs.DETERMINISTIC_UUIDS = True')
+    data_dir = general_configs.DATA_DIR
+    if df is None:
+        df = raw_data.load_raw_data(raw_path, all_configs=all_configs)
+    hash_cols = raw_delta.get_raw_hash_cols(df, raw_delta.load_raw_snapshot_hash_cols(data_dir))
+    df_hashes = raw_delta.hash_raw_rows(df, key_col=key_col, hash_cols=hash_cols)
+    delta_keys = raw_delta.diff_raw_data(
+        df_hashes,
+        raw_delta.load_raw_snapshot(data_dir),
+        key_col=key_col,
+    )
+    print(
+        f"Raw records: {len(delta_keys['added'])} added, {len(delta_keys['changed'])} changed, "
+        f"{len(delta_keys['removed'])} removed, {delta_keys['unchanged']} unchanged"
+    )
+    affected_keys = set(delta_keys['added'] + delta_keys['changed'])
+    dfs = {}
+    dfs_delta_tiles = []
+    for configs in all_configs:
+        staging_table = configs.get('staging_table')
+        print(f'Preparing delta data for: {staging_table}')
+        utilities.drop_import_table(staging_table)
+        if not configs.get('load_path'):
+            df_load = df
+        else:
+            df_load = read_load_df(configs, registry=registry)
+        df_load = raw_delta.filter_affected_rows(df_load, affected_keys, key_col=key_col)
+        if key_col in df_load.columns:
+            # The tiles of the affected records, so the SQL can delete the ones that
+            # no longer have data.
+            plan = mapping_plans.compile_staging_plan(configs)
+            dfs_delta_tiles.append(raw_delta.make_delta_tiles(df_load, plan))
+        df_stage, _ = prep_transformed_data(df_load, configs, columnar_mode=columnar_mode)
+        # A small delta may lack data for some columns, but the SQL needs all of them.
+        col_data_types = schema_planner.plan_staging_schema(configs)
+        df_stage = df_stage.reindex(columns=list(col_data_types.keys()))
+        # Save the delta apart from the full staging data, so cached runs don't use it.
+        trans_path = staging_artifacts.make_staging_artifact_path(
+            staging_table,
+            artifact_format,
+            data_dir=data_dir,
+            suffix='_delta',
+            configs=configs,
+        )
+        df_encoded = json_encoding.encode_json_columns(df_stage, col_data_types)
+        save_staging_artifact(df_stage, col_data_types, trans_path, df_encoded=df_encoded)
+        load_staging_data(
+            df_encoded,
+            staging_table,
+            col_data_types,
+            staging_schema=staging_schema,
+            db_url=db_url,
+            loader=loader,
+            json_encoded=True,
+        )
+        dfs[staging_table] = df_stage
+    utilities.drop_import_table(raw_delta.DELTA_TILES_TABLE)
+    df_delta_tiles = pd.concat(
+        [pd.DataFrame(columns=list(raw_delta.DELTA_TILES_COL_DATA_TYPES.keys()))] + dfs_delta_tiles,
+        ignore_index=True,
+    )
+    load_staging_data(
+        df_delta_tiles,
+        raw_delta.DELTA_TILES_TABLE,
+        raw_delta.DELTA_TILES_COL_DATA_TYPES,
+        staging_schema=staging_schema,
+        db_url=db_url,
+        loader=loader,
+    )
+    # The staging tables now only have the delta, so they don't match their fingerprints.
+    fingerprints.update_staging_manifest(removed_staging_tables=list(dfs.keys()), data_dir=data_dir)
+    raw_delta.save_pending_raw_snapshot(df_hashes, delta_keys, data_dir, hash_cols=hash_cols)
+    return dfs
+
+
+def make_staging_index_name(staging_table, col):
+    """Makes an index name for a staging table column, within PostgreSQL's 63 character limit"""
+    index_name = f'{staging_table}_{col}_idx'
+    if len(index_name) <= POSTGRES_MAX_IDENTIFIER_LEN:
+        return index_name
+    name_hash = hashlib.md5(index_name.encode('utf-8')).hexdigest()[:8]
+    return f'{index_name[:(POSTGRES_MAX_IDENTIFIER_LEN - 13)]}_{name_hash}_idx'
+
+
+def get_staging_index_cols(plan):
+    """Gets the staging table columns (of a compiled staging plan) that the insert
+    statements join or filter on"""
+    index_cols = ['resourceinstanceid']
+    for mapping in plan.mappings:
+        if not mapping.make_tileid:
+            continue
+        if mapping.tileid_col not in index_cols:
+            index_cols.append(mapping.tileid_col)
+    return index_cols
+
+
+def make_staging_index_sqls(configs, staging_schema=general_configs.STAGING_SCHEMA_NAME):
+    """Makes SQL statements to index the resourceinstanceid and tileid columns of a staging table
+
+    These indexes keep the anti-joins (and the tile updates) in the insert statements
+    fast, so the load time stays about the same as the Arches database grows.
+    """
+    plan = mapping_plans.compile_staging_plan(configs)
+    staging_table = plan.staging_table
+    sqls = []
+    for col in get_staging_index_cols(plan):
+        index_name = make_staging_index_name(staging_table, col)
+        sqls.append(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON {staging_schema}.{staging_table} ({col});'
+        )
+    # Update the table statistics so the query planner knows to use the indexes.
+    sqls.append(f'ANALYZE {staging_schema}.{staging_table};')
+    return sqls
+
+
+def make_keyset_batch_condition(source_tab):
+    """Makes a SQL condition that limits a statement to a range of staging resourceinstanceids
+
+    The range starts at the :batch_from resourceinstanceid and ends before the
+    :batch_before resourceinstanceid (or goes to the end if :batch_before is NULL).
+    """
+    return (
+        f'({source_tab}.resourceinstanceid >= :batch_from AND '
+        f'(:batch_before IS NULL OR {source_tab}.resourceinstanceid < :batch_before))'
+    )
+
+
+def make_keyset_batch_starts_sql(source_tab):
+    """Makes a SQL query for the first resourceinstanceid of each batch of a staging table
+
+    Batches are consecutive ranges of :batch_size distinct resourceinstanceids, so
+    each batch gets found with the resourceinstanceid index (keyset pagination),
+    rather than scanning past all the earlier rows like an OFFSET would.
+    """
+    return f"""
+    SELECT numbered.resourceinstanceid
+    FROM (
+        SELECT rids.resourceinstanceid,
+        row_number() OVER (ORDER BY rids.resourceinstanceid) AS row_num
+        FROM (
+            SELECT DISTINCT resourceinstanceid
+            FROM {source_tab}
+            WHERE resourceinstanceid IS NOT NULL
+        ) AS rids
+    ) AS numbered
+    WHERE (numbered.row_num - 1) % :batch_size = 0
+    ORDER BY numbered.resourceinstanceid
+    ;
+    """
+
+
+def make_insert_select_sql(
+    model_staging_schema,
+    targ_table,
+    targ_fields_sql,
+    stage_fields_sql,
+    source_tab,
+    where_condition_sql,
+):
+    """Makes the SQL to insert selected staging data into a target table"""
+    return f"""
+            INSERT INTO {model_staging_schema}.{targ_table} (
+                {targ_fields_sql}
+            ) SELECT
+                {stage_fields_sql}
+            
+            FROM {source_tab}
+            WHERE {where_condition_sql}
+            ORDER BY {source_tab}.resourceinstanceid
+            
+            ;
+            """
+
+
+def make_tile_view_delete_sql(
+    model_staging_schema,
+    targ_table,
+    staging_table,
+    source_tab,
+    staging_tileid_field,
+    not_null_condition,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+):
+    """Makes the SQL to delete tiles (through a relational view) of changed records
+    that no longer have staging data for a mapping
+
+    The tiles to check are the ones the mapping made for the changed records (see:
+    delta.make_delta_tiles), so tiles that other mappings (or other staging tables)
+    made are left alone.
+    """
+    delta_tiles_tab = f'{staging_schema}.{raw_delta.DELTA_TILES_TABLE}'
+    return f"""
+            DELETE FROM {model_staging_schema}.{targ_table} AS targ
+            WHERE targ.tileid IN (
+                SELECT {delta_tiles_tab}.tileid::uuid
+                FROM {delta_tiles_tab}
+                WHERE {delta_tiles_tab}.staging_table = '{staging_table}'
+                AND {delta_tiles_tab}.tileid_col = '{staging_tileid_field}'
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM {source_tab}
+                WHERE {source_tab}.{staging_tileid_field}::uuid = targ.tileid
+                AND {not_null_condition}
+            )
+            ;
+            """
+
+
+def make_tile_view_update_sql(
+    model_staging_schema,
+    targ_table,
+    update_fields,
+    source_tab,
+    staging_tileid_field,
+    where_condition_sql,
+):
+    """Makes the SQL to update tiles (through a relational view) that are already in
+    Arches with their staging data
+    """
+    targ_fields_sql = ', \n'.join([tf for tf, _ in update_fields])
+    # The staging fields are not qualified with the staging table name, so we select
+    # them in a subquery, where they resolve to the staging table first.
+    stage_fields_sql = ', \n'.join([s_field_and_type for _, s_field_and_type in update_fields])
+    return f"""
+            UPDATE {model_staging_schema}.{targ_table} AS targ
+            SET (
+                {targ_fields_sql}
+            ) = (
+                SELECT
+                {stage_fields_sql}
+                FROM {source_tab}
+                WHERE {source_tab}.{staging_tileid_field}::uuid = targ.tileid
+            )
+            WHERE EXISTS (
+                SELECT 1
+                FROM {source_tab}
+                WHERE {source_tab}.{staging_tileid_field}::uuid = targ.tileid
+                AND {where_condition_sql}
+            )
+            ;
+            """
+
+
+def make_sql_insert_steps(
     all_configs=general_configs.ALL_MAPPING_CONFIGS,
     staging_schema=general_configs.STAGING_SCHEMA_NAME,
     relational_views_sqls=general_configs.ARCHES_REL_VIEW_PREP_SQLS,
-    total_count=15000,
-    increment=15000,
     add_tile_update_sqls=False,
+    ewkb_geometry=general_configs.STAGE_GEOMETRY_AS_EWKB,
+    add_update_sqls=False,
 ):
-    sqls = []
+    """Makes the SQL statements to load the staging data into Arches, in order
+
+    Each step is a dict with the SQL statement, the kind of statement, and the model
+    (the relational views schema) and staging table it belongs to. The insert and
+    update steps also have a batch_sql version of the statement, limited to a
+    range of staging resourceinstanceids (see: sql_executor.execute_batched_step),
+    and the batch_starts_sql to get the start of each range.
+
+    If ewkb_geometry is True, the source GeoJSON geometries are expected to be staged
+    as hex encoded EWKB (see: make_ewkb_geometry_configs), so we just cast them.
+
+    If add_update_sqls is True, the tiles that are already in Arches get updated
+    (through the relational views) with the staging data before the inserts. Use this
+    with delta loads (see: prepare_delta_transformed_data), where the staging tables
+    only have the added and changed records. The tiles of changed records that no
+    longer have staging data get deleted first (children before their parents), so a
+    delta load ends up with the same tiles as a full load.
+    """
+    if ewkb_geometry:
+        all_configs = [make_ewkb_geometry_configs(configs) for configs in all_configs]
+    steps = []
     if relational_views_sqls:
         # Add the SQL statements for the relational views.
-        sqls += relational_views_sqls
-    for configs in all_configs:
-        staging_table = configs.get('staging_table')
-        model_staging_schema = configs.get('model_staging_schema')
-        start = 0
+        for sql in relational_views_sqls:
+            steps.append(
+                {
+                    'kind': 'relational_views',
+                    'model': None,
+                    'staging_table': None,
+                    'targ_table': None,
+                    'sql': sql,
+                }
+            )
+    # Compile (and check) all the configs before we make any SQL.
+    plans = mapping_plans.compile_staging_plans(all_configs)
+    for plan in plans:
+        staging_table = plan.staging_table
+        model_staging_schema = plan.model_staging_schema
         source_tab = f'{staging_schema}.{staging_table}'
-        while start < total_count:
-            for mapping in configs.get('mappings'):
-                insert_fields = []
-                not_null_fields = []
-                where_conditions = []
+        batch_starts_sql = make_keyset_batch_starts_sql(source_tab)
+        for sql in make_staging_index_sqls(plan, staging_schema=staging_schema):
+            steps.append(
+                {
+                    'kind': 'staging_index',
+                    'model': model_staging_schema,
+                    'staging_table': staging_table,
+                    'targ_table': None,
+                    'sql': sql,
+                }
+            )
+        # The delete steps of the plan go before its other steps, in reverse order, so
+        # the tiles of child mappings (with a related_tileid) get deleted first.
+        delete_steps_i = len(steps)
+        for mapping in plan.mappings:
+            insert_fields = []
+            not_null_fields = []
+            where_conditions = []
+
 
+            targ_table = mapping.targ_table
+            targ_field = mapping.targ_field
+
+            # Add the resourceinstanceid to the insert fields, it should be always present
+            insert_fields.append(
+                ('resourceinstanceid', 'resourceinstanceid::uuid')
+            )
 
-                stage_field_prefix = mapping.get('stage_field_prefix')
-                targ_table = mapping.get('targ_table')
-                targ_field = mapping.get('targ_field')
 
-                # Add the resourceinstanceid to the insert fields, it should be always present
+            # Now handle tileid fields. Tileids are made for attribute data added to an resource instance.
+            # They will be used to know that we haven't already added certain tile data to a resource instance.
+            if mapping.make_tileid:
+                targ_tileid_field = 'tileid'
+                staging_tileid_field = mapping.tileid_col
+                staging_tileid_select_field_type = f'{staging_tileid_field}::uuid'
                 insert_fields.append(
-                    ('resourceinstanceid', 'resourceinstanceid::uuid')
+                    (targ_tileid_field, staging_tileid_select_field_type)
+                )
+                # An anti-join on the tiles primary key, so we don't scan all the tiles for each insert.
+                where_conditions.append(
+                    f'(NOT EXISTS (SELECT 1 FROM tiles WHERE tiles.tileid = {source_tab}.{staging_tileid_select_field_type}))'
+                )
+                where_conditions.append(
+                    f'({source_tab}.{staging_tileid_select_field_type} IS NOT NULL)'
+                )
+            else:
+                where_conditions.append(
+                    f'(NOT EXISTS (SELECT 1 FROM {model_staging_schema}.{targ_table} AS targ '
+                    f'WHERE targ.resourceinstanceid = {source_tab}.resourceinstanceid))'
                 )
 
-                limit_offset = f'LIMIT {increment} OFFSET {start}'
-                if targ_field == 'resourceinstanceid':
-                    # We're importing resource instances, so skip the offsets. We'll import them all at once.
-                    limit_offset = ''
-                    if start > 0:
-                        # No need to make duplicate queries for resource instances. We'll do them all at once.
-                        continue
-                
-                # We're turning off and not doing the limit_offset thing.
-                limit_offset = ''
+            # This is for the main data value that goes into the target table. Generally this will be tile data,
+            # except for inserts into the resourceinstance table.
+            stage_targ_field = mapping.stage_targ_col
+            stage_targ_field_and_type = f'{stage_targ_field}::{mapping.data_type_sql}'
+            not_null_fields.append(stage_targ_field_and_type)
+            if mapping.staging_geometry_format == 'ewkb':
+                # The geometry is already staged as EWKB, so we only need to cast it.
+                stage_targ_field_and_type = f"ST_AsText({stage_targ_field}::geometry)"
+            elif mapping.source_geojson:
+                # We need to add a transformation function to change the geojson to a PostGIS geometry.
+                stage_targ_field_and_type = f"ST_AsText(ST_GeomFromGeoJSON({stage_targ_field}))"
+            
+            # Add the target field to the insert fields.
+            act_insert_field = (targ_field, stage_targ_field_and_type)
+            if act_insert_field not in insert_fields:
+                insert_fields.append(act_insert_field)
+            
+
+            # Add the default values to the insert fields.
+            for default_value in mapping.default_values:
+                default_col_and_type = f'{default_value.stage_col}::{default_value.data_type_sql}'
+                insert_fields.append(
+                    (default_value.d_col, default_col_and_type)
+                )
+
+            
+            if mapping.related_tileid:
+                # The current insert is related to a previously inserted tileid. We need to add the tileid for
+                # the association
+                targ_relatated_tileid_field, source_tile_field = mapping.related_tileid
+                source_related_tileid_field_and_type = f'{source_tile_field}::uuid'
+                insert_fields.append(
+                    (targ_relatated_tileid_field, source_related_tileid_field_and_type)
+                )
 
 
-                # Now handle tileid fields. Tileids are made for attribute data added to an resource instance.
-                # They will be used to know that we haven't already added certain tile data to a resource instance.
-                if mapping.get('make_tileid'):
-                    targ_tileid_field = 'tileid'
-                    staging_tileid_field = f'{stage_field_prefix}tileid'
-                    staging_tileid_select_field_type = f'{staging_tileid_field}::uuid'
+            # Now we need to handle related_resources. These are JSONB fields that define relationships between
+            # resource instances.
+            done_source_rel_objs_fields = []
+            rel_dict_i = 0
+            for rel_resource in mapping.related_resources:
+                rel_dict_i += 1
+                multi_value = rel_resource.multi_value
+                source_rel_objs_field = rel_resource.related_objs_col
+                if source_rel_objs_field in done_source_rel_objs_fields:
+                    continue
+                done_source_rel_objs_fields.append(source_rel_objs_field)
+                targ_rel_objs_field = rel_resource.targ_field
+                if multi_value:
+                    safe_source = f"""
+                    coalesce(
+                        case jsonb_typeof({source_rel_objs_field}) 
+                            when 'array' then {source_rel_objs_field} 
+                            else '[]'::jsonb end
+                        ) as {source_rel_objs_field}_{rel_dict_i}
+                    """
                     insert_fields.append(
-                        (targ_tileid_field, staging_tileid_select_field_type)
-                    )
-                    where_conditions.append(    
-                        f'({source_tab}.{staging_tileid_select_field_type} NOT IN (SELECT tileid FROM tiles))'
-                    )
-                    where_conditions.append(
-                        f'({source_tab}.{staging_tileid_select_field_type} IS NOT NULL)'
+                        (targ_rel_objs_field, f'{safe_source}')
                     )
                 else:
-                    where_conditions.append(
-                        f'({source_tab}.resourceinstanceid NOT IN (SELECT resourceinstanceid FROM {model_staging_schema}.{targ_table}))'
-                    )
-
-                # This is for the main data value that goes into the target table. Generally this will be tile data,
-                # except for inserts into the resourceinstance table.
-                stage_targ_field = f'{stage_field_prefix}{targ_field}'
-                targ_data_type_sql = utilities.lookup_data_type_sql_str(mapping.get('data_type'))
-                stage_targ_field_and_type = f'{stage_targ_field}::{targ_data_type_sql}'
-                not_null_fields.append(stage_targ_field_and_type)
-                if mapping.get('source_geojson'):
-                    # We need to add a transformation function to change the geojson to a PostGIS geometry.
-                    stage_targ_field_and_type = f"ST_AsText(ST_GeomFromGeoJSON({stage_targ_field}))"
-                
-                # Add the target field to the insert fields.
-                act_insert_field = (targ_field, stage_targ_field_and_type)
-                if act_insert_field not in insert_fields:
-                    insert_fields.append(act_insert_field)
-                
-
-                # Add the default values to the insert fields.
-                default_values = mapping.get('default_values', [])
-                for d_col, d_type, d_val in default_values:
-                    default_col = f'{stage_field_prefix}{d_col}'
-                    data_type_sql = utilities.lookup_data_type_sql_str(d_type)
-                    default_col_and_type = f'{default_col}::{data_type_sql}'
                     insert_fields.append(
-                        (d_col, default_col_and_type)
+                        (targ_rel_objs_field, f'{source_rel_objs_field}::jsonb')
                     )
+                not_null_fields.append(f'{source_rel_objs_field}::jsonb')
 
-                
-                if mapping.get('related_tileid'):
-                    # The current insert is related to a previously inserted tileid. We need to add the tileid for
-                    # the association
-                    rel_tile_config = mapping.get('related_tileid')
-                    targ_relatated_tileid_field = f'{rel_tile_config.get("targ_tile_field")}'
-                    source_related_tileid_field_and_type = f'{rel_tile_config.get("source_tile_field")}::uuid'
-                    insert_fields.append(
-                        (targ_relatated_tileid_field, source_related_tileid_field_and_type)
-                    )
+            # Process configurations for other data fields that belong to this same tileid
+            for other_field in mapping.other_fields:
+                other_stage_targ_field_and_type = f'{other_field.stage_col}::{other_field.data_type_sql}'
+                not_null_fields.append(other_stage_targ_field_and_type)
+                insert_fields.append(
+                    (other_field.targ_field, other_stage_targ_field_and_type)
+                )
 
+            # Make a not null condition for the insert statement.
+            not_null_condition = ' OR '.join([f'({source_tab}.{not_null_field} IS NOT NULL)' for not_null_field in not_null_fields])
+            not_null_condition = f'({not_null_condition})'
+            where_conditions.append(not_null_condition)
 
-                # Now we need to handle related_resources. These are JSONB fields that define relationships between
-                # resource instances.
-                done_source_rel_objs_fields = []
-                rel_dict_i = 0
-                for rel_dict in mapping.get('related_resources', []):
-                    rel_dict_i += 1
-                    multi_value = rel_dict.get('multi_value', False)
-                    group_source_field = rel_dict.get('group_source_field', '')
-                    source_rel_objs_field = f'{stage_field_prefix}{group_source_field}related_objs'
-                    if source_rel_objs_field in done_source_rel_objs_fields:
-                        continue
-                    done_source_rel_objs_fields.append(source_rel_objs_field)
-                    targ_rel_objs_field = rel_dict.get('targ_field')
-                    if multi_value:
-                        safe_source = f"""
-                        coalesce(
-                            case jsonb_typeof({source_rel_objs_field}) 
-                                when 'array' then {source_rel_objs_field} 
-                                else '[]'::jsonb end
-                            ) as {source_rel_objs_field}_{rel_dict_i}
-                        """
-                        insert_fields.append(
-                            (targ_rel_objs_field, f'{safe_source}')
-                        )
-                    else:
-                        insert_fields.append(
-                            (targ_rel_objs_field, f'{source_rel_objs_field}::jsonb')
-                        )
-                    not_null_fields.append(f'{source_rel_objs_field}::jsonb')
-
-                # Process configurations for other data fields that belong to this same tileid
-                for tile_other_dict in mapping.get('tile_other_fields', []):
-                    other_targ_field = tile_other_dict.get('targ_field')
-                    other_stage_targ_field = f'{stage_field_prefix}{other_targ_field}'
-                    other_data_type_sql = utilities.lookup_data_type_sql_str(tile_other_dict.get('data_type'))
-                    other_stage_targ_field_and_type = f'{other_stage_targ_field}::{other_data_type_sql}'
-                    not_null_fields.append(other_stage_targ_field_and_type)
-                    insert_fields.append(
-                        (other_targ_field, other_stage_targ_field_and_type)
-                    )
+            # Make the where condition for the insert statement.
+            where_condition_sql = ' AND \n'.join(where_conditions)
 
-                # Make a not null condition for the insert statement.
-                not_null_condition = ' OR '.join([f'({source_tab}.{not_null_field} IS NOT NULL)' for not_null_field in not_null_fields])
-                not_null_condition = f'({not_null_condition})'
-                where_conditions.append(not_null_condition)
+            targ_fields_sql = ', \n'.join([tf for tf, _ in insert_fields])
+            stage_fields_sql = ', \n'.join([s_field_and_type for _, s_field_and_type in insert_fields])
 
-                # Make the where condition for the insert statement.
-                where_condition_sql = ' AND \n'.join(where_conditions)
+            if add_update_sqls and mapping.make_tileid:
+                steps.insert(
+                    delete_steps_i,
+                    {
+                        'kind': 'delete',
+                        'model': model_staging_schema,
+                        'staging_table': staging_table,
+                        'targ_table': targ_table,
+                        'sql': make_tile_view_delete_sql(
+                            model_staging_schema,
+                            targ_table,
+                            staging_table,
+                            source_tab,
+                            staging_tileid_field,
+                            not_null_condition,
+                            staging_schema=staging_schema,
+                        ),
+                    },
+                )
+                update_sql_args = [
+                    model_staging_schema,
+                    targ_table,
+                    [(tf, s_field) for tf, s_field in insert_fields if tf not in ['resourceinstanceid', 'tileid']],
+                    source_tab,
+                    staging_tileid_field,
+                ]
+                steps.append(
+                    {
+                        'kind': 'update',
+                        'model': model_staging_schema,
+                        'staging_table': staging_table,
+                        'targ_table': targ_table,
+                        'sql': make_tile_view_update_sql(*update_sql_args, not_null_condition),
+                        'batch_sql': make_tile_view_update_sql(
+                            *update_sql_args,
+                            f'{not_null_condition} AND \n{make_keyset_batch_condition(source_tab)}',
+                        ),
+                        'batch_starts_sql': batch_starts_sql,
+                    }
+                )
 
-                targ_fields_sql = ', \n'.join([tf for tf, _ in insert_fields])
-                stage_fields_sql = ', \n'.join([s_field_and_type for _, s_field_and_type in insert_fields])
+            # Now we can build the SQL query.
+            insert_sql_args = [model_staging_schema, targ_table, targ_fields_sql, stage_fields_sql, source_tab]
+            sql = make_insert_select_sql(*insert_sql_args, where_condition_sql)
+            batch_sql = make_insert_select_sql(
+                *insert_sql_args,
+                f'{where_condition_sql} AND \n{make_keyset_batch_condition(source_tab)}',
+            )
+            steps.append(
+                {
+                    'kind': 'insert',
+                    'model': model_staging_schema,
+                    'staging_table': staging_table,
+                    'targ_table': targ_table,
+                    'sql': sql,
+                    'batch_sql': batch_sql,
+                    'batch_starts_sql': batch_starts_sql,
+                }
+            )
+            if not mapping.tile_data:
+                # No need to do a SQL UPDATE on the tile data.
+                continue
+            if not add_tile_update_sqls:
+                # We're not adding the tile data to the SQL statements.
+                continue
+            # Compose a SQL UPDATE statement for the tile data.
+            tile_data_col = mapping.tile_data_col
+            nodegroupid_col = mapping.nodegroupid_col
+            tile_sql = f"""
 
-                # Now we can build the SQL query.
-                sql = f"""
-                INSERT INTO {model_staging_schema}.{targ_table} (
-                    {targ_fields_sql}
-                ) SELECT
-                    {stage_fields_sql}
-                
-                FROM {source_tab}
-                WHERE {where_condition_sql}
-                ORDER BY {source_tab}.resourceinstanceid
-                {limit_offset}
-                ;
-                """
-                sqls.append(sql)
-                if not mapping.get('tile_data'):
-                    # No need to do a SQL UPDATE on the tile data.
-                    continue
-                if not add_tile_update_sqls:
-                    # We're not adding the tile data to the SQL statements.
-                    continue
-                # Compose a SQL UPDATE statement for the tile data.
-                tile_data_col = f'{stage_field_prefix}tile_data'
-                nodegroupid_col = f'{stage_field_prefix}nodegroupid'
-                tile_sql = f"""
-
-                UPDATE tiles
-                SET sortorder = 0,
-                nodegroupid = {source_tab}.{nodegroupid_col}::uuid,
-                tiledata = {source_tab}.{tile_data_col}::jsonb
-                FROM {source_tab}
-                WHERE {source_tab}.{staging_tileid_field}::uuid = tiles.tileid::uuid;
+            UPDATE tiles
+            SET sortorder = 0,
+            nodegroupid = {source_tab}.{nodegroupid_col}::uuid,
+            tiledata = {source_tab}.{tile_data_col}::jsonb
+            FROM {source_tab}
+            WHERE {source_tab}.{staging_tileid_field}::uuid = tiles.tileid::uuid;
 
-                """
-                sqls.append(tile_sql)
-            start += increment
-    utilities.save_sql(sqls)
+            """
+            batch_tile_sql = tile_sql.replace(
+                ' = tiles.tileid::uuid;',
+                f' = tiles.tileid::uuid AND \n{make_keyset_batch_condition(source_tab)};',
+            )
+            steps.append(
+                {
+                    'kind': 'tile_update',
+                    'model': model_staging_schema,
+                    'staging_table': staging_table,
+                    'targ_table': 'tiles',
+                    'sql': tile_sql,
+                    'batch_sql': batch_tile_sql,
+                    'batch_starts_sql': batch_starts_sql,
+                }
+            )
+    return steps
+
+
+@instrumentation.instrument_stage('prepare_all_sql_inserts')
+def prepare_all_sql_inserts(
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    staging_schema=general_configs.STAGING_SCHEMA_NAME,
+    relational_views_sqls=general_configs.ARCHES_REL_VIEW_PREP_SQLS,
+    add_tile_update_sqls=False,
+    ewkb_geometry=general_configs.STAGE_GEOMETRY_AS_EWKB,
+    add_update_sqls=False,
+    sql_path=general_configs.ARCHES_INSERT_SQL_PATH,
+    total_count=None,
+    increment=None,
+):
+    """Prepares the SQL statements to load the staging data into Arches and saves them
+
+    The saved statements are not batched: each one loads all the staging data for a
+    mapping. To load in batches, use sql_executor.execute_all_sql_inserts with a
+    batch_size. The total_count and increment arguments are deprecated and ignored
+    (their LIMIT / OFFSET batches were always turned off).
+    """
+    if total_count is not None or increment is not None:
+        warnings.warn(
+            'prepare_all_sql_inserts ignores total_count and increment, use '
+            'sql_executor.execute_all_sql_inserts(batch_size=...) to load in batches',
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    steps = make_sql_insert_steps(
+        all_configs=all_configs,
+        staging_schema=staging_schema,
+        relational_views_sqls=relational_views_sqls,
+        add_tile_update_sqls=add_tile_update_sqls,
+        ewkb_geometry=ewkb_geometry,
+        add_update_sqls=add_update_sqls,
+    )
+    sqls = [step.get('sql') for step in steps]
+    utilities.save_sql(sqls, file_path=sql_path)
     return sqls 
 
 
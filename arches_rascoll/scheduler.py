@@ -0,0 +1,289 @@
+import concurrent.futures
+import time
+
+from arches_rascoll import general_configs
+from arches_rascoll import groups
+from arches_rascoll import persons
+from arches_rascoll import places
+from arches_rascoll import prov_acts
+from arches_rascoll import ref_collection
+from arches_rascoll import sets
+from arches_rascoll import utilities
+
+"""
+Runs the entity preparation functions and the staging of each mapping config as a
+dependency graph (DAG) of stages. Stages that don't depend on each other (for
+example, the persons and the groups) run at the same time in a pool of processes.
+
+A stage depends on another stage if it reads a file that the other stage writes.
+For example, the rsci_place staging table reads the IMPORT_RSCI_PLACES_CSV made by
+places.prepare_rsci_place_data, which in turn reads the IMPORT_PLACES_CSV made by
+places.prepare_save_geo_data.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import scheduler
+report = scheduler.run_etl_stages()
+
+"""
+
+
+def make_entity_stages(raw_path=general_configs.RAW_IMPORT_CSV):
+    """Makes the stages that prepare entity data (and save them as CSV files) from the raw data"""
+    return [
+        {
+            'name': 'places',
+            'func': places.prepare_save_geo_data,
+            'kwargs': {'raw_path': raw_path, 'save_path': general_configs.IMPORT_PLACES_CSV},
+            'inputs': [raw_path],
+            'outputs': [general_configs.IMPORT_PLACES_CSV],
+        },
+        {
+            'name': 'rsci_places',
+            'func': places.prepare_rsci_place_data,
+            'kwargs': {
+                'raw_path': raw_path,
+                'geo_path': general_configs.IMPORT_PLACES_CSV,
+                'rsci_geo_path': general_configs.IMPORT_RSCI_PLACES_CSV,
+            },
+            'inputs': [raw_path, general_configs.IMPORT_PLACES_CSV],
+            'outputs': [general_configs.IMPORT_RSCI_PLACES_CSV],
+        },
+        {
+            'name': 'groups',
+            'func': groups.prepare_save_groups_data,
+            'kwargs': {'raw_path': raw_path, 'save_path': general_configs.IMPORT_RAW_GROUP_CSV},
+            'inputs': [raw_path],
+            'outputs': [general_configs.IMPORT_RAW_GROUP_CSV],
+        },
+        {
+            'name': 'rsci_group_safety',
+            'func': groups.prepare_rsci_group_safety_data,
+            'kwargs': {
+                'raw_path': raw_path,
+                'rsci_safety_path': general_configs.IMPORT_RSCI_GROUPS_SAFTEY_CSV,
+            },
+            'inputs': [raw_path],
+            'outputs': [general_configs.IMPORT_RSCI_GROUPS_SAFTEY_CSV],
+        },
+        {
+            'name': 'persons',
+            'func': persons.prepare_save_persons_data,
+            'kwargs': {'raw_path': raw_path, 'save_path': general_configs.IMPORT_RAW_PERSON_CSV},
+            'inputs': [raw_path],
+            'outputs': [general_configs.IMPORT_RAW_PERSON_CSV],
+        },
+        {
+            'name': 'sets',
+            'func': sets.prepare_save_sets_data,
+            'kwargs': {'raw_path': raw_path, 'save_path': general_configs.IMPORT_RAW_SET_CSV},
+            'inputs': [],
+            'outputs': [general_configs.IMPORT_RAW_SET_CSV],
+        },
+        {
+            'name': 'prov_acts',
+            'func': prov_acts.prepare_save_prov_acts_data,
+            'kwargs': {
+                'raw_path': raw_path,
+                'persons_path': general_configs.IMPORT_RAW_PERSON_CSV,
+                'groups_path': general_configs.IMPORT_RAW_GROUP_CSV,
+                'save_path': general_configs.IMPORT_RAW_PROV_ACT_CSV,
+            },
+            'inputs': [
+                raw_path,
+                general_configs.IMPORT_RAW_PERSON_CSV,
+                general_configs.IMPORT_RAW_GROUP_CSV,
+            ],
+            'outputs': [general_configs.IMPORT_RAW_PROV_ACT_CSV],
+        },
+    ]
+
+
+def make_staging_stages(
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    staging_kwargs=None,
+):
+    """Makes a stage to prepare and load the staging table of each mapping config"""
+    stages = []
+    for configs in all_configs:
+        kwargs = {
+            'raw_path': raw_path,
+            'all_configs': [configs],
+        }
+        kwargs.update(staging_kwargs or {})
+        stages.append(
+            {
+                'name': f"stage:{configs.get('staging_table')}",
+                'func': ref_collection.prepare_all_transformed_data,
+                'kwargs': kwargs,
+                'inputs': [configs.get('load_path') or raw_path],
+                'outputs': [],
+            }
+        )
+    return stages
+
+
+def make_stage_dependencies(stages):
+    """Makes a dict of stage name -> list of the names of the stages it depends on"""
+    output_stages = {}
+    for stage in stages:
+        for output in stage.get('outputs', []):
+            output_stages[output] = stage.get('name')
+    dependencies = {}
+    for stage in stages:
+        deps = []
+        for act_input in stage.get('inputs', []):
+            dep = output_stages.get(act_input)
+            if dep and dep != stage.get('name') and dep not in deps:
+                deps.append(dep)
+        dependencies[stage.get('name')] = deps
+    return dependencies
+
+
+def count_result_rows(result):
+    """Counts the rows in the result of a stage function"""
+    if result is None:
+        return None
+    if isinstance(result, dict):
+        # The staging stages return a dict of staging table -> dataframe (or row count).
+        return sum([v if isinstance(v, int) else len(v.index) for v in result.values()])
+    return len(result.index)
+
+
+def run_stage(func, kwargs):
+    """Runs a stage function (in a worker process) and returns a summary of the run
+
+    We only send back a summary, because sending dataframes between processes is slow.
+    """
+    start = time.time()
+    result = func(**kwargs)
+    end = time.time()
+    return {
+        'start': start,
+        'end': end,
+        'seconds': end - start,
+        'rows': count_result_rows(result),
+    }
+
+
+def get_critical_path(dependencies, stage_seconds):
+    """Gets the chain of dependent stages with the longest total run time"""
+    finish = {}
+    prior = {}
+
+    def get_finish(name):
+        if name in finish:
+            return finish[name]
+        best_dep = None
+        best_dep_finish = 0.0
+        for dep in dependencies.get(name, []):
+            dep_finish = get_finish(dep)
+            if best_dep is None or dep_finish > best_dep_finish:
+                best_dep = dep
+                best_dep_finish = dep_finish
+        prior[name] = best_dep
+        finish[name] = best_dep_finish + stage_seconds.get(name, 0.0)
+        return finish[name]
+
+    if not stage_seconds:
+        return [], 0.0
+    last = max(stage_seconds.keys(), key=get_finish)
+    path = []
+    act = last
+    while act is not None:
+        path.append(act)
+        act = prior.get(act)
+    path.reverse()
+    return path, finish[last]
+
+
+def init_worker():
+    """Drops the database engines a worker process inherits from its (forked) parent,
+    so the worker makes its own connections rather than sharing the parent's pooled
+    connections
+    """
+    for engine in utilities.DB_ENGINES.values():
+        # close=False leaves the parent's connections open for the parent.
+        engine.dispose(close=False)
+    utilities.DB_ENGINES.clear()
+
+
+def run_stages(stages, max_workers=None):
+    """Runs stages in a process pool, starting each stage once its dependencies are done
+
+    Returns a report dict with the summary of each stage, the total wall time, and
+    the critical path (the chain of dependent stages that took the longest).
+    """
+    dependencies = make_stage_dependencies(stages)
+    stages_by_name = {stage.get('name'): stage for stage in stages}
+    pending = list(stages_by_name.keys())
+    done = {}
+    running = {}
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+        while pending or running:
+            ready = [
+                name for name in pending
+                if all([dep in done for dep in dependencies.get(name, [])])
+            ]
+            for name in ready:
+                pending.remove(name)
+                stage = stages_by_name[name]
+                print(f'Starting stage: {name}')
+                future = executor.submit(run_stage, stage.get('func'), stage.get('kwargs', {}))
+                running[future] = name
+            if not running:
+                raise ValueError(f'Stages with circular dependencies: {pending}')
+            finished, _ = concurrent.futures.wait(
+                running.keys(),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    done[name] = future.result()
+                except Exception:
+                    for other_future in running:
+                        other_future.cancel()
+                    print(f'Stage failed: {name}')
+                    raise
+                print(f"Finished stage: {name} in {done[name]['seconds']:.2f} seconds")
+    wall_seconds = time.time() - start
+    stage_seconds = {name: summary['seconds'] for name, summary in done.items()}
+    critical_path, critical_path_seconds = get_critical_path(dependencies, stage_seconds)
+    print(f'Ran {len(done)} stages in {wall_seconds:.2f} seconds')
+    print(f"Critical path ({critical_path_seconds:.2f} seconds): {' -> '.join(critical_path)}")
+    return {
+        'stages': {
+            name: dict(summary, dependencies=dependencies.get(name, []))
+            for name, summary in done.items()
+        },
+        'wall_seconds': wall_seconds,
+        'critical_path': critical_path,
+        'critical_path_seconds': critical_path_seconds,
+    }
+
+
+def run_etl_stages(
+    all_configs=general_configs.ALL_MAPPING_CONFIGS,
+    raw_path=general_configs.RAW_IMPORT_CSV,
+    max_workers=None,
+    staging_kwargs=None,
+    include_entity_stages=True,
+):
+    """Prepares the entity data and all the staging tables, running independent stages
+    in parallel
+
+    The staging_kwargs (for example {'loader': 'copy'}) get passed to
+    ref_collection.prepare_all_transformed_data for each staging table.
+    """
+    stages = []
+    if include_entity_stages:
+        stages += make_entity_stages(raw_path=raw_path)
+    stages += make_staging_stages(
+        all_configs=all_configs,
+        raw_path=raw_path,
+        staging_kwargs=staging_kwargs,
+    )
+    return run_stages(stages, max_workers=max_workers)
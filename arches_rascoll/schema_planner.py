@@ -0,0 +1,66 @@
+from arches_rascoll import mapping_plans
+
+"""
+Plans the columns (and their SQLAlchemy data types) of a staging table directly from
+a mapping config, without transforming any data. These plans come from the compiled
+mapping config (see: mapping_plans), so they follow the same naming rules as
+ref_collection.prep_transformed_data.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import general_configs, schema_planner
+col_data_types = schema_planner.plan_staging_col_data_types(general_configs.RSCI_MAPPING_CONFIGS)
+
+"""
+
+
+def plan_staging_col_data_types(configs):
+    """Plans the col_data_types for all the staging columns that the configs can make
+
+    As with the transform, if more than one mapping makes the same column, the data type
+    of the last one wins.
+    """
+    col_data_types = {}
+    for mapping in mapping_plans.compile_staging_plan(configs).mappings:
+        for col, data_type, _ in mapping.staging_columns:
+            col_data_types[col] = data_type
+    return col_data_types
+
+
+def plan_staging_columns(configs):
+    """Plans the order of the staging columns, as the transform would order them if the
+    first row had values for every column"""
+    # The transform writes the tile_other_fields and the tileid of a mapping before
+    # its main value.
+    slot_order = ['other', 'tileid', 'targ', 'default', 'related_objs', 'tile_data']
+    cols = []
+    for mapping in mapping_plans.compile_staging_plan(configs).mappings:
+        # The staging columns of a mapping are (column, data_type, slot) tuples.
+        mapping_cols = sorted(
+            mapping.staging_columns,
+            key=lambda col_tup: slot_order.index(col_tup[2]),
+        )
+        for col, _, _ in mapping_cols:
+            if col not in cols:
+                cols.append(col)
+    return cols
+
+
+def plan_staging_schema(configs):
+    """Plans the staging columns (in order) with their data types"""
+    col_data_types = plan_staging_col_data_types(configs)
+    return {col: col_data_types[col] for col in plan_staging_columns(configs)}
+
+
+def get_col_data_types_for_columns(configs, cols):
+    """Gets the planned col_data_types for the columns of an existing staging dataset
+
+    Returns None if some of the columns are not in the plan, for example if the staging
+    dataset was prepared with an older version of the configs.
+    """
+    col_data_types = plan_staging_col_data_types(configs)
+    unknown_cols = [col for col in cols if col not in col_data_types]
+    if unknown_cols:
+        print(f'Columns not planned by the configs: {unknown_cols}')
+        return None
+    return {col: col_data_types[col] for col in cols}
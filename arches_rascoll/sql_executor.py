@@ -0,0 +1,235 @@
+import os
+import time
+
+from sqlalchemy.sql import text
+
+from arches_rascoll import delta as raw_delta
+from arches_rascoll import general_configs
+from arches_rascoll import ref_collection
+from arches_rascoll import utilities
+
+"""
+Executes the SQL statements that load the staging data into Arches, in order, over
+a single pooled database connection. For each statement we record the elapsed time
+and the number of rows affected, so we can see where the load time goes.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import general_configs
+from arches_rascoll import sql_executor
+records = sql_executor.execute_all_sql_inserts(per_model_transactions=True)
+
+# Or, to commit the inserts in batches of staging resourceinstanceids:
+records = sql_executor.execute_all_sql_inserts(batch_size=general_configs.SQL_BATCH_SIZE)
+
+"""
+
+SQL_EXECUTION_REPORT_FILENAME = 'etl_sql_execution.json'
+
+
+def get_sql_summary(sql, max_len=120):
+    """Gets a short, single line summary of a SQL statement"""
+    summary = ' '.join(sql.split())
+    if len(summary) > max_len:
+        summary = summary[:max_len] + '...'
+    return summary
+
+
+def group_steps_by_model(steps):
+    """Groups consecutive steps that belong to the same model"""
+    step_groups = []
+    for step in steps:
+        if step_groups and step_groups[-1][0].get('model') == step.get('model'):
+            step_groups[-1].append(step)
+            continue
+        step_groups.append([step])
+    return step_groups
+
+
+def make_step_record(step, step_i, status='ok'):
+    """Makes a record (to report) for the execution of a SQL step"""
+    return {
+        'step': step_i,
+        'kind': step.get('kind'),
+        'model': step.get('model'),
+        'staging_table': step.get('staging_table'),
+        'targ_table': step.get('targ_table'),
+        'sql_summary': get_sql_summary(step.get('sql')),
+        'status': status,
+        'rowcount': None,
+        'seconds': None,
+    }
+
+
+def execute_step(con, step, step_i):
+    """Executes a single SQL step on a connection, and returns a record of the execution"""
+    start = time.time()
+    result = con.execute(text(step.get('sql')))
+    record = make_step_record(step, step_i)
+    record['seconds'] = time.time() - start
+    record['rowcount'] = result.rowcount
+    return record
+
+
+class BatchExecutionError(Exception):
+    """Raised when a batch fails, with the record of the batches already committed"""
+
+    def __init__(self, record):
+        super().__init__(f"Failed after {record.get('batches')} committed batches")
+        self.record = record
+
+
+def get_batch_starts(con, step, batch_size, batch_starts_cache):
+    """Gets the first staging resourceinstanceid of each batch for a step"""
+    batch_starts_sql = step.get('batch_starts_sql')
+    if batch_starts_sql not in batch_starts_cache:
+        with con.begin():
+            result = con.execute(text(batch_starts_sql), {'batch_size': batch_size})
+            batch_starts_cache[batch_starts_sql] = [str(row[0]) for row in result]
+    return batch_starts_cache[batch_starts_sql]
+
+
+def execute_batched_step(con, step, step_i, batch_size, batch_starts_cache):
+    """Executes a SQL step in batches of staging resourceinstanceid ranges, committing
+    each batch, and returns a record of the execution
+    """
+    start = time.time()
+    record = make_step_record(step, step_i)
+    record['rowcount'] = 0
+    record['batches'] = 0
+    batch_starts = get_batch_starts(con, step, batch_size, batch_starts_cache)
+    for i, batch_from in enumerate(batch_starts):
+        batch_before = None
+        if (i + 1) < len(batch_starts):
+            batch_before = batch_starts[i + 1]
+        try:
+            with con.begin():
+                result = con.execute(
+                    text(step.get('batch_sql')),
+                    {'batch_from': batch_from, 'batch_before': batch_before},
+                )
+        except Exception:
+            # The earlier batches are already committed.
+            record['seconds'] = time.time() - start
+            raise BatchExecutionError(record)
+        record['rowcount'] += max(result.rowcount, 0)
+        record['batches'] += 1
+    record['seconds'] = time.time() - start
+    return record
+
+
+def save_execution_report(records, sql_path=general_configs.ARCHES_INSERT_SQL_PATH):
+    """Saves the execution records as JSON next to the saved SQL statements"""
+    report_dir = os.path.dirname(sql_path)
+    utilities.save_serialized_json(report_dir, SQL_EXECUTION_REPORT_FILENAME, records)
+    return os.path.join(report_dir, SQL_EXECUTION_REPORT_FILENAME)
+
+
+def execute_sql_steps(
+    steps,
+    db_url=general_configs.ARCHES_DB_URL,
+    per_model_transactions=False,
+    batch_size=None,
+    sql_path=general_configs.ARCHES_INSERT_SQL_PATH,
+):
+    """Executes SQL steps in order over one pooled connection
+
+    If per_model_transactions is True, consecutive steps for the same model run in one
+    transaction (so an error rolls back all the loading for that model). Otherwise,
+    each statement gets committed on its own. If a batch_size is given, the steps
+    that have a batch_sql run in batches of batch_size staging resourceinstanceids,
+    with a commit after each batch. Returns a list of execution records, which also
+    get saved as JSON next to the saved SQL statements.
+    """
+    if per_model_transactions and batch_size:
+        raise ValueError('Batches get committed one at a time, so they cannot run in per model transactions')
+    if per_model_transactions:
+        step_groups = group_steps_by_model(steps)
+    else:
+        step_groups = [[step] for step in steps]
+    engine = utilities.get_engine(db_url)
+    records = []
+    batch_starts_cache = {}
+    step_i = 0
+    try:
+        with engine.connect() as con:
+            for step_group in step_groups:
+                group_records = []
+                try:
+                    if batch_size and step_group[0].get('batch_sql'):
+                        step_i += 1
+                        record = execute_batched_step(con, step_group[0], step_i, batch_size, batch_starts_cache)
+                        group_records.append(record)
+                        print(
+                            f"[{step_i}/{len(steps)}] {record['rowcount']} rows in {record['batches']} batches "
+                            f"in {record['seconds']:.2f} seconds: {record['sql_summary'][:60]}"
+                        )
+                        records += group_records
+                        continue
+                    with con.begin():
+                        for step in step_group:
+                            step_i += 1
+                            record = execute_step(con, step, step_i)
+                            group_records.append(record)
+                            print(
+                                f"[{step_i}/{len(steps)}] {record['rowcount']} rows "
+                                f"in {record['seconds']:.2f} seconds: {record['sql_summary'][:60]}"
+                            )
+                except BatchExecutionError as e:
+                    error_record = e.record
+                    error_record['status'] = 'error'
+                    error_record['error'] = str(e.__context__)
+                    records.append(error_record)
+                    raise
+                except Exception as e:
+                    for record in group_records:
+                        # These got rolled back with the rest of the transaction.
+                        record['status'] = 'rolled_back'
+                    records += group_records
+                    failed_step = step_group[min(len(group_records), len(step_group) - 1)]
+                    error_record = make_step_record(failed_step, step_i, status='error')
+                    error_record['error'] = str(e)
+                    records.append(error_record)
+                    raise
+                records += group_records
+    finally:
+        report_path = save_execution_report(records, sql_path=sql_path)
+        total_seconds = sum([r.get('seconds') or 0 for r in records])
+        print(f'Executed {len(records)} SQL statements in {total_seconds:.2f} seconds, see: {report_path}')
+    return records
+
+
+def execute_all_sql_inserts(
+    db_url=general_configs.ARCHES_DB_URL,
+    per_model_transactions=False,
+    batch_size=None,
+    delta=False,
+    sql_path=general_configs.ARCHES_INSERT_SQL_PATH,
+    data_dir=None,
+    **kwargs,
+):
+    """Prepares (and saves) the SQL statements to load the staging data into Arches,
+    then executes them
+
+    If delta is True, the SQL also updates the tiles of changed records, and once the
+    SQL succeeds, the raw data snapshot gets updated (see: delta.commit_raw_snapshot)
+    in the data_dir (by default, the general_configs.DATA_DIR that the delta got
+    staged from). The SQL gets saved to the sql_path, with the execution report next
+    to it. The kwargs get passed to ref_collection.make_sql_insert_steps.
+    """
+    if delta:
+        kwargs['add_update_sqls'] = True
+    steps = ref_collection.make_sql_insert_steps(**kwargs)
+    utilities.save_sql([step.get('sql') for step in steps], file_path=sql_path)
+    records = execute_sql_steps(
+        steps,
+        db_url=db_url,
+        per_model_transactions=per_model_transactions,
+        batch_size=batch_size,
+        sql_path=sql_path,
+    )
+    if delta:
+        if data_dir is None:
+            data_dir = general_configs.DATA_DIR
+        raw_delta.commit_raw_snapshot(data_dir=data_dir)
+    return records
@@ -0,0 +1,274 @@
+import json
+
+import pandas as pd
+
+from arches_rascoll import general_configs
+from arches_rascoll import json_encoding
+from arches_rascoll import utilities
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Without pyarrow, staging data can only be saved as CSV.
+    pa = None
+    pq = None
+
+"""
+Saves and loads the staging data that ref_collection prepares for each staging table
+(the "staging artifacts" in the DATA_DIR), which cached runs reload rather than
+transforming the data again.
+
+Staging data can be saved as CSV (with the JSON objects and UUID arrays as JSON
+strings, which is easy to look at) or as Parquet. Parquet keeps the UUID arrays as
+lists of strings, and the JSON objects as nested (struct or list) values whenever
+that gives back exactly the same objects. Otherwise, a JSON column gets saved as
+JSON strings, which we parse a whole column at a time when we load it. The PostgreSQL
+type of each column is saved in the Parquet metadata.
+
+# Use like this in a Python shell:
+
+from arches_rascoll import ref_collection
+dfs = ref_collection.prepare_all_transformed_data(artifact_format='parquet')
+
+"""
+
+STAGING_ARTIFACT_EXTENSIONS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+}
+
+# The key of our metadata in the Parquet schema metadata.
+PARQUET_METADATA_KEY = b'arches_rascoll'
+
+# The PostgreSQL types of staging columns that hold JSON objects or lists, which we
+# load with an empty string (not NaN) for missing values (like make_objs_from_json_strings).
+OBJECT_SQL_TYPES = ['jsonb', 'uuid[]']
+
+
+def check_artifact_format(artifact_format):
+    """Checks that we can save staging data in an artifact format"""
+    if artifact_format not in STAGING_ARTIFACT_EXTENSIONS:
+        raise ValueError(
+            f'Unknown staging artifact format: {artifact_format}, '
+            f'use one of: {list(STAGING_ARTIFACT_EXTENSIONS.keys())}'
+        )
+    if artifact_format == 'parquet' and pa is None:
+        raise ValueError('Saving staging data as Parquet needs pyarrow (pip install pyarrow)')
+
+
+def make_geometry_format_suffix(configs):
+    """Makes the artifact name suffix for configs that stage geometries in a format
+    other than GeoJSON (like '_ewkb'), so staging data saved with one geometry format
+    never gets used for another
+    """
+    if not configs:
+        return ''
+    geometry_formats = sorted(
+        {
+            mapping.get('staging_geometry_format')
+            for mapping in configs.get('mappings', [])
+            if mapping.get('staging_geometry_format')
+        }
+    )
+    return ''.join([f'_{geometry_format}' for geometry_format in geometry_formats])
+
+
+def make_staging_artifact_path(
+    staging_table,
+    artifact_format=general_configs.STAGING_ARTIFACT_FORMAT,
+    data_dir=general_configs.DATA_DIR,
+    suffix='',
+    configs=None,
+):
+    """Makes the path of the saved staging data for a staging table
+
+    If the configs are given, the path also gets the suffix for their geometry
+    format (see: make_geometry_format_suffix).
+    """
+    check_artifact_format(artifact_format)
+    extension = STAGING_ARTIFACT_EXTENSIONS[artifact_format]
+    suffix = f'{make_geometry_format_suffix(configs)}{suffix}'
+    return utilities.make_full_path_filename(data_dir, f'{staging_table}{suffix}{extension}')
+
+
+def is_parquet_path(path):
+    """Checks if a staging artifact path is a Parquet file"""
+    return path.endswith(STAGING_ARTIFACT_EXTENSIONS['parquet'])
+
+
+def make_uuid_list(value):
+    """Makes a list of UUID strings from a staging uuid[] value"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return [str(v) for v in value]
+
+
+def make_scalar_arrow_array(values, sql_type):
+    """Makes an Arrow array for the values of a (non JSON) staging column"""
+    if sql_type == 'integer':
+        return pa.array([None if utilities.is_missing_value(v) else int(v) for v in values], type=pa.int64())
+    if sql_type == 'float':
+        return pa.array([None if utilities.is_missing_value(v) else float(v) for v in values], type=pa.float64())
+    # UUIDs and timestamps are staged as strings, and get cast by PostgreSQL.
+    return pa.array([None if utilities.is_missing_value(v) else str(v) for v in values], type=pa.string())
+
+
+def collect_json_key_sets(value, key_sets, path=''):
+    """Collects the distinct key sets of the dicts at each path within a JSON value"""
+    if isinstance(value, dict):
+        key_sets.setdefault(path, set()).add(tuple(value.keys()))
+        for key, act_value in value.items():
+            collect_json_key_sets(act_value, key_sets, f'{path}.{key}')
+    elif isinstance(value, list):
+        for act_value in value:
+            collect_json_key_sets(act_value, key_sets, f'{path}[]')
+
+
+def has_uniform_json_keys(values):
+    """Checks if all the dicts at the same path within JSON values have the same keys
+
+    Otherwise (for example, with dicts keyed by UUIDs), Arrow would make a struct field
+    for every key in the column, which is very slow and big.
+    """
+    key_sets = {}
+    for value in values:
+        collect_json_key_sets(value, key_sets)
+        for act_key_sets in key_sets.values():
+            if len(act_key_sets) > 1:
+                return False
+    return True
+
+
+def make_json_arrow_array(values, json_as_text=False, json_values=None):
+    """Makes an Arrow array for the values of a JSON staging column
+
+    The json_values are the values already encoded as JSON strings (see:
+    json_encoding.encode_json_columns), if we have them. Returns the array and True
+    if the values got saved as JSON strings.
+    """
+    values = [None if utilities.is_missing_value(v) else v for v in values]
+    if json_values is None:
+        json_values = json_encoding.encode_json_values(values)
+    if not json_as_text and has_uniform_json_keys(values):
+        try:
+            arrow_values = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            arrow_values = None
+        # Structs get a field for every key in the column, so dicts with different
+        # keys would come back with extra None values (and mixed ints and floats come
+        # back as floats). Only use the nested values if they give back the same JSON.
+        if arrow_values is not None:
+            if json_encoding.encode_json_values(arrow_values.to_pylist()) == json_values:
+                return arrow_values, False
+    return pa.array(json_values, type=pa.string()), True
+
+
+def make_staging_arrow_table(df_stage, col_data_types, json_as_text=False, df_encoded=None):
+    """Makes an Arrow table (with our metadata) from a staging dataframe
+
+    If json_as_text is True, all the JSON columns get saved as JSON strings, so the
+    schema only depends on the col_data_types (as it must when we write chunks).
+    The df_encoded has the JSON columns already encoded, if we have it.
+    """
+    arrays = []
+    col_sql_types = {}
+    json_text_cols = []
+    for col in df_stage.columns.tolist():
+        sql_type = 'text'
+        if col_data_types.get(col) is not None:
+            sql_type = utilities.lookup_data_type_sql_str(col_data_types.get(col))
+        col_sql_types[col] = sql_type
+        values = df_stage[col].tolist()
+        if sql_type == 'jsonb':
+            json_values = None
+            if df_encoded is not None:
+                json_values = df_encoded[col].tolist()
+            arrow_values, is_json_text = make_json_arrow_array(
+                values,
+                json_as_text=json_as_text,
+                json_values=json_values,
+            )
+            if is_json_text:
+                json_text_cols.append(col)
+        elif sql_type == 'uuid[]':
+            arrow_values = pa.array(
+                [None if utilities.is_missing_value(v) else make_uuid_list(v) for v in values],
+                type=pa.list_(pa.string()),
+            )
+        else:
+            arrow_values = make_scalar_arrow_array(values, sql_type)
+        arrays.append(arrow_values)
+    metadata = {
+        'col_sql_types': col_sql_types,
+        'json_text_cols': json_text_cols,
+    }
+    return pa.Table.from_arrays(
+        arrays,
+        names=df_stage.columns.tolist(),
+        metadata={PARQUET_METADATA_KEY: json.dumps(metadata)},
+    )
+
+
+def load_json_text_values(values):
+    """Parses a list of JSON strings (or None) with one json.loads call"""
+    json_list = '[' + ','.join(['null' if v is None else v for v in values]) + ']'
+    return json.loads(json_list)
+
+
+def make_staging_df_from_arrow_table(table, metadata=None):
+    """Makes a staging dataframe from an Arrow table saved by make_staging_arrow_table"""
+    if metadata is None:
+        metadata = json.loads(table.schema.metadata[PARQUET_METADATA_KEY])
+    col_sql_types = metadata.get('col_sql_types', {})
+    json_text_cols = metadata.get('json_text_cols', [])
+    data = {}
+    for col in table.column_names:
+        sql_type = col_sql_types.get(col, 'text')
+        if sql_type not in OBJECT_SQL_TYPES:
+            data[col] = table.column(col).to_pandas()
+            continue
+        values = table.column(col).to_pylist()
+        if col in json_text_cols:
+            values = load_json_text_values(values)
+        data[col] = pd.Series([('' if v is None else v) for v in values], dtype=object)
+    return pd.DataFrame(data, columns=table.column_names)
+
+
+def save_staging_parquet(df_stage, col_data_types, path, df_encoded=None):
+    """Saves a staging dataframe as a Parquet file"""
+    check_artifact_format('parquet')
+    pq.write_table(make_staging_arrow_table(df_stage, col_data_types, df_encoded=df_encoded), path)
+
+
+def load_staging_parquet(path):
+    """Loads a staging dataframe from a Parquet file"""
+    check_artifact_format('parquet')
+    return make_staging_df_from_arrow_table(pq.read_table(path))
+
+
+def get_staging_parquet_columns(path):
+    """Gets the column names of a staging Parquet file, without reading the data"""
+    check_artifact_format('parquet')
+    return pq.read_schema(path).names
+
+
+def write_staging_parquet_chunk(writer, df_stage, col_data_types, path, df_encoded=None):
+    """Writes a chunk of staging data to a Parquet file, opening a writer for the
+    first chunk. Returns the writer, which the caller needs to close
+    """
+    check_artifact_format('parquet')
+    table = make_staging_arrow_table(df_stage, col_data_types, json_as_text=True, df_encoded=df_encoded)
+    if writer is None:
+        writer = pq.ParquetWriter(path, table.schema)
+    writer.write_table(table)
+    return writer
+
+
+def iter_staging_parquet_chunks(path, chunksize=general_configs.STAGING_CHUNK_SIZE):
+    """Yields staging dataframes of up to chunksize rows from a Parquet file"""
+    check_artifact_format('parquet')
+    parquet_file = pq.ParquetFile(path)
+    metadata = json.loads(parquet_file.schema_arrow.metadata[PARQUET_METADATA_KEY])
+    for batch in parquet_file.iter_batches(batch_size=chunksize):
+        yield make_staging_df_from_arrow_table(pa.Table.from_batches([batch]), metadata=metadata)
@@ -1,6 +1,8 @@
 import codecs
 import copy
 import datetime
+import hashlib
+import itertools
 import json
 import os
 import uuid as GenUUID
@@ -10,7 +12,7 @@ import pandas as pd
 
 from shapely.geometry import mapping, shape
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.sql import text
 from sqlalchemy.types import JSON, Float, Text, DateTime, Integer
 from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
@@ -18,6 +20,118 @@ from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
 from arches_rascoll import general_configs
 
 
+def normalize_key(value):
+    """Normalizes a natural key value (like a name) so trivial differences in case and
+    whitespace make the same key
+    """
+    return ' '.join(str(value).split()).lower()
+
+
+def drop_duplicate_names(df, name_col):
+    """Drops the entities with names that only differ in case or whitespace from the
+    name of an earlier entity. These make the same (normalized name) key, so with
+    DETERMINISTIC_UUIDS they would make the same UUID. The first of them wins.
+    """
+    if df.empty:
+        return df
+    keys = df[name_col].map(normalize_key, na_action='ignore')
+    dup_index = keys.notnull() & keys.duplicated(keep='first')
+    if dup_index.any():
+        print(f'Dropping {dup_index.sum()} {name_col} values that only differ in case or whitespace')
+    return df[~dup_index].copy()
+
+
+def make_uuid(*keys):
+    """Makes a new UUID string
+
+    If general_configs.DETERMINISTIC_UUIDS is True, this is a UUIDv5 made from the
+    general_configs.UUID_NAMESPACE and the natural keys, so the same keys always
+    make the same UUID. Otherwise, this is a random UUIDv4.
+    """
+    if not general_configs.DETERMINISTIC_UUIDS:
+        return str(GenUUID.uuid4())
+    name = '|'.join([str(key) for key in keys])
+    return str(GenUUID.uuid5(GenUUID.UUID(general_configs.UUID_NAMESPACE), name))
+
+
+# The positions of the hex digits in a UUID string (between the dashes).
+UUID_HEX_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype='S1')
+
+
+def format_uuid_bytes(uuid_bytes):
+    """Formats an (n, 16) numpy array of UUID bytes as a list of n UUID strings"""
+    count = uuid_bytes.shape[0]
+    chars = np.full((count, 36), b'-', dtype='S1')
+    hex_chars = np.empty((count, 32), dtype='S1')
+    hex_chars[:, 0::2] = HEX_DIGITS[uuid_bytes >> 4]
+    hex_chars[:, 1::2] = HEX_DIGITS[uuid_bytes & 0x0F]
+    chars[:, UUID_HEX_POSITIONS] = hex_chars
+    return chars.view('S36').ravel().astype(str).tolist()
+
+
+def make_uuids(count, *keys):
+    """Makes a list of count new UUID strings, in one batch
+
+    Like make_uuid, but each key is either a single value for all the UUIDs or a
+    list (or array) with a value for each UUID. With general_configs.DETERMINISTIC_UUIDS,
+    the UUIDs are the same as make_uuid would make from each row of keys.
+    """
+    if not general_configs.DETERMINISTIC_UUIDS:
+        digests = os.urandom(16 * count)
+        version = 4
+    else:
+        key_cols = []
+        for key in keys:
+            if isinstance(key, (list, tuple, np.ndarray)):
+                key_cols.append([str(v) for v in key])
+            else:
+                key_cols.append(itertools.repeat(str(key), count))
+        names = ['|'.join(row_keys) for row_keys in zip(*key_cols)] if key_cols else [''] * count
+        namespace_bytes = GenUUID.UUID(general_configs.UUID_NAMESPACE).bytes
+        digests = b''.join(
+            [hashlib.sha1(namespace_bytes + name.encode('utf-8')).digest()[:16] for name in names]
+        )
+        version = 5
+    uuid_bytes = np.frombuffer(digests, dtype=np.uint8).reshape(count, 16).copy()
+    # Set the version and the (RFC 4122) variant bits, as uuid.UUID does.
+    uuid_bytes[:, 6] = (uuid_bytes[:, 6] & 0x0F) | (version << 4)
+    uuid_bytes[:, 8] = (uuid_bytes[:, 8] & 0x3F) | 0x80
+    return format_uuid_bytes(uuid_bytes)
+
+
+def make_lookup_index(df, key_col, value_col):
+    """Makes a dict index of key -> value from the rows of a lookup dataframe
+
+    Rows that repeat a key with the same value (like a configured group that is also
+    in the raw data) get collapsed. Raises a ValueError if a key has different
+    values, since that would make the lookup ambiguous.
+    """
+    df_keys = df[df[key_col].notnull()][[key_col, value_col]].drop_duplicates()
+    dup_index = df_keys[key_col].duplicated(keep=False)
+    if dup_index.any():
+        dup_keys = df_keys[dup_index][key_col].unique().tolist()
+        raise ValueError(f'{key_col} values with different {value_col} values in lookup data: {dup_keys[:10]}')
+    return dict(zip(df_keys[key_col].tolist(), df_keys[value_col].tolist()))
+
+
+def lookup_values(series, lookup_index, missing_value=''):
+    """Looks up the values of a series in a lookup index (like Series.map), using
+    missing_value for values not in the index
+    """
+    values = series.map(lookup_index)
+    return values.where(values.notnull(), missing_value)
+
+
+def is_missing_value(value):
+    """Checks if a staging value is missing (None, NaN or the empty string sentinel)"""
+    if isinstance(value, (list, dict)):
+        return False
+    if isinstance(value, str):
+        return value == ''
+    return pd.isnull(value)
+
+
 def make_full_path_filename(path, filename):
     """ makes a full filepath and file name string """
     os.makedirs(path, exist_ok=True)
@@ -40,9 +154,13 @@ def save_serialized_json(path, filename, dict_obj):
         indent=4,
         ensure_ascii=False,
     )
-    file = codecs.open(dir_file, 'w', 'utf-8')
+    # Write a temporary file, then replace the file with it, so readers never see a
+    # half written file.
+    temp_file = f'{dir_file}.{os.getpid()}.tmp'
+    file = codecs.open(temp_file, 'w', 'utf-8')
     file.write(json_output)
     file.close()
+    os.replace(temp_file, dir_file)
 
 
 def save_sql(sqls, file_path=general_configs.ARCHES_INSERT_SQL_PATH):
@@ -53,9 +171,23 @@ def save_sql(sqls, file_path=general_configs.ARCHES_INSERT_SQL_PATH):
     return sql_str
 
 
+# SQLAlchemy engines (each with its own connection pool), keyed by database URL.
+DB_ENGINES = {}
+
+
+def get_engine(db_url=general_configs.ARCHES_DB_URL):
+    """Gets a (pooled) SQLAlchemy engine for a database URL, reusing it between calls"""
+    engine = DB_ENGINES.get(db_url)
+    if engine is None:
+        engine = create_engine(db_url, pool_pre_ping=True)
+        DB_ENGINES[db_url] = engine
+    return engine
+
+
 def execute_sql(sql_text, db_url=general_configs.ARCHES_DB_URL):
-    engine = create_engine(db_url)
-    with engine.connect() as con:
+    engine = get_engine(db_url)
+    # Use a transaction block so the statement gets committed.
+    with engine.begin() as con:
         con.execute(text(sql_text))
 
 
@@ -69,6 +201,12 @@ def drop_import_table(tab_name, staging_schema=general_configs.STAGING_SCHEMA_NA
     execute_sql(sql)
 
 
+def staging_table_exists(tab_name, staging_schema=general_configs.STAGING_SCHEMA_NAME, db_url=general_configs.ARCHES_DB_URL):
+    """Checks if a table exists in the staging schema"""
+    engine = get_engine(db_url)
+    return inspect(engine).has_table(tab_name, schema=staging_schema)
+
+
 def lookup_data_type_sql_str(data_type):
     """Maps a SQLAlchemy data type object to a SQL string """
     mapped_data_type = general_configs.DATA_TYPES_SQL.get(data_type)
@@ -0,0 +1,91 @@
+import os
+
+import pandas as pd
+import pytest
+
+from arches_rascoll import benchmarks
+from arches_rascoll import general_configs
+from arches_rascoll import groups
+from arches_rascoll import persons
+from arches_rascoll import places
+from arches_rascoll import prov_acts
+from arches_rascoll import ref_collection
+from arches_rascoll import schema_planner
+from arches_rascoll import sets
+
+"""
+Checks that the columnar transform (see: columnar.py) makes the same staging data
+as the row-by-row reference transform, for each mapping config, on synthetic raw
+data (see: benchmarks.make_synthetic_raw_df). The UUIDs are deterministic, so both
+transforms make the same ones.
+
+# Run like this, from the root of the repo:
+
+python -m pytest tests
+
+"""
+
+SYNTHETIC_RAW_SIZE = 500
+
+
+def make_load_path(path, data_dir):
+    """Makes the path in the test data directory for one of the ETL's data files"""
+    return os.path.join(data_dir, os.path.basename(path))
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    """Saves the entity data that the mapping configs load, made from the synthetic raw data"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(general_configs, 'DETERMINISTIC_UUIDS', True)
+        data_dir = str(tmp_path_factory.mktemp('data'))
+        df = benchmarks.make_synthetic_raw_df(SYNTHETIC_RAW_SIZE)
+        geo_path = make_load_path(general_configs.IMPORT_PLACES_CSV, data_dir)
+        persons_path = make_load_path(general_configs.IMPORT_RAW_PERSON_CSV, data_dir)
+        groups_path = make_load_path(general_configs.IMPORT_RAW_GROUP_CSV, data_dir)
+        places.prep_raw_geo_data(df).to_csv(geo_path, index=False)
+        places.prepare_rsci_place_data(
+            df,
+            geo_path=geo_path,
+            rsci_geo_path=make_load_path(general_configs.IMPORT_RSCI_PLACES_CSV, data_dir),
+        )
+        persons.prepare_save_persons_data(df, save_path=persons_path)
+        groups.prepare_save_groups_data(df=groups.get_groups_from_raw_data(df=df), save_path=groups_path)
+        sets.prepare_save_sets_data(save_path=make_load_path(general_configs.IMPORT_RAW_SET_CSV, data_dir))
+        groups.prepare_rsci_group_safety_data(
+            df,
+            rsci_safety_path=make_load_path(general_configs.IMPORT_RSCI_GROUPS_SAFTEY_CSV, data_dir),
+        )
+        prov_acts.prepare_save_prov_acts_data(
+            df,
+            persons_path=persons_path,
+            groups_path=groups_path,
+            save_path=make_load_path(general_configs.IMPORT_RAW_PROV_ACT_CSV, data_dir),
+        )
+        yield data_dir
+
+
+@pytest.mark.parametrize(
+    'configs',
+    general_configs.ALL_MAPPING_CONFIGS,
+    ids=[configs['staging_table'] for configs in general_configs.ALL_MAPPING_CONFIGS],
+)
+def test_columnar_matches_row_transform(data_dir, configs, monkeypatch):
+    monkeypatch.setattr(general_configs, 'DETERMINISTIC_UUIDS', True)
+    if configs.get('load_path'):
+        configs = dict(configs, load_path=make_load_path(configs['load_path'], data_dir))
+        df = pd.read_csv(configs['load_path'])
+    else:
+        df = benchmarks.make_synthetic_raw_df(SYNTHETIC_RAW_SIZE)
+    df_row, row_col_data_types = ref_collection.prep_transformed_data(df, configs, columnar_mode=False)
+    df_col, col_col_data_types = ref_collection.prep_transformed_data(df, configs, columnar_mode=True)
+    assert len(df_row.index) > 0
+    pd.testing.assert_frame_equal(df_col, df_row)
+    # Both transforms give a data type for each staging column, the one planned
+    # from the config.
+    planned_col_data_types = schema_planner.plan_staging_col_data_types(configs)
+    for col_data_types in [row_col_data_types, col_col_data_types]:
+        assert set(col_data_types.keys()) == set(df_row.columns)
+        for col, data_type in col_data_types.items():
+            assert repr(data_type) == repr(planned_col_data_types[col])
+    assert list(col_col_data_types.items()) == list(row_col_data_types.items())
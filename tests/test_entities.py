@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from arches_rascoll import benchmarks
+from arches_rascoll import general_configs
+from arches_rascoll import groups
+from arches_rascoll import persons
+from arches_rascoll import prov_acts
+from arches_rascoll import ref_collection
+
+"""
+Checks that person and group names that only differ in case or whitespace (which
+make the same deterministic UUID) get staged as one entity, and that the provenance
+activities link all the name variants to it.
+
+# Run like this, from the root of the repo:
+
+python -m pytest tests
+
+"""
+
+
+def make_name_variants_raw_df():
+    """Makes synthetic raw data with case and whitespace variants of a person name
+    and of a configured group name"""
+    df = benchmarks.make_synthetic_raw_df(20)
+    for col in ['Acquired By (CLEAN_1)', 'Acquired By (CLEAN_2)']:
+        df[col] = np.nan
+    df['Acquired By (CLEAN_1)'] = df['Acquired By (CLEAN_1)'].astype(object)
+    df.loc[0, 'Acquired By (CLEAN_1)'] = 'Smith, J.'
+    df.loc[1, 'Acquired By (CLEAN_1)'] = 'smith,  j. '
+    df.loc[2, 'Acquired From (CLEAN_1)'] = general_configs.GROUP_DATA[0]['group_name'].lower()
+    return df
+
+
+def test_name_variants_make_one_entity(tmp_path, monkeypatch):
+    monkeypatch.setattr(general_configs, 'DETERMINISTIC_UUIDS', True)
+    df = make_name_variants_raw_df()
+    persons_path = str(tmp_path / 'persons.csv')
+    groups_path = str(tmp_path / 'groups.csv')
+    df_persons = persons.prepare_save_persons_data(df, save_path=persons_path)
+    assert len(df_persons.index) == 1
+    df_groups = groups.prepare_save_groups_data(
+        df=groups.get_groups_from_raw_data(df=df),
+        save_path=groups_path,
+    )
+    nfpa_index = df_groups['group_name'].str.lower() == general_configs.GROUP_DATA[0]['group_name'].lower()
+    assert df_groups[nfpa_index]['group_uuid'].tolist() == [general_configs.NFPA_GROUP_UUID]
+
+    for configs, load_path in [
+        (general_configs.PERSON_MAPPING_CONFIGS, persons_path),
+        (general_configs.GROUP_MAPPING_CONFIGS, groups_path),
+    ]:
+        configs = dict(configs, load_path=load_path)
+        df_stage, _ = ref_collection.prep_transformed_data(pd.read_csv(load_path), configs)
+        assert df_stage['resourceinstanceid'].is_unique
+
+    df_prov_acts = prov_acts.prepare_save_prov_acts_data(
+        df,
+        persons_path=persons_path,
+        groups_path=groups_path,
+        save_path=str(tmp_path / 'prov_acts.csv'),
+    ).set_index('rsci_uuid')
+    person_uuid = df_persons['person_uuid'].iloc[0]
+    for i in [0, 1]:
+        assert df_prov_acts.loc[df.loc[i, 'rsci_uuid'], 'acq_by_person_1_uuid'] == person_uuid
+    assert df_prov_acts.loc[df.loc[2, 'rsci_uuid'], 'acq_from_group_1_uuid'] == general_configs.NFPA_GROUP_UUID
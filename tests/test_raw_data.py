@@ -0,0 +1,22 @@
+import pytest
+
+from arches_rascoll import benchmarks
+from arches_rascoll import raw_data
+
+"""
+Checks how raw_data.load_raw_data handles a raw data CSV without some of the
+columns the ETL reads.
+
+# Run like this, from the root of the repo:
+
+python -m pytest tests
+
+"""
+
+
+def test_missing_raw_columns_get_named(tmp_path):
+    raw_path = str(tmp_path / 'raw.csv')
+    df = benchmarks.make_synthetic_raw_df(10).drop(columns=['Common Name'])
+    df.to_csv(raw_path, index=False)
+    with pytest.raises(ValueError, match=r"'Common Name' \(used by rsci\)"):
+        raw_data.load_raw_data(raw_path, use_cache=False)
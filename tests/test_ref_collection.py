@@ -0,0 +1,26 @@
+import pandas as pd
+
+from arches_rascoll import ref_collection
+
+"""
+Checks how ref_collection splits staging input data into chunks.
+
+# Run like this, from the root of the repo:
+
+python -m pytest tests
+
+"""
+
+
+def test_iter_df_chunks_keeps_keys_together():
+    df = pd.DataFrame({'pk': ['a', 'b', 'a', 'c', 'b', 'a', 'd'], 'val': range(7)})
+    chunks = list(ref_collection.iter_df_chunks(df, 2, key_col='pk'))
+    assert [chunk['val'].tolist() for chunk in chunks] == [[0, 2, 5], [1, 4], [3, 6]]
+    for i, chunk in enumerate(chunks):
+        for other in chunks[(i + 1):]:
+            assert not set(chunk['pk']) & set(other['pk'])
+
+
+def test_iter_chunks_or_none():
+    df = pd.DataFrame({'pk': []})
+    assert list(ref_collection.iter_chunks_or_none(ref_collection.iter_df_chunks(df, 2))) == [None]
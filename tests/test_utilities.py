@@ -0,0 +1,53 @@
+import uuid as GenUUID
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from arches_rascoll import general_configs
+from arches_rascoll import utilities
+
+"""
+Checks that the batches of UUIDs made by utilities.make_uuids are the same as the
+UUIDs made one at a time by utilities.make_uuid, and how lookup indexes handle
+duplicate keys.
+
+# Run like this, from the root of the repo:
+
+python -m pytest tests
+
+"""
+
+
+def test_make_uuids_matches_make_uuid(monkeypatch):
+    monkeypatch.setattr(general_configs, 'DETERMINISTIC_UUIDS', True)
+    pks = [f'pk-{i}' for i in range(1000)]
+    # Mixed (and non-ASCII) key values, as in the columns of the raw data.
+    rids = np.array([f'ré{i}' if i % 3 else 1.5 for i in range(1000)], dtype=object)
+    batch = utilities.make_uuids(1000, 'rxr', 'rsci', 'pre_', pks, rids)
+    single = [utilities.make_uuid('rxr', 'rsci', 'pre_', pk, rid) for pk, rid in zip(pks, rids)]
+    assert batch == single
+    assert utilities.make_uuids(2) == [utilities.make_uuid()] * 2
+    assert utilities.make_uuids(0, 'rxr', []) == []
+
+
+def test_make_uuids_random(monkeypatch):
+    monkeypatch.setattr(general_configs, 'DETERMINISTIC_UUIDS', False)
+    uuids = utilities.make_uuids(1000, 'rxr')
+    assert len(set(uuids)) == 1000
+    for uuid_str in uuids:
+        assert str(GenUUID.UUID(uuid_str)) == uuid_str
+        assert GenUUID.UUID(uuid_str).version == 4
+
+
+def test_make_lookup_index_duplicates():
+    df = pd.DataFrame(
+        {
+            'group_name': ['NFPA', 'NFPA', 'Acme', None],
+            'group_uuid': ['uuid-1', 'uuid-1', 'uuid-2', 'uuid-3'],
+        }
+    )
+    assert utilities.make_lookup_index(df, 'group_name', 'group_uuid') == {'NFPA': 'uuid-1', 'Acme': 'uuid-2'}
+    df.loc[1, 'group_uuid'] = 'uuid-4'
+    with pytest.raises(ValueError):
+        utilities.make_lookup_index(df, 'group_name', 'group_uuid')